@@ -0,0 +1,53 @@
+"""add_avatar_blobs
+
+Revision ID: a7c3e9d5f1b2
+Revises: c4e8a1f07b2d
+Create Date: 2026-10-19 16:05:12.418205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3e9d5f1b2'
+down_revision: Union[str, Sequence[str], None] = 'c4e8a1f07b2d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Reference counts of content-addressed avatar blobs. Characters keep
+    # their legacy avatar names; ``python -m app.avatar_import`` moves them
+    # into the store (it uses the app's current settings and transcoding)
+    op.create_table(
+        'avatar_blobs',
+        sa.Column('content_hash', sa.String(64), primary_key=True),
+        sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('released_at', sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index('ix_avatar_blobs_released_at', 'avatar_blobs', ['released_at'])
+
+
+def _is_content_key(name: str) -> bool:
+    return len(name) == 64 and all(c in '0123456789abcdef' for c in name)
+
+
+def downgrade() -> None:
+    # Irreversible once a character uses a content key (uploaded or imported):
+    # the code before this revision only serves flat files by name
+    conn = op.get_bind()
+    names = conn.execute(sa.text(
+        "SELECT avatar_url FROM characters WHERE avatar_url IS NOT NULL"
+    )).scalars()
+    in_use = sum(1 for name in names if _is_content_key(name))
+    if in_use:
+        raise RuntimeError(
+            f"Cannot downgrade: {in_use} characters use content-addressed avatars, "
+            "which the previous revision cannot serve"
+        )
+    op.drop_index('ix_avatar_blobs_released_at', table_name='avatar_blobs')
+    op.drop_table('avatar_blobs')
@@ -0,0 +1,31 @@
+"""add_token_version_to_users
+
+Revision ID: c4e8a1f07b2d
+Revises: rename_messages_to_chats, update_message_stats
+Create Date: 2026-10-19 10:12:44.205311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e8a1f07b2d'
+down_revision: Union[str, Sequence[str], None] = ('rename_messages_to_chats', 'update_message_stats')
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Per-user token version; bumping it revokes previously issued access tokens
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(
+            sa.Column('token_version', sa.Integer(), nullable=False, server_default='0')
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('token_version')
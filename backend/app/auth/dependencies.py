@@ -1,10 +1,14 @@
+# Authentication module
+from dataclasses import dataclass
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 
-from app.auth.jwt import verify_token
+from app.auth.jwt import decode_token, token_version_matches
+from app.auth.user_cache import get_token_version, resolve_user
+from app.core.logging_config import user_var
+from app.core.tracing import traced
 from app.database import get_db
 from app.models import User
 
@@ -12,28 +16,94 @@ from app.models import User
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
-) -> User:
-    """현재 사용자 정보 가져오기"""
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
-    username = verify_token(token)
-    if username is None:
+
+@dataclass(frozen=True)
+class Principal:
+    """토큰 클레임만으로 구성한 인증 주체 (User 행 없이 권한 판단)"""
+    user_id: int
+    username: str
+    is_admin: bool
+    is_active: bool
+    token_version: int
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            user_id=user.user_id,
+            username=user.username,
+            is_admin=bool(user.is_admin),
+            is_active=bool(user.is_active),
+            token_version=user.token_version or 0,
+        )
+
+
+@traced("auth")
+async def get_current_user(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+) -> User:
+    """현재 사용자 정보 가져오기"""
+    credentials_exception = _credentials_exception()
+
+    payload = decode_token(token)
+    if payload is None:
         raise credentials_exception
 
-    result = await db.execute(select(User).where(User.username == username))
-    user = result.scalar_one_or_none()
-    if user is None:
+    user = await resolve_user(db, payload["sub"])
+    if user is None or not token_version_matches(payload, user):
         raise credentials_exception
 
+    user_var.set(user.username)
     return user
 
 
+@traced("auth")
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+) -> Principal:
+    """
+    토큰 클레임으로 인증 주체 가져오기 (조회 전용 라우트용)
+
+    User 행을 읽지 않고 token_version 만 확인한다 (캐시됨).
+    관리자가 권한/활성 상태를 바꾸면 token_version 이 증가해 기존 토큰이 거부된다.
+    """
+    credentials_exception = _credentials_exception()
+
+    payload = decode_token(token)
+    if payload is None:
+        raise credentials_exception
+
+    if "uid" not in payload:
+        # 클레임 도입 이전에 발급된 토큰은 User 행으로 판단
+        user = await resolve_user(db, payload["sub"])
+        if user is None or not token_version_matches(payload, user):
+            raise credentials_exception
+        principal = Principal.from_user(user)
+    else:
+        principal = Principal(
+            user_id=payload["uid"],
+            username=payload["sub"],
+            is_admin=bool(payload.get("adm", False)),
+            is_active=bool(payload.get("act", True)),
+            token_version=payload.get("ver", 0),
+        )
+        current_version = await get_token_version(db, principal.user_id)
+        if current_version is None or current_version != principal.token_version:
+            raise credentials_exception
+
+    if not principal.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+
+    user_var.set(principal.username)
+    return principal
+
+
 async def require_admin(current_user: User = Depends(get_current_user)) -> User:
     """관리자 권한 요구"""
     if not current_user.is_admin:
@@ -41,17 +111,27 @@ async def require_admin(current_user: User = Depends(get_current_user)) -> User:
     return current_user
 
 
+async def require_admin_principal(
+    principal: Principal = Depends(get_current_principal),
+) -> Principal:
+    """관리자 권한 요구 (토큰 클레임 기반, 조회 전용 라우트용)"""
+    if not principal.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    return principal
+
+
 async def get_current_user_optional(
     token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
 ) -> Optional[User]:
     """토큰이 없어도 오류를 발생시키지 않는 사용자 정보 가져오기"""
     try:
-        username = verify_token(token)
-        if username is None:
+        payload = decode_token(token)
+        if payload is None:
             return None
 
-        result = await db.execute(select(User).where(User.username == username))
-        user = result.scalar_one_or_none()
+        user = await resolve_user(db, payload["sub"])
+        if user is None or not token_version_matches(payload, user):
+            return None
         return user
     except:
         return None
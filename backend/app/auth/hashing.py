@@ -0,0 +1,51 @@
+"""
+Bounded worker pool for bcrypt password hashing
+
+bcrypt deliberately costs ~100ms of CPU per call. Running it inside an async
+handler stalls every request on the worker, so hashing runs on a small thread
+pool (bcrypt releases the GIL) and requests beyond the pool plus a short wait
+queue are rejected with 429 instead of piling up.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from app.auth.jwt import get_password_hash, verify_password
+from app.core.config import settings
+from app.core.workers import BoundedExecutor
+
+
+class PasswordHasher(BoundedExecutor):
+    """Runs password hashing off the event loop with a concurrency and queue limit"""
+
+    def __init__(self, concurrency: int, queue_size: int, retry_after: int = 1):
+        super().__init__(
+            lambda workers: ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="password-hash"
+            ),
+            workers=concurrency,
+            queue_size=queue_size,
+            busy_detail="Too many authentication requests, please retry shortly",
+            retry_after=retry_after,
+        )
+
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+
+password_hasher = PasswordHasher(
+    concurrency=settings.PASSWORD_HASH_CONCURRENCY,
+    queue_size=settings.PASSWORD_HASH_QUEUE_SIZE,
+    retry_after=settings.PASSWORD_HASH_RETRY_AFTER_SECONDS,
+)
+
+
+async def hash_password(password: str) -> str:
+    """Hash a password on the bounded pool (429 when saturated)"""
+    return await password_hasher.hash(password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the bounded pool (429 when saturated)"""
+    return await password_hasher.verify(plain_password, hashed_password)
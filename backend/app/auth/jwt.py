@@ -1,13 +1,14 @@
 from datetime import datetime, timedelta
 from typing import Optional
-import os
 from jose import JWTError, jwt
 import bcrypt
 
-# JWT 설정
-SECRET_KEY = os.getenv("JWT_SECRET", "your-super-secret-key-change-this-in-production")
-ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_HOURS = int(os.getenv("JWT_EXPIRATION_HOURS", "24"))
+from app.core.config import settings
+
+# JWT 설정 - app.core.auth 와 같은 Settings 값을 사용해야 토큰이 양쪽에서 검증된다
+SECRET_KEY = settings.JWT_SECRET
+ALGORITHM = settings.JWT_ALGORITHM
+ACCESS_TOKEN_EXPIRE_HOURS = settings.JWT_EXPIRATION_HOURS
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -23,16 +24,49 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def verify_token(token: str):
-    """JWT 토큰 검증"""
+def create_user_access_token(user, expires_delta: Optional[timedelta] = None):
+    """
+    사용자 권한 클레임을 담은 JWT 액세스 토큰 생성
+
+    - sub: username
+    - uid: user_id
+    - adm / act: is_admin / is_active
+    - ver: 발급 시점의 token_version (증가시키면 기존 토큰이 무효화된다)
+    """
+    return create_access_token(
+        data={
+            "sub": user.username,
+            "uid": user.user_id,
+            "adm": bool(user.is_admin),
+            "act": bool(user.is_active),
+            "ver": user.token_version or 0,
+        },
+        expires_delta=expires_delta,
+    )
+
+
+def decode_token(token: str) -> Optional[dict]:
+    """JWT 토큰 검증 후 전체 클레임 반환"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        return username
     except JWTError:
         return None
+    if payload.get("sub") is None:
+        return None
+    return payload
+
+
+def verify_token(token: str):
+    """JWT 토큰 검증"""
+    payload = decode_token(token)
+    if payload is None:
+        return None
+    return payload["sub"]
+
+
+def token_version_matches(payload: dict, user) -> bool:
+    """토큰의 버전이 사용자의 현재 token_version 과 같은지 확인 (버전 클레임이 없는 토큰은 0 으로 간주)"""
+    return payload.get("ver", 0) == (user.token_version or 0)
 
 
 def get_password_hash(password: str) -> str:
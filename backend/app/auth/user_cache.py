@@ -0,0 +1,68 @@
+"""
+Short-lived cache of authenticated users keyed by token subject (username)
+
+Cached entries are detached column snapshots, never the instance owned by a
+request session, so a request mutating its user cannot leak uncommitted
+state into the cache. Hits are merged into the caller's session without SQL.
+"""
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.models import User
+
+user_cache = TTLCache(
+    "auth_user",
+    ttl=settings.AUTH_USER_CACHE_TTL_SECONDS,
+    maxsize=settings.AUTH_USER_CACHE_SIZE,
+)
+
+# user_id -> current token_version, consulted for every claims-only authorization
+token_version_cache = TTLCache(
+    "auth_token_version",
+    ttl=settings.AUTH_TOKEN_VERSION_CACHE_TTL_SECONDS,
+    maxsize=settings.AUTH_USER_CACHE_SIZE,
+)
+
+
+def _snapshot(user: User) -> User:
+    """Detached copy of the user's column values"""
+    snapshot = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+async def resolve_user(db: AsyncSession, username: str) -> Optional[User]:
+    """Load a user by username, serving repeated lookups from the cache"""
+    cached = user_cache.get(username)
+    if cached is not None:
+        return await db.merge(cached, load=False)
+
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalar_one_or_none()
+    if user is not None:
+        user_cache.set(username, _snapshot(user))
+    return user
+
+
+async def get_token_version(db: AsyncSession, user_id: int) -> Optional[int]:
+    """Current token_version of a user, or None if the user no longer exists"""
+    version = token_version_cache.get(user_id)
+    if version is not None:
+        return version
+
+    result = await db.execute(select(User.token_version).where(User.user_id == user_id))
+    version = result.scalar_one_or_none()
+    if version is not None:
+        token_version_cache.set(user_id, version)
+    return version
+
+
+def invalidate_user(user: User) -> None:
+    """Drop a user from the caches after it was changed or deleted"""
+    user_cache.invalidate(user.username)
+    token_version_cache.invalidate(user.user_id)
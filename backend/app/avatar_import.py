@@ -0,0 +1,110 @@
+"""
+Legacy avatar import
+
+Usage:
+    python -m app.avatar_import
+
+Moves avatars stored before the content-addressed layout (flat PNG/WebP
+files in AVATAR_LEGACY_DIRS, named by ``characters.avatar_url``) into the
+blob store: each file is transcoded into its blob, counted in
+``avatar_blobs`` and the character is pointed at the content key.
+
+Legacy names are served until they are imported, so this runs after
+``alembic upgrade head``, with the app running, and can be run again to
+pick up what was skipped. It takes references the way uploads do, and a
+character whose avatar changed in the meantime is left alone. It uses the
+application's current settings and transcoding, which is why it is not
+part of the migration.
+"""
+import asyncio
+import logging
+from typing import Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.database import AsyncSessionLocal, engine
+from app.models import Character
+from app.services.avatar_storage import AvatarStorage, avatar_storage, hash_file, is_content_key
+from app.services.image_processing import InvalidImage, image_processor
+
+logger = logging.getLogger(__name__)
+
+
+async def import_avatar(storage: AvatarStorage, session_factory: async_sessionmaker,
+                        character_id: int, name: str) -> bool:
+    """Move one character's legacy avatar into the blob store; False if it was skipped"""
+    source = await asyncio.to_thread(storage.legacy_file, name)
+    if source is None:
+        logger.warning(f"Character {character_id}: legacy avatar {name} not found")
+        return False
+    key = await asyncio.to_thread(hash_file, source)
+
+    # Hold a reference before transcoding so the collector leaves the blob alone
+    async with session_factory() as db:
+        try:
+            await storage.acquire(db, key)
+        except HTTPException as e:
+            logger.warning(f"Character {character_id}: {e.detail}")
+            return False
+        await db.commit()
+
+    replaced = False
+    try:
+        await storage.ensure(source, key)
+        async with session_factory() as db:
+            # Only if the character still shows the legacy file
+            result = await db.execute(
+                update(Character)
+                .where(Character.character_id == character_id, Character.avatar_url == name)
+                .values(avatar_url=key)
+                .execution_options(synchronize_session=False)
+            )
+            replaced = bool(result.rowcount)
+            await db.commit()
+    except InvalidImage as e:
+        logger.warning(f"Character {character_id}: {name} is not a valid image ({e})")
+    finally:
+        if not replaced:
+            async with session_factory() as db:
+                await storage.release(db, key)
+                await db.commit()
+    return replaced
+
+
+async def import_legacy_avatars(storage: AvatarStorage = avatar_storage,
+                                session_factory: async_sessionmaker = AsyncSessionLocal) -> Tuple[int, int]:
+    """Import every legacy avatar still in use; returns (imported, skipped)"""
+    async with session_factory() as db:
+        rows = (await db.execute(
+            select(Character.character_id, Character.avatar_url).where(Character.avatar_url.is_not(None))
+        )).all()
+
+    imported = skipped = 0
+    for character_id, name in rows:
+        if is_content_key(name):
+            continue
+        if await import_avatar(storage, session_factory, character_id, name):
+            imported += 1
+        else:
+            skipped += 1
+    return imported, skipped
+
+
+async def _main() -> None:
+    try:
+        imported, skipped = await import_legacy_avatars()
+    finally:
+        image_processor.shutdown()
+        await engine.dispose()
+    print(f"Imported {imported} legacy avatars, skipped {skipped}")
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    asyncio.run(_main())
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,13 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 import bcrypt
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 
 from app.core.config import settings
 from app.database import get_db
+from app.auth.jwt import token_version_matches
+from app.auth.user_cache import resolve_user
+from app.core.logging_config import user_var
+from app.core.tracing import traced
 from app.models import User
 
 # OAuth2 scheme
@@ -54,6 +57,7 @@ def verify_token(token: str) -> Optional[dict]:
         return None
 
 
+@traced("auth")
 async def get_current_user(
     token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
 ) -> User:
@@ -72,11 +76,11 @@ async def get_current_user(
     if username is None:
         raise credentials_exception
 
-    result = await db.execute(select(User).filter(User.username == username))
-    user = result.scalar_one_or_none()
-    if user is None:
+    user = await resolve_user(db, username)
+    if user is None or not token_version_matches(payload, user):
         raise credentials_exception
 
+    user_var.set(user.username)
     return user
 
 
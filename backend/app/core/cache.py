@@ -0,0 +1,108 @@
+"""
+In-process caching primitives
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from app.core.metrics import CACHE_REQUESTS
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache whose entries expire after a time-to-live
+
+    The cache is per process: with several workers each keeps its own copy,
+    so explicit invalidation only reaches the current worker and the TTL
+    bounds how long other workers may serve a stale entry.
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 1024):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._hit_counter = CACHE_REQUESTS.labels(name, "hit")
+        self._miss_counter = CACHE_REQUESTS.labels(name, "miss")
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            self._miss_counter.inc()
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self.invalidate(key)
+            self.misses += 1
+            self._miss_counter.inc()
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        self._hit_counter.inc()
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if not self.enabled:
+            return
+
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class BytesTTLCache(TTLCache):
+    """
+    TTLCache bounded by the total size of its values instead of their count
+
+    ``sizeof`` gives the size of a value (``len`` by default); values larger
+    than ``max_item_bytes`` are not cached so one big entry cannot flush
+    everything else.
+    """
+
+    def __init__(self, name: str, ttl: float, maxbytes: int, max_item_bytes: Optional[int] = None,
+                 sizeof: Callable[[Any], int] = len):
+        super().__init__(name, ttl, maxsize=maxbytes)
+        self.maxbytes = maxbytes
+        self.max_item_bytes = maxbytes if max_item_bytes is None else max_item_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        size = self.sizeof(value)
+        if not self.enabled or size > self.max_item_bytes:
+            return
+
+        self.invalidate(key)
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.nbytes += size
+        while self.nbytes > self.maxbytes:
+            _, (_, evicted) = self._data.popitem(last=False)
+            self.nbytes -= self.sizeof(evicted)
+
+    def invalidate(self, key: Hashable) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.nbytes -= self.sizeof(entry[1])
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.nbytes = 0
@@ -27,16 +27,90 @@ class Settings(BaseSettings):
     # Server
     HOST: str = "0.0.0.0"
     PORT: int = 8000
+
+    # Server processes (python -m app.serve)
+    SERVER_WORKERS: Optional[int] = None  # None sizes from the CPUs and memory available (cgroup aware)
+    SERVER_WORKERS_PER_CPU: float = 1.0  # Async workers: one per core keeps every core busy
+    SERVER_WORKER_MEMORY_MB: int = 384  # Memory budgeted per worker (app, image processes, caches)
+    SERVER_MAX_WORKERS: int = 8
+    SERVER_BACKLOG: int = 2048  # Pending connections queued by the kernel
+    SERVER_KEEPALIVE_SECONDS: int = 65  # Longer than a load balancer's idle timeout (commonly 60s)
+    SERVER_MAX_REQUESTS: int = 20000  # A worker is recycled after this many requests; 0 disables
+    SERVER_MAX_REQUESTS_JITTER: int = 2000  # Spreads recycling so workers do not restart together
+    SERVER_TIMEOUT_SECONDS: int = 60  # A worker that stops heartbeating this long is restarted
+    SERVER_GRACEFUL_TIMEOUT_SECONDS: int = 30  # Drain time on shutdown or recycling before a worker is killed
+    SHUTDOWN_READINESS_DELAY_SECONDS: float = 5  # Not ready but still serving, so load balancers stop routing first
+    SHUTDOWN_TIMEOUT_SECONDS: float = 10  # Wait for in-flight Claude calls and replies before closing engines
+    SERVER_PRELOAD: bool = True  # Import the app once in the master and fork the workers from it
     
     # Database
     DATABASE_URL: str = "sqlite:///./data/lionrocket.db"
-    
+
+    # SQLite performance profile: off|balanced|durable|throughput
+    SQLITE_PROFILE: str = "balanced"
+    SQLITE_BUSY_TIMEOUT_MS: Optional[int] = None  # Overrides the profile's busy_timeout
+
+    # Connection pool (ignored for in-memory SQLite)
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30  # seconds
+    DB_POOL_RECYCLE: int = 1800  # seconds, -1 disables recycling
+    DB_POOL_PRE_PING: bool = False
+
+    # SQLite read/write split: GET routes use a read-only pool, writes share one connection
+    DB_SPLIT_READ_WRITE: bool = True
+    DB_READ_POOL_SIZE: int = 8
+
+    # Query instrumentation (per request, see app.core.query_stats)
+    DB_SLOW_QUERY_MS: int = 200  # Statements at least this slow are logged
+    DB_REPEATED_QUERY_THRESHOLD: int = 10  # Same statement more often than this in one request looks like N+1
+    DB_REPEATED_QUERY_ACTION: Optional[str] = None  # off|warn|raise; defaults to warn with DEBUG or ENVIRONMENT=test
+
+    # Chat data sharding (chats, conversation_summaries, usage_stats) by hash of user_id
+    CHAT_SHARD_COUNT: int = 1  # 1 disables sharding
+    CHAT_SHARD_URL_TEMPLATE: str = "sqlite:///./data/lionrocket_chat_{shard}.db"
+
     # Security
     SECRET_KEY: str = "your-secret-key-here"
     JWT_SECRET: str = "your-jwt-secret-here"
     JWT_ALGORITHM: str = "HS256"
     JWT_EXPIRATION_HOURS: int = 24
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+
+    # Authenticated user cache (per worker, 0 disables)
+    AUTH_USER_CACHE_TTL_SECONDS: int = 30
+    AUTH_USER_CACHE_SIZE: int = 10000
+    AUTH_TOKEN_VERSION_CACHE_TTL_SECONDS: int = 10  # Upper bound for token revocation to reach every worker
+
+    # Password hashing pool (bcrypt runs off the event loop)
+    PASSWORD_HASH_CONCURRENCY: int = 2  # Threads per worker
+    PASSWORD_HASH_QUEUE_SIZE: int = 16  # Waiting requests beyond this are rejected with 429
+    PASSWORD_HASH_RETRY_AFTER_SECONDS: int = 1
+
+    # Character catalogue cache (/characters/available responses per worker, 0 disables)
+    CATALOGUE_CACHE_TTL_SECONDS: int = 30  # Upper bound for other workers to see a character change
+    CATALOGUE_CACHE_MAX_BYTES: int = 8 * 1024 * 1024
+
+    # Avatar serving (hot avatar bytes cached per worker, 0 disables)
+    AVATAR_CACHE_MAX_BYTES: int = 32 * 1024 * 1024
+    AVATAR_CACHE_MAX_ITEM_BYTES: int = 1024 * 1024
+    AVATAR_CACHE_TTL_SECONDS: int = 300  # Upper bound for a deleted avatar to disappear from every worker
+
+    # Avatar uploads (decoded and re-encoded to WebP in worker processes)
+    AVATAR_MAX_UPLOAD_BYTES: int = 5 * 1024 * 1024
+    AVATAR_MAX_PIXELS: int = 40_000_000  # Larger images are rejected (decompression bombs)
+    AVATAR_MAX_DIMENSION: int = 1024  # Longest side of the stored avatar
+    AVATAR_THUMBNAIL_SIZES: List[int] = [64, 256]  # Square thumbnails, served with ?size=
+    AVATAR_WEBP_QUALITY: int = 85
+    IMAGE_PROCESS_WORKERS: int = 2  # Processes per worker
+    IMAGE_PROCESS_QUEUE_SIZE: int = 8  # Waiting uploads beyond this are rejected with 429
+
+    # Avatar storage (content-addressed, unreferenced blobs are collected in the background)
+    AVATAR_STORAGE_DIR: str = "uploads/avatars"
+    AVATAR_LEGACY_DIRS: List[str] = ["app/uploads/avatars"]  # Flat files from before content addressing, read-only
+    AVATAR_GC_INTERVAL_SECONDS: int = 600  # 0 disables the collector
+    AVATAR_GC_GRACE_SECONDS: int = 3600  # Unreferenced blobs are kept this long (undo, cached URLs)
+    AVATAR_GC_BATCH_SIZE: int = 100
     
     
     # CORS
@@ -49,8 +123,14 @@ class Settings(BaseSettings):
         return v
     
     # Rate Limiting
-    RATE_LIMIT_PER_MINUTE: int = 100
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_PER_MINUTE: int = 100  # Read endpoints
     CHAT_RATE_LIMIT_PER_MINUTE: int = 20
+    AUTH_RATE_LIMIT_PER_MINUTE: int = 10  # register / login / admin login, keyed by client IP
+    RATE_LIMIT_STORAGE: str = "sqlite"  # sqlite (shared by all workers on the host) | memory (per worker)
+    RATE_LIMIT_STORAGE_PATH: str = "./data/ratelimit.db"
+    RATE_LIMIT_MAX_KEYS: int = 100000  # Tracked buckets per worker (memory storage)
+    ADMIN_RATE_LIMIT_MAX_KEYS: int = 10000  # Tracked admin windows per worker (memory storage)
     
     # Admin
     DEFAULT_ADMIN_USERNAME: str = "admin"
@@ -59,10 +139,35 @@ class Settings(BaseSettings):
     
     # Claude API
     CLAUDE_API_KEY: Optional[str] = None  # Set via environment variable
+    CLAUDE_CIRCUIT_FAILURES: int = 5  # Consecutive API errors that open the circuit (fallback replies); 0 disables
+    CLAUDE_CIRCUIT_RESET_SECONDS: float = 30  # Open circuit lets a trial call through after this long
     
     # Logging
     LOG_LEVEL: str = "INFO"
-    LOG_FILE: Optional[str] = "./logs/app.log"
+    LOG_FILE: Optional[str] = "./logs/app.log"  # JSON lines, rotated; empty disables file output
+    LOG_FILE_MAX_BYTES: int = 10 * 1024 * 1024
+    LOG_FILE_BACKUP_COUNT: int = 5
+    LOG_QUEUE_SIZE: int = 10000  # Records beyond this are dropped instead of blocking requests
+    LOG_ACCESS_SAMPLE_RATE: float = 0.1  # Fraction of successful fast requests written to the access log
+    LOG_ACCESS_SLOW_MS: int = 1000  # Slower requests are always logged
+    
+    # Metrics (Prometheus, aggregated across workers via PROMETHEUS_MULTIPROC_DIR)
+    METRICS_ENABLED: bool = True
+    EVENT_LOOP_LAG_INTERVAL_SECONDS: float = 0.5
+    EVENT_LOOP_BLOCK_THRESHOLD_MS: int = 200  # Log the loop's stack when it is blocked this long; 0 disables
+    
+    # Health checks (/health/live, /health/ready)
+    HEALTH_CACHE_SECONDS: float = 1.0  # Readiness result reused by probes within this window
+    HEALTH_DB_MAX_MS: int = 500  # Database round trip slower than this (or locked) makes the worker not ready
+    HEALTH_LOOP_LAG_MAX_MS: int = 500  # Event loop lag above this makes the worker not ready
+    
+    # Tracing (tail sampled, OTLP/JSON, see app.core.tracing)
+    TRACING_ENABLED: bool = True
+    TRACE_SLOW_MS: int = 2000  # Traces at least this slow are always kept, as are failed ones
+    TRACE_SAMPLE_RATE: float = 0.0  # Fraction of the remaining traces kept
+    TRACE_FILE: Optional[str] = "./logs/traces.jsonl"  # One ExportTraceServiceRequest per line; empty disables
+    TRACE_OTLP_ENDPOINT: Optional[str] = None  # e.g. http://localhost:4318/v1/traces
+    TRACE_QUEUE_SIZE: int = 1000  # Traces beyond this are dropped instead of blocking requests
     
     model_config = ConfigDict(
         env_file=str(ENV_FILE),
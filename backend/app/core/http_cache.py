@@ -0,0 +1,29 @@
+"""
+HTTP validators shared by cacheable endpoints
+"""
+import hashlib
+from typing import Optional
+
+from fastapi import Request
+
+
+def content_etag(body: bytes) -> str:
+    """Strong ETag derived from the response body, identical on every worker"""
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(request: Request, etag: str) -> Optional[bool]:
+    """
+    Evaluate If-None-Match against ``etag``
+
+    Returns None when the request has no If-None-Match header, so callers
+    can fall back to If-Modified-Since (which If-None-Match takes precedence over).
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return None
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip() for tag in if_none_match.split(",")}
+    # Weak comparison as RFC 9110 prescribes for If-None-Match
+    return etag in tags or f"W/{etag}" in tags
@@ -0,0 +1,128 @@
+"""
+Worker lifecycle: readiness and in-flight work for a graceful shutdown
+
+When a worker is asked to stop it first starts draining: readiness
+reports "not ready" so load balancers stop routing to it, and new chat
+requests are answered with 503. The server then stops accepting
+connections and lets open requests finish, and the shutdown handlers wait
+(up to SHUTDOWN_TIMEOUT_SECONDS) for the work tracked here before the
+database engines and clients are closed.
+
+Work is tracked by kind ("claude" calls, "chat" replies, ...). A reply
+the user is waiting for runs in a task of its own (``shield``), so it is
+stored even if the request is cancelled, whether the client disconnected
+or the server's drain timeout ran out.
+"""
+import asyncio
+import logging
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Dict, Optional, Set
+
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+
+class Lifecycle:
+    """Draining flag plus counts of this worker's in-flight work"""
+
+    def __init__(self):
+        self.draining = False
+        self._inflight: Counter = Counter()
+        self._tasks: Set[asyncio.Task] = set()
+        self._idle: Optional[asyncio.Event] = None
+
+    @property
+    def ready(self) -> bool:
+        return not self.draining
+
+    def begin_serving(self) -> None:
+        """Ready again when the app is started (again) in this process"""
+        self.draining = False
+
+    def begin_drain(self) -> None:
+        if not self.draining:
+            self.draining = True
+            logger.info(f"Draining: {self.pending() or 'no work in flight'}")
+
+    def pending(self) -> Dict[str, int]:
+        """In-flight work by kind"""
+        return {kind: count for kind, count in self._inflight.items() if count}
+
+    def _enter(self, kind: str) -> None:
+        self._inflight[kind] += 1
+        if self._idle is not None:
+            self._idle.clear()
+
+    def _exit(self, kind: str) -> None:
+        self._inflight[kind] -= 1
+        if self._idle is not None and not any(self._inflight.values()):
+            self._idle.set()
+
+    @asynccontextmanager
+    async def track(self, kind: str):
+        """Count the enclosed work as in flight"""
+        self._enter(kind)
+        try:
+            yield
+        finally:
+            self._exit(kind)
+
+    def spawn(self, work: Awaitable[Any], kind: str) -> asyncio.Task:
+        """Run work in a task of its own that shutdown waits for"""
+        self._enter(kind)
+        task = asyncio.ensure_future(work)
+        self._tasks.add(task)
+
+        def _done(finished: asyncio.Task) -> None:
+            self._tasks.discard(finished)
+            self._exit(kind)
+
+        task.add_done_callback(_done)
+        return task
+
+    async def shield(self, work: Awaitable[Any], kind: str) -> Any:
+        """
+        Await work that must finish even if the caller is cancelled
+
+        The caller gets the result as usual. If the caller is cancelled the
+        work keeps running and its failure, if any, is logged since nobody
+        else will see it.
+        """
+        task = self.spawn(work, kind)
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            task.add_done_callback(_log_orphan_failure)
+            raise
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Wait until no tracked work is left; False if some is still running after ``timeout``"""
+        if not any(self._inflight.values()):
+            return True
+        if self._idle is None:
+            self._idle = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+def _log_orphan_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Work outliving its request failed: {task.exception()!r}")
+
+
+lifecycle = Lifecycle()
+
+
+async def reject_when_draining() -> None:
+    """Dependency: refuse work a draining worker may not get to finish"""
+    if lifecycle.draining:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is shutting down, please retry",
+            headers={"Retry-After": "1"},
+        )
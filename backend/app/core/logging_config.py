@@ -0,0 +1,196 @@
+"""
+Non-blocking structured logging
+
+Log calls on the event loop only put the record on a bounded queue; a
+background QueueListener thread formats records as JSON and writes them to
+stderr and to a rotating LOG_FILE. Request context (request_id, user) is
+captured from context variables when the record is created, so it survives
+the hop to the writer thread. Access logs are sampled at the call site.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional, Tuple
+
+from app.core.config import settings
+
+# Set by CoreMiddleware and the auth dependencies for the current request
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+user_var: ContextVar[Optional[str]] = ContextVar("user", default=None)
+
+access_logger = logging.getLogger("app.access")
+
+# Attributes every LogRecord has; anything else was passed via ``extra``
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with request context and ``extra`` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and value is not None:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that stamps request context and never blocks
+
+    Records are dropped (and counted) when the queue is full. After a fork
+    (gunicorn --preload) the writer thread does not exist in the child, so
+    the pipeline is restarted on the first record logged there.
+    """
+
+    def __init__(self, pipeline: "LoggingPipeline"):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id_var.get()
+        record.user = user_var.get()
+        # Merge args and render the traceback now; the record crosses threads
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.pipeline.pid != os.getpid():
+            self.pipeline.restart()
+            self.queue = self.pipeline.queue
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LoggingPipeline:
+    """Bounded queue plus the listener thread writing to the real handlers"""
+
+    def __init__(self, queue_size: int, log_file: Optional[str], max_bytes: int, backup_count: int):
+        self.queue_size = queue_size
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue = None
+        self.listener = None
+        self.pid = None
+
+    def _handlers(self):
+        formatter = JsonFormatter()
+        handlers = [logging.StreamHandler(sys.stderr)]
+        if self.log_file:
+            Path(self.log_file).parent.mkdir(parents=True, exist_ok=True)
+            handlers.append(
+                logging.handlers.RotatingFileHandler(
+                    self.log_file,
+                    maxBytes=self.max_bytes,
+                    backupCount=self.backup_count,
+                    encoding="utf-8",
+                )
+            )
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        return handlers
+
+    def start(self) -> None:
+        self.queue = queue.Queue(self.queue_size)
+        self.listener = logging.handlers.QueueListener(self.queue, *self._handlers())
+        self.listener.start()
+        self.pid = os.getpid()
+
+    def restart(self) -> None:
+        # The inherited listener thread did not survive fork(); start a fresh one
+        self.start()
+
+    def stop(self) -> None:
+        """Flush queued records and stop the writer thread"""
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+        self.listener = None
+
+
+_pipeline: Optional[LoggingPipeline] = None
+
+
+def setup_logging() -> None:
+    """Route all logging through the queue; safe to call more than once"""
+    global _pipeline
+    if _pipeline is not None:
+        return
+
+    _pipeline = LoggingPipeline(
+        queue_size=settings.LOG_QUEUE_SIZE,
+        log_file=settings.LOG_FILE,
+        max_bytes=settings.LOG_FILE_MAX_BYTES,
+        backup_count=settings.LOG_FILE_BACKUP_COUNT,
+    )
+    _pipeline.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(ContextQueueHandler(_pipeline))
+    root.setLevel(settings.LOG_LEVEL.upper())
+
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush the queue and log synchronously to stderr from now on"""
+    global _pipeline
+    if _pipeline is None:
+        return
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, ContextQueueHandler):
+            root.removeHandler(handler)
+    _pipeline.stop()
+    _pipeline = None
+
+    fallback = logging.StreamHandler(sys.stderr)
+    fallback.setFormatter(JsonFormatter())
+    root.addHandler(fallback)
+
+
+def log_queue_depth() -> Tuple[int, int]:
+    """Records waiting for the writer thread and the queue's capacity"""
+    if _pipeline is None or _pipeline.queue is None:
+        return 0, settings.LOG_QUEUE_SIZE
+    return _pipeline.queue.qsize(), _pipeline.queue_size
+
+
+def should_log_access(status_code: int, latency_ms: float) -> bool:
+    """Errors and slow requests are always logged, the rest at LOG_ACCESS_SAMPLE_RATE"""
+    if status_code >= 400 or latency_ms >= settings.LOG_ACCESS_SLOW_MS:
+        return True
+    rate = settings.LOG_ACCESS_SAMPLE_RATE
+    return rate >= 1 or random.random() < rate
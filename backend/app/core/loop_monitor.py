@@ -0,0 +1,90 @@
+"""
+Event loop lag and blocking detection
+
+A coroutine on the loop sleeps for EVENT_LOOP_LAG_INTERVAL_SECONDS at a
+time and records how late it wakes up; that overshoot is time the loop
+spent running something else without yielding. A watchdog thread checks
+the coroutine's pending wake-up: once it is overdue by more than
+EVENT_LOOP_BLOCK_THRESHOLD_MS the loop is stuck in synchronous code, so
+the watchdog snapshots the loop thread's stack (``sys._current_frames``)
+and logs it with the blocking time so far, once per blocking episode.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from app.core.metrics import EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG, EVENT_LOOP_LAG_HISTOGRAM
+
+logger = logging.getLogger(__name__)
+
+# Innermost frames kept in a blocking report
+STACK_LIMIT = 30
+
+
+class LoopMonitor:
+    """Lag sampler on the event loop plus a watchdog thread outside it"""
+
+    def __init__(self, interval: float, block_threshold: float):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.blocks = 0
+        self.lag = 0.0  # Seconds, latest sample
+        self._deadline: Optional[float] = None
+        self._reported: Optional[float] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start sampling on the running loop and the watchdog thread"""
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        if self.block_threshold > 0:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _sample(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            self._deadline = expected
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.lag = lag
+            EVENT_LOOP_LAG.set(lag)
+            EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
+
+    def _watch(self) -> None:
+        poll = max(self.block_threshold / 2, 0.01)
+        while not self._stop.wait(poll):
+            deadline = self._deadline
+            if deadline is None or deadline == self._reported:
+                continue
+            overdue = time.perf_counter() - deadline
+            if overdue >= self.block_threshold:
+                self._reported = deadline
+                self._report(overdue)
+
+    def _report(self, overdue: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame else None
+        self.blocks += 1
+        EVENT_LOOP_BLOCKS.inc()
+        logger.warning(
+            "Event loop blocked for more than %.0f ms", overdue * 1000,
+            extra={"blocked_ms": round(overdue * 1000, 1), "stack": stack},
+        )
@@ -0,0 +1,88 @@
+"""
+Prometheus metrics
+
+With several gunicorn workers set PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py
+does) before the app is imported: every worker then writes its samples to
+memory-mapped files in that directory and /metrics aggregates all of them,
+whichever worker serves the scrape.
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+# HTTP
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests", ["method", "route", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests being processed", multiprocess_mode="livesum"
+)
+
+# Claude API
+CLAUDE_DURATION = Histogram(
+    "claude_api_duration_seconds", "Claude API call latency", ["outcome"],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+CLAUDE_TOKENS = Counter("claude_tokens_total", "Claude API tokens used", ["type"])
+CLAUDE_RESPONSES = Counter(
+    "claude_responses_total", "AI responses by source (api or fallback)", ["source", "reason"]
+)
+
+# Database
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed", ["database"])
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "SQL statement latency", ["database"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+
+# Caches
+CACHE_REQUESTS = Counter("cache_requests_total", "In-process cache lookups", ["cache", "result"])
+
+# Event loop
+EVENT_LOOP_LAG = Gauge(
+    "event_loop_lag_seconds", "Latest event loop scheduling delay", multiprocess_mode="livemax"
+)
+EVENT_LOOP_LAG_HISTOGRAM = Histogram(
+    "event_loop_lag_distribution_seconds", "Event loop scheduling delay",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+EVENT_LOOP_BLOCKS = Counter(
+    "event_loop_blocks_total", "Times the event loop was blocked beyond the threshold"
+)
+
+
+def route_label(scope) -> str:
+    """Route template (e.g. /characters/{character_id}) so labels stay bounded"""
+    route = scope.get("route")
+    return getattr(route, "path_format", None) or "unmatched"
+
+
+def render_metrics() -> tuple:
+    """Exposition body and content type, aggregated across workers in multiprocess mode"""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drop a dead worker's live gauges (gunicorn child_exit hook)"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,127 @@
+"""
+Per-request database query instrumentation
+
+Engine event hooks count every statement and its duration, both in the
+Prometheus metrics and in a ``QueryStats`` object that CoreMiddleware binds
+to the request (through a context variable, alongside the request ID).
+CoreMiddleware reports the totals in the ``Server-Timing`` header and the
+access log.
+
+Statements slower than DB_SLOW_QUERY_MS are logged. A statement that runs
+more than DB_REPEATED_QUERY_THRESHOLD times in one request usually means a
+query issued in a Python loop (N+1); depending on DB_REPEATED_QUERY_ACTION
+this is logged once per statement (``warn``) or fails the request
+(``raise``, meant for tests).
+"""
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+from app.core.config import settings
+from app.core.metrics import DB_QUERIES, DB_QUERY_DURATION
+
+logger = logging.getLogger(__name__)
+
+# Longest statement text written to a log record
+STATEMENT_LOG_LIMIT = 500
+
+
+class RepeatedQueryError(RuntimeError):
+    """Raised in ``raise`` mode when one statement runs too often in a request"""
+
+
+class QueryStats:
+    """Statements executed while handling one request"""
+
+    __slots__ = ("count", "duration", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter = Counter()
+
+    @property
+    def duration_ms(self) -> float:
+        return self.duration * 1000
+
+
+# Set by CoreMiddleware for the current request
+query_stats_var: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def repeated_query_action() -> str:
+    """off|warn|raise; warns by default with DEBUG or ENVIRONMENT=test"""
+    if settings.DB_REPEATED_QUERY_ACTION:
+        return settings.DB_REPEATED_QUERY_ACTION.lower()
+    if settings.DEBUG or settings.ENVIRONMENT == "test":
+        return "warn"
+    return "off"
+
+
+def _shorten(statement: str) -> str:
+    statement = " ".join(statement.split())
+    if len(statement) > STATEMENT_LOG_LIMIT:
+        return statement[:STATEMENT_LOG_LIMIT] + "..."
+    return statement
+
+
+def _check_repeated(stats: QueryStats, statement: str, database: str) -> None:
+    threshold = settings.DB_REPEATED_QUERY_THRESHOLD
+    stats.statements[statement] += 1
+    # Only the first statement over the threshold is reported
+    if threshold <= 0 or stats.statements[statement] != threshold + 1:
+        return
+
+    action = repeated_query_action()
+    if action == "off":
+        return
+    message = f"Statement ran more than {threshold} times in one request (possible N+1)"
+    if action == "raise":
+        raise RepeatedQueryError(f"{message}: {_shorten(statement)}")
+    logger.warning(
+        message,
+        extra={"database": database, "statement": _shorten(statement), "threshold": threshold},
+    )
+
+
+def instrument_engine(async_engine, database: str) -> None:
+    """Count and time every statement executed on the engine"""
+    sync_engine = async_engine.sync_engine
+    queries = DB_QUERIES.labels(database)
+    duration = DB_QUERY_DURATION.labels(database)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        stats = query_stats_var.get()
+        if stats is not None:
+            # Checked before executing so ``raise`` mode never runs the extra statement
+            _check_repeated(stats, statement, database)
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        queries.inc()
+        duration.observe(elapsed)
+
+        stats = query_stats_var.get()
+        if stats is not None:
+            stats.count += 1
+            stats.duration += elapsed
+
+        if elapsed * 1000 >= settings.DB_SLOW_QUERY_MS:
+            logger.warning(
+                "Slow query (%.1f ms)", elapsed * 1000,
+                extra={"database": database, "statement": _shorten(statement)},
+            )
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        # after_cursor_execute does not run for failed statements
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
@@ -0,0 +1,75 @@
+"""
+Fast JSON path for list endpoints
+
+Building a Pydantic model per row and letting FastAPI validate it again
+against ``response_model`` dominates the cost of list endpoints. Here the
+query selects exactly the response columns, each row tuple is zipped into
+a dict laid out like the response schema, and orjson encodes the result
+straight to bytes. The schema still documents the endpoint; validation is
+skipped because the columns come from our own tables.
+
+The output matches what FastAPI would produce: field order follows the
+schema, enums are encoded by value and datetimes as ISO 8601 (UTC as ``Z``
+like Pydantic).
+"""
+from typing import Any, Dict, Iterable, List, Mapping, Type
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined
+from sqlalchemy import Select, select
+
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded with orjson (dicts, lists, datetimes, enums)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RowSerializer:
+    """
+    Maps selected columns of a query onto a response schema's fields
+
+    ``columns`` maps schema field names to SQL columns. Fields of the schema
+    that are not selected get their schema default, so the JSON has the
+    same keys in the same order as the schema would produce.
+    """
+
+    def __init__(self, schema: Type[BaseModel], columns: Mapping[str, Any]):
+        unknown = set(columns) - set(schema.model_fields)
+        if unknown:
+            raise ValueError(f"{schema.__name__} has no fields {sorted(unknown)}")
+        self.schema = schema
+        self.columns = dict(columns)
+        self.names = list(self.columns)
+        self._template = {
+            name: None if field.default is PydanticUndefined else field.default
+            for name, field in schema.model_fields.items()
+        }
+
+    def select(self) -> Select:
+        """SELECT of the mapped columns, in the order ``rows`` expects"""
+        return select(*self.columns.values())
+
+    def row(self, row: Iterable[Any]) -> Dict[str, Any]:
+        item = self._template.copy()
+        item.update(zip(self.names, row))
+        return item
+
+    def rows(self, rows: Iterable[Iterable[Any]]) -> List[Dict[str, Any]]:
+        template = self._template
+        names = self.names
+        items = []
+        for row in rows:
+            item = template.copy()
+            item.update(zip(names, row))
+            items.append(item)
+        return items
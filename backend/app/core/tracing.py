@@ -0,0 +1,274 @@
+"""
+Lightweight request tracing with tail sampling
+
+CoreMiddleware opens one trace per request; its trace ID is the request ID
+(a UUID4 is exactly the 16 bytes OTLP expects), so a trace can be found
+from the X-Request-ID header or any log record of the request. Code marks
+phases with ``span()`` (or ``@traced``); the current span lives in a
+context variable, so nested spans get the right parent without passing
+anything around.
+
+Spans are only buffered while the request runs. When it finishes the
+whole trace is kept if it failed or took at least TRACE_SLOW_MS (tail
+sampling), plus TRACE_SAMPLE_RATE of the rest. Kept traces are written by
+a background thread as OTLP/JSON ``ExportTraceServiceRequest`` lines to
+TRACE_FILE and, when TRACE_OTLP_ENDPOINT is set, POSTed to that collector.
+"""
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# OTLP status codes
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+
+class Span:
+    """One timed operation of a trace"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status", "message")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = STATUS_UNSET
+        self.message = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, message: str) -> None:
+        self.status = STATUS_ERROR
+        self.message = message
+
+    def finish(self) -> None:
+        self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+
+class Trace:
+    """Spans of one request, exported or dropped as a whole"""
+
+    __slots__ = ("trace_id", "spans", "failed")
+
+    def __init__(self, request_id: str):
+        self.trace_id = request_id.replace("-", "")
+        self.spans: List[Span] = []
+        self.failed = False
+
+    def start_span(self, name: str, parent: Optional[Span], attributes: Dict[str, Any]) -> Span:
+        span = Span(name, parent.span_id if parent else None, attributes)
+        self.spans.append(span)
+        return span
+
+
+# Set by CoreMiddleware / span() for the current request
+trace_var: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+span_var: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as a child of the current span (no-op outside a trace)"""
+    trace = trace_var.get()
+    if trace is None:
+        yield None
+        return
+
+    current = trace.start_span(name, span_var.get(), attributes)
+    token = span_var.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(f"{type(e).__name__}: {e}")
+        # HTTP 4xx errors are expected outcomes, not failed traces
+        if getattr(e, "status_code", 500) >= 500:
+            trace.failed = True
+        raise
+    finally:
+        current.finish()
+        span_var.reset(token)
+
+
+def traced(name: str):
+    """Decorator form of ``span()`` for coroutine functions"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def mark_error(message: str) -> None:
+    """Flag the current span (and so its trace) as failed without raising"""
+    current = span_var.get()
+    trace = trace_var.get()
+    if current is not None:
+        current.set_error(message)
+    if trace is not None:
+        trace.failed = True
+
+
+def should_keep(trace: Trace, root: Span) -> bool:
+    """Tail sampling: failed or slow traces always, the rest at TRACE_SAMPLE_RATE"""
+    if trace.failed or root.duration_ms >= settings.TRACE_SLOW_MS:
+        return True
+    rate = settings.TRACE_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def _attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def to_otlp(trace: Trace) -> dict:
+    """OTLP/JSON ExportTraceServiceRequest holding one trace"""
+    spans = []
+    for item in trace.spans:
+        data = {
+            "traceId": trace.trace_id,
+            "spanId": item.span_id,
+            "name": item.name,
+            "kind": 2 if item.parent_id is None else 1,  # SERVER for the root, INTERNAL otherwise
+            "startTimeUnixNano": str(item.start_ns),
+            "endTimeUnixNano": str(item.end_ns or item.start_ns),
+            "attributes": [
+                _attribute(key, value) for key, value in item.attributes.items() if value is not None
+            ],
+            "status": {"code": item.status},
+        }
+        if item.parent_id:
+            data["parentSpanId"] = item.parent_id
+        if item.message:
+            data["status"]["message"] = item.message
+        spans.append(data)
+
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                _attribute("service.name", settings.APP_NAME),
+                _attribute("service.version", settings.APP_VERSION),
+            ]},
+            "scopeSpans": [{"scope": {"name": "app.core.tracing"}, "spans": spans}],
+        }]
+    }
+
+
+class TraceExporter:
+    """
+    Bounded queue plus a writer thread, so exporting never blocks a request
+
+    Traces are dropped when the queue is full. Like the logging pipeline the
+    thread is restarted after fork (gunicorn --preload).
+    """
+
+    def __init__(self, path: Optional[str], endpoint: Optional[str], queue_size: int):
+        self.path = path
+        self.endpoint = endpoint
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def start(self) -> None:
+        self._queue = queue.Queue(self.queue_size)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+        self._pid = os.getpid()
+
+    def export(self, trace: Trace) -> None:
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        client = None
+        if self.endpoint:
+            import httpx
+            client = httpx.Client(timeout=5)
+        stream = None
+        if self.path:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            stream = open(self.path, "a", encoding="utf-8")
+        try:
+            while True:
+                trace = self._queue.get()
+                if trace is None:
+                    break
+                payload = to_otlp(trace)
+                if stream is not None:
+                    stream.write(json.dumps(payload, ensure_ascii=False, default=str) + "\n")
+                    stream.flush()
+                if client is not None:
+                    try:
+                        client.post(self.endpoint, json=payload)
+                    except Exception as e:
+                        logger.warning(f"Trace export to {self.endpoint} failed: {e}")
+        finally:
+            if stream is not None:
+                stream.close()
+            if client is not None:
+                client.close()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Write out queued traces and stop the thread"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        self._pid = None
+
+
+exporter = TraceExporter(settings.TRACE_FILE, settings.TRACE_OTLP_ENDPOINT, settings.TRACE_QUEUE_SIZE)
+
+
+def start_trace(request_id: str, name: str, **attributes):
+    """Open the request's trace and root span; returns the tokens for ``end_trace``"""
+    trace = Trace(request_id)
+    root = trace.start_span(name, None, attributes)
+    return trace, root, (trace_var.set(trace), span_var.set(root))
+
+
+def end_trace(trace: Trace, root: Span, tokens) -> None:
+    """Close the root span and hand the trace to the exporter if it is sampled"""
+    root.finish()
+    trace_var.reset(tokens[0])
+    span_var.reset(tokens[1])
+    if should_keep(trace, root):
+        exporter.export(trace)
@@ -0,0 +1,82 @@
+"""
+Bounded executors for blocking work
+
+CPU-bound calls (password hashing, avatar transcoding) run on an executor
+so they do not stall the event loop. Each executor has a fixed number of
+workers plus a short wait queue; calls beyond that are rejected with 429
+and Retry-After instead of piling up behind the ones already waiting.
+
+A process pool whose child died (killed by the OOM killer, say) refuses
+all further work; it is dropped and the next call starts a new one, and
+the calls that were on it are answered with 503.
+"""
+import asyncio
+import logging
+from concurrent.futures import BrokenExecutor, Executor
+from typing import Callable, Optional, TypeVar
+
+from fastapi import HTTPException, status
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BoundedExecutor:
+    """Runs calls on an executor (created on first use) with a concurrency and queue limit"""
+
+    def __init__(self, create_executor: Callable[[int], Executor], workers: int, queue_size: int,
+                 busy_detail: str, retry_after: int = 1):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.busy_detail = busy_detail
+        self.retry_after = retry_after
+        self.pending = 0
+        self.rejected = 0
+        self._create_executor = create_executor
+        self._executor: Optional[Executor] = None
+
+    @property
+    def capacity(self) -> int:
+        """Calls running or waiting before new ones are rejected"""
+        return self.workers + self.queue_size
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self._create_executor(self.workers)
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        # pending 은 이벤트 루프에서만 변경되므로 별도 잠금이 필요 없다
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=self.busy_detail,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+        self.pending += 1
+        executor = self.executor
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenExecutor as e:
+            logger.error(f"Worker pool broken, replacing it: {e}")
+            # Calls failing together drop it once; a replacement may already be running
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Worker pool restarting, please retry shortly",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        finally:
+            self.pending -= 1
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+            self._executor = None
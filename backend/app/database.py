@@ -1,37 +1,308 @@
+import ast
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import FrozenSet, Tuple
+
+from fastapi import Request
+from sqlalchemy import Column, MetaData, String, Table, event, inspect, insert, select
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.models.base import Base
 from app.core.config import settings
+from app.core.query_stats import instrument_engine
+
+logger = logging.getLogger(__name__)
 
 # 데이터베이스 URL 설정 (async SQLite)
 DATABASE_URL = settings.DATABASE_URL
 if DATABASE_URL.startswith("sqlite:///"):
     DATABASE_URL = DATABASE_URL.replace("sqlite:///", "sqlite+aiosqlite:///")
 
-# SQLAlchemy async 엔진 생성
-engine = create_async_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
-    echo=settings.DEBUG
+IS_SQLITE = "sqlite" in DATABASE_URL
+
+
+def is_memory_sqlite(url: str) -> bool:
+    """Whether the URL points at an in-memory SQLite database"""
+    return "sqlite" in url and (":memory:" in url or url.endswith("://"))
+
+
+# SQLite 성능 프로필 - 새 연결마다 PRAGMA 로 적용된다
+# - balanced: WAL + synchronous=NORMAL, 일반적인 운영 환경 기본값
+# - durable: WAL + synchronous=FULL, 전원 장애에도 커밋 유실 없음
+# - throughput: synchronous=OFF, 벤치마크/일회성 데이터용 (OS 크래시 시 유실 가능)
+SQLITE_PROFILES = {
+    "off": {},
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -65536,  # 64MB (음수는 KiB 단위)
+        "mmap_size": 268435456,  # 256MB
+        "temp_store": "MEMORY",
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 10000,
+        "cache_size": -16384,  # 16MB
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+    },
+    "throughput": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "busy_timeout": 5000,
+        "cache_size": -131072,  # 128MB
+        "mmap_size": 1073741824,  # 1GB
+        "temp_store": "MEMORY",
+    },
+}
+
+
+def get_sqlite_pragmas(profile: str = None) -> dict:
+    """Resolve the PRAGMA set for a profile, applying settings overrides"""
+    profile = profile or settings.SQLITE_PROFILE
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(
+            f"Unknown SQLITE_PROFILE '{profile}'. Choose one of: {', '.join(SQLITE_PROFILES)}"
+        )
+
+    pragmas = dict(SQLITE_PROFILES[profile])
+    if settings.SQLITE_BUSY_TIMEOUT_MS is not None:
+        pragmas["busy_timeout"] = settings.SQLITE_BUSY_TIMEOUT_MS
+    return pragmas
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas: dict) -> None:
+    """Execute PRAGMA statements on a raw DBAPI connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def get_engine_kwargs(
+    url: str = DATABASE_URL, pool_size: int = None, max_overflow: int = None
+) -> dict:
+    """Engine keyword arguments (connect args and pool sizing) from Settings"""
+    kwargs = {"echo": settings.DEBUG}
+
+    if "sqlite" in url:
+        kwargs["connect_args"] = {"check_same_thread": False}
+        if is_memory_sqlite(url):
+            # 인메모리 DB 는 단일 연결(StaticPool)을 그대로 사용
+            return kwargs
+
+        # aiosqlite 는 파일 DB 에 NullPool 을 기본으로 쓰므로 요청마다 연결(스레드)이 새로 열린다
+        kwargs["poolclass"] = AsyncAdaptedQueuePool
+
+    kwargs.update(
+        pool_size=settings.DB_POOL_SIZE if pool_size is None else pool_size,
+        max_overflow=settings.DB_MAX_OVERFLOW if max_overflow is None else max_overflow,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    return kwargs
+
+
+def install_sqlite_profile(async_engine, profile: str = None, extra_pragmas: dict = None) -> None:
+    """Apply the SQLite performance profile on every new connection of an engine"""
+    pragmas = {**get_sqlite_pragmas(profile), **(extra_pragmas or {})}
+    if not pragmas:
+        return
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection, pragmas)
+
+
+def create_session_factory(bind) -> async_sessionmaker:
+    """Session factory with the application's session defaults"""
+    return async_sessionmaker(
+        bind=bind,
+        class_=AsyncSession,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False
+    )
+
+
+# 파일 SQLite 는 읽기/쓰기 연결을 분리한다
+# - 쓰기: 단일 전용 연결. 대기 중인 쓰기는 풀의 FIFO 대기열에서 순서를 기다린다 (잠금 경쟁 없음)
+# - 읽기: query_only 연결 풀. WAL 모드에서는 쓰기가 진행 중이어도 막히지 않는다
+SPLIT_READ_WRITE = (
+    IS_SQLITE and not is_memory_sqlite(DATABASE_URL) and settings.DB_SPLIT_READ_WRITE
 )
 
+# SQLAlchemy async 엔진 생성 (쓰기용)
+if SPLIT_READ_WRITE:
+    engine = create_async_engine(
+        DATABASE_URL, **get_engine_kwargs(DATABASE_URL, pool_size=1, max_overflow=0)
+    )
+else:
+    engine = create_async_engine(DATABASE_URL, **get_engine_kwargs(DATABASE_URL))
+
+if IS_SQLITE:
+    install_sqlite_profile(engine)
+
+# 읽기 전용 엔진
+if SPLIT_READ_WRITE:
+    read_engine = create_async_engine(
+        DATABASE_URL,
+        **get_engine_kwargs(DATABASE_URL, pool_size=settings.DB_READ_POOL_SIZE, max_overflow=0),
+    )
+    install_sqlite_profile(read_engine, extra_pragmas={"query_only": 1})
+else:
+    read_engine = engine
+
+# 쿼리 수/지연시간 메트릭
+instrument_engine(engine, "main")
+if SPLIT_READ_WRITE:
+    instrument_engine(read_engine, "main_read")
+
 # async 세션 팩토리 생성
-AsyncSessionLocal = async_sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    autocommit=False,
-    autoflush=False,
-    expire_on_commit=False
+AsyncSessionLocal = create_session_factory(engine)
+AsyncReadSessionLocal = create_session_factory(read_engine) if SPLIT_READ_WRITE else AsyncSessionLocal
+
+
+def reset_pools_after_fork(*engines) -> None:
+    """
+    Forget pooled connections inherited from the parent process
+
+    With gunicorn --preload the app (and its engines) is created once in
+    the master and forked into the workers; a connection opened before the
+    fork must not be shared. ``close=False`` leaves the parent's
+    connections alone and gives this process an empty pool.
+    """
+    for async_engine in {engine, read_engine, *engines}:
+        async_engine.sync_engine.dispose(close=False)
+
+
+# 읽기 전용 세션으로 처리할 HTTP 메서드
+READ_ONLY_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+# Alembic 리비전 파일 위치와 버전 테이블 (alembic 자체는 부팅 시 import 하지 않는다)
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "alembic" / "versions"
+
+alembic_version = Table(
+    "alembic_version",
+    MetaData(),
+    Column("version_num", String(32), primary_key=True),
 )
 
 
-# 테이블 생성
-async def create_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+@lru_cache(maxsize=1)
+def migration_revisions() -> Tuple[FrozenSet[str], FrozenSet[str]]:
+    """
+    All revision ids under alembic/versions and the heads among them
+
+    The files are parsed, not imported: loading alembic's script directory
+    costs a third of a second, while reading the ``revision`` and
+    ``down_revision`` assignments is a few milliseconds.
+    """
+    revisions, parents = set(), set()
+    for path in MIGRATIONS_DIR.glob("*.py"):
+        values = {}
+        for node in ast.parse(path.read_text(encoding="utf-8")).body:
+            if isinstance(node, ast.Assign) and len(node.targets) == 1:
+                target, value = node.targets[0], node.value
+            elif isinstance(node, ast.AnnAssign) and node.value is not None:
+                target, value = node.target, node.value
+            else:
+                continue
+            if isinstance(target, ast.Name) and target.id in ("revision", "down_revision"):
+                values[target.id] = ast.literal_eval(value)
+        if "revision" not in values:
+            continue
+        revisions.add(values["revision"])
+        down = values.get("down_revision")
+        if isinstance(down, str):
+            parents.add(down)
+        elif down:
+            parents.update(down)
+    return frozenset(revisions), frozenset(revisions - parents)
+
+
+def _check_schema(connection, revisions: FrozenSet[str], heads: FrozenSet[str]) -> str:
+    tables = set(inspect(connection).get_table_names())
+    if alembic_version.name in tables:
+        current = set(connection.execute(select(alembic_version.c.version_num)).scalars())
+        if current == heads:
+            return "current"
+        if current - revisions:
+            # 롤링 배포 중 새 버전이 먼저 마이그레이션한 경우
+            logger.warning(f"Database schema {sorted(current)} is newer than this code {sorted(heads)}")
+            return "ahead"
+        raise RuntimeError(
+            f"Database schema is at {sorted(current) or 'no revision'}, expected {sorted(heads)}; "
+            "run `alembic upgrade head`"
+        )
+
+    if tables & set(Base.metadata.tables):
+        # alembic 을 쓰기 전 create_all 로 만든 DB: 이전처럼 빠진 테이블만 만든다
+        logger.warning(
+            "Database has no alembic_version table; creating missing tables. "
+            "Run `alembic stamp head` once the schema matches the models"
+        )
+        Base.metadata.create_all(connection)
+        return "unversioned"
+
+    # 빈 DB: 모델에서 바로 만들고 head 로 stamp 한다
+    Base.metadata.create_all(connection)
+    alembic_version.create(connection)
+    connection.execute(insert(alembic_version), [{"version_num": head} for head in sorted(heads)])
+    return "created"
+
+
+async def ensure_schema() -> str:
+    """
+    Make sure the main database is at the Alembic head before serving
+
+    A database at head costs one table listing and one SELECT instead of a
+    ``create_all`` that inspects every table. An empty database is created
+    from the models and stamped; one at an older revision stops startup.
+    Returns "current", "ahead", "unversioned" or "created".
+    """
+    revisions, heads = migration_revisions()
+    for attempt in range(2):
+        try:
+            async with engine.begin() as conn:
+                return await conn.run_sync(_check_schema, revisions, heads)
+        except DBAPIError:
+            # 여러 워커가 동시에 빈 DB 를 만들면 한쪽이 실패한다: 다시 확인하면 head 다
+            if attempt:
+                raise
+
+
+# 데이터베이스 세션 의존성 - GET 요청은 읽기 풀, 그 외에는 쓰기 연결을 사용
+async def get_db(request: Request) -> AsyncSession:
+    session_factory = (
+        AsyncReadSessionLocal if request.method in READ_ONLY_METHODS else AsyncSessionLocal
+    )
+    async with session_factory() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+# 메서드와 무관하게 읽기 전용 세션을 사용 (예: 조회만 하는 POST /auth/login)
+async def get_read_db() -> AsyncSession:
+    async with AsyncReadSessionLocal() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
 
 
-# 데이터베이스 세션 의존성
-async def get_db() -> AsyncSession:
+# 메서드와 무관하게 쓰기 세션을 사용
+async def get_write_db() -> AsyncSession:
     async with AsyncSessionLocal() as session:
         try:
             yield session
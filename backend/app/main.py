@@ -1,28 +1,35 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
-import uvicorn
+import asyncio
 import logging
-from pathlib import Path
+from typing import Optional
 
 from app.routers import auth, chat, character, admin
-from app.database import create_tables
-from app.middleware import (
-    # Rate limiting
-    limiter,
-    RateLimitExceeded,
-    _rate_limit_exceeded_handler,
-    # Admin middleware
-    add_admin_middleware,
-)
+from app.database import AsyncSessionLocal, engine, ensure_schema, read_engine
+from app.sharding import create_shard_tables, shard_router
+from app.auth.hashing import password_hasher
+from app.middleware import add_admin_middleware
 from app.middleware.core import CoreMiddleware, RequestSizeMiddleware
+from app.middleware.rate_limit_store import rate_limit_store
 
 from app.core.config import settings
+from app.core.lifecycle import lifecycle
+from app.core.logging_config import setup_logging, shutdown_logging
+from app.core.metrics import render_metrics
+from app.core.loop_monitor import LoopMonitor
+from app.core.tracing import exporter as trace_exporter
+from app.schemas.common import HealthCheckResponse
+from app.services.avatar_service import avatar_response
+from app.services.avatar_storage import avatar_storage, run_collector
+from app.services.claude_service import claude_service
+from app.services.health_service import liveness, readiness
+from app.services.image_processing import image_processor
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (queue-backed JSON records, see app.core.logging_config)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(
@@ -34,15 +41,18 @@ app = FastAPI(
     openapi_url="/openapi.json",
 )
 
-# Add rate limiter to app state
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-
 # Add unified middleware (simplified for assignment environment)
-# 1. Request size limit - Should be first to reject large requests
+# All layers are pure ASGI. Starlette runs the middleware added last first,
+# so they are added innermost first; requests pass through them as:
+# Core -> CORS -> Request size -> Admin -> routes
+
+# 4. Admin-specific middleware - Validation, security, rate limit and audit for admin endpoints
+add_admin_middleware(app)
+
+# 3. Request size limit - Rejects large bodies before routing reads them
 app.add_middleware(RequestSizeMiddleware, max_size=5 * 1024 * 1024)
 
-# 2. CORS - Must be before other processing
+# 2. CORS - Wraps every response below, including 413/429 errors
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -56,20 +66,63 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 3. Core middleware - Unified request ID, logging, timing, and security
+# 1. Core middleware - Unified request ID, logging, timing, and security
 app.add_middleware(CoreMiddleware, api_version="1.0.0")
 
-# 4. Admin-specific middleware - Enhanced security for admin endpoints
-add_admin_middleware(app)
-
 
 # Application startup event
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database tables on application startup"""
-    logger.info("Creating database tables...")
-    await create_tables()
-    logger.info("Database tables created successfully")
+    """Check the database schema and start background work on application startup"""
+    setup_logging()
+    lifecycle.begin_serving()
+    schema = await ensure_schema()
+    await create_shard_tables()
+    logger.info(f"Database schema {schema}")
+    await asyncio.to_thread(avatar_storage.root.mkdir, parents=True, exist_ok=True)
+    if claude_service.api_available:
+        # The SDK import takes about a second; do it now rather than in the first chat
+        app.state.claude_warm_up = asyncio.create_task(asyncio.to_thread(claude_service.warm_up))
+    if settings.METRICS_ENABLED:
+        app.state.loop_monitor = LoopMonitor(
+            interval=settings.EVENT_LOOP_LAG_INTERVAL_SECONDS,
+            block_threshold=settings.EVENT_LOOP_BLOCK_THRESHOLD_MS / 1000,
+        )
+        app.state.loop_monitor.start()
+    if settings.AVATAR_GC_INTERVAL_SECONDS > 0:
+        app.state.avatar_collector = asyncio.create_task(run_collector(avatar_storage, AsyncSessionLocal))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Drain in-flight work, then release engines, clients and worker pools
+
+    Readiness is already "not ready" when the server was stopped by
+    app.serve (see DrainingServer); open requests have finished or timed
+    out by now. Replies and Claude calls still running are given
+    SHUTDOWN_TIMEOUT_SECONDS before the engines they write to are closed.
+    """
+    lifecycle.begin_drain()
+    avatar_collector = getattr(app.state, "avatar_collector", None)
+    if avatar_collector is not None:
+        avatar_collector.cancel()
+    if not await lifecycle.wait_idle(settings.SHUTDOWN_TIMEOUT_SECONDS):
+        logger.warning(f"Shutting down with work still in flight: {lifecycle.pending()}")
+    loop_monitor = getattr(app.state, "loop_monitor", None)
+    if loop_monitor is not None:
+        loop_monitor.stop()
+    await claude_service.close()
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+    if shard_router is not None:
+        await shard_router.dispose()
+    password_hasher.shutdown()
+    image_processor.shutdown()
+    rate_limit_store.close()
+    trace_exporter.stop()
+    shutdown_logging()
 
 
 # 라우터 등록 - '/api' prefix 제거하여 간결한 URL 사용
@@ -83,7 +136,9 @@ app.include_router(admin.router, prefix="/admin", tags=["admin"])
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
     return JSONResponse(
-        status_code=exc.status_code, content={"detail": exc.detail, "status": exc.status_code}
+        status_code=exc.status_code,
+        content={"detail": exc.detail, "status": exc.status_code},
+        headers=getattr(exc, "headers", None),
     )
 
 
@@ -135,84 +190,115 @@ async def health_check():
     Health check endpoint for monitoring service status.
 
     Returns:
-        dict: Service health status
+        dict: Service health status; 503 once the worker is draining for shutdown
     """
+    if not lifecycle.ready:
+        return JSONResponse(
+            status_code=503, content={"status": "draining", "service": "LionRocket AI Chat"}
+        )
     return {"status": "healthy", "service": "LionRocket AI Chat"}
 
 
+@app.get(
+    "/health/live",
+    tags=["health"],
+    response_model=HealthCheckResponse,
+    summary="Liveness Check",
+    description="Check that the worker process and its event loop answer",
+)
+async def liveness_check():
+    """
+    Liveness probe: restart the worker when this stops answering.
+
+    Returns:
+        HealthCheckResponse: Always healthy; no dependency is checked
+    """
+    return liveness()
+
+
+@app.get(
+    "/health/ready",
+    tags=["health"],
+    response_model=HealthCheckResponse,
+    responses={503: {"model": HealthCheckResponse, "description": "Not ready"}},
+    summary="Readiness Check",
+    description="Check the database, event loop, queues and Claude circuit of this worker",
+)
+async def readiness_check(request: Request):
+    """
+    Readiness probe: route traffic to the worker only while this answers 200.
+
+    Returns:
+        HealthCheckResponse: Overall status and each check (cached for HEALTH_CACHE_SECONDS);
+        503 when a check fails or the worker is draining for shutdown
+    """
+    status_code, result = await readiness.check(getattr(request.app.state, "loop_monitor", None))
+    return JSONResponse(
+        status_code=status_code, content=result.model_dump(), headers={"Cache-Control": "no-store"}
+    )
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics of every worker"""
+    if not settings.METRICS_ENABLED:
+        from fastapi import HTTPException
+        raise HTTPException(status_code=404, detail="Not Found")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 @app.get("/images/avatars/{avatar_url}")
-async def serve_avatar_image(avatar_url: str):
+async def serve_avatar_image(avatar_url: str, request: Request, size: Optional[int] = None):
     """
     Serve avatar images from /images/{avatar_url} endpoint
     
-    This endpoint serves character avatar images stored in the uploads/avatars directory.
+    This endpoint serves character avatar images from the content-addressed avatar storage.
     The frontend can access avatars using: GET /images/avatars/{avatar_url}
     
+    A name is the hash of the image, so it always refers to the same
+    content and responses are cacheable forever; hot avatars are served from memory.
+    
     Args:
-        avatar_url: The avatar URL (without extension)
+        avatar_url: The avatar URL (content key, or a legacy file name without extension)
+        size: Optional thumbnail edge in pixels (the closest larger thumbnail is served)
         
     Returns:
-        FileResponse: The avatar image file (PNG format)
+        Response: The avatar image (WebP, or PNG for legacy files), or 304 if the client's copy is current
         
     Raises:
         HTTPException: 400 if path traversal detected, 404 if file not found
     """
     from fastapi import HTTPException
     
-    # Prevent path traversal attacks
+    # Prevent path traversal attacks; without separators or '..' the path stays in the directory
     if '..' in avatar_url or '/' in avatar_url or '\\' in avatar_url:
         raise HTTPException(
             status_code=400,
             detail="Invalid avatar URL. Path traversal not allowed."
         )
     
-    # Construct the full path to the avatar file
-    avatar_path = Path("uploads/avatars") / f"{avatar_url}.png"
-    
-    # Ensure the path is within the allowed directory
-    try:
-        avatar_path = avatar_path.resolve()
-        uploads_dir = Path("uploads/avatars").resolve()
-        if not str(avatar_path).startswith(str(uploads_dir)):
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid avatar path"
-            )
-    except Exception:
-        raise HTTPException(
-            status_code=400,
-            detail="Invalid avatar path"
-        )
-    
-    # Check if file exists
-    if not avatar_path.exists():
+    avatar, media_type = await avatar_storage.find(avatar_url, size)
+    if avatar is None:
         raise HTTPException(
             status_code=404, 
             detail="Avatar image not found"
         )
     
-    # Check if it's actually a file (not a directory)
-    if not avatar_path.is_file():
-        raise HTTPException(
-            status_code=404,
-            detail="Avatar path is not a file"
-        )
-    
-    return FileResponse(
-        path=str(avatar_path),
-        media_type="image/png",
-        filename=f"avatar_{avatar_url}.png",
-        headers={
-            "Cache-Control": "public, max-age=3600",  # Cache for 1 hour
-            "X-Content-Type-Options": "nosniff",
-            "Access-Control-Allow-Origin": "*",  # Allow cross-origin requests for images
-            "Access-Control-Allow-Methods": "GET",
-            "Access-Control-Allow-Headers": "Content-Type"
-        }
+    response = avatar_response(
+        request, avatar, media_type, immutable=True,
+        filename=f"avatar_{avatar_url}{avatar.path.suffix}",
     )
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    response.headers["Access-Control-Allow-Origin"] = "*"  # Allow cross-origin requests for images
+    response.headers["Access-Control-Allow-Methods"] = "GET"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type"
+    return response
 
 
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    from app.serve import main
+
+    main()
@@ -3,16 +3,11 @@ from .rate_limit import (
     limiter,
     rate_limit,
     chat_rate_limit,
+    auth_rate_limit,
+    read_rate_limit,
     RateLimitExceeded,
-    _rate_limit_exceeded_handler,
-)
-from .admin import (
-    AdminAuditLogMiddleware,
-    AdminRateLimitMiddleware,
-    AdminSecurityMiddleware,
-    AdminRequestValidationMiddleware,
-    add_admin_middleware,
 )
+from .admin import AdminMiddleware, add_admin_middleware
 from .core import CoreMiddleware, RequestSizeMiddleware
 
 __all__ = [
@@ -20,15 +15,13 @@ __all__ = [
     "limiter",
     "rate_limit",
     "chat_rate_limit",
+    "auth_rate_limit",
+    "read_rate_limit",
     "RateLimitExceeded",
-    "_rate_limit_exceeded_handler",
     # Core unified middleware
     "CoreMiddleware",
     "RequestSizeMiddleware",
     # Admin middleware
-    "AdminAuditLogMiddleware",
-    "AdminRateLimitMiddleware",
-    "AdminSecurityMiddleware",
-    "AdminRequestValidationMiddleware",
+    "AdminMiddleware",
     "add_admin_middleware",
 ]
@@ -1,288 +1,224 @@
 """
 Admin-specific middleware for enhanced security, logging, and monitoring
+
+All admin checks run in one pure ASGI middleware. Non-admin requests are
+passed straight through; admin request and response bodies are forwarded
+untouched (the audit log only keeps a copy of small request bodies).
 """
 import json
+import math
 import time
-from typing import Callable
-from datetime import datetime
-from fastapi import Request, Response, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from typing import Optional
+from urllib.parse import unquote_plus
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import logging
-from jose import jwt, JWTError
+from app.auth.jwt import decode_token
 from app.core.config import settings
+from app.middleware.rate_limit_store import SlidingWindowRateLimitStore, rate_limit_store
 
 logger = logging.getLogger(__name__)
 
+# Request bodies up to this size are copied into the audit log
+AUDIT_BODY_LIMIT = 10000
 
-class AdminAuditLogMiddleware(BaseHTTPMiddleware):
-    """
-    Middleware to log all admin actions for audit purposes
-    """
-    
-    def __init__(self, app: ASGIApp):
-        super().__init__(app)
-        self.sensitive_endpoints = [
-            "/admin/users",
-            "/admin/characters",
-            "/admin/stats",
-            "/admin/dashboard"
-        ]
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Only log admin endpoints, but skip CORS preflight requests
-        if not request.url.path.startswith("/admin") or request.method == "OPTIONS":
-            return await call_next(request)
-        
-        # Capture request info
-        start_time = time.time()
-        request_body = None
-        
-        # Get user info from JWT token for audit logging
-        admin_username = "unknown"
-        admin_id = None
-        
-        # Extract user info from JWT token
-        auth_header = request.headers.get("authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            try:
-                token = auth_header.split(" ")[1]
-                payload = jwt.decode(
-                    token, 
-                    settings.JWT_SECRET_KEY, 
-                    algorithms=[settings.JWT_ALGORITHM]
-                )
-                admin_username = payload.get("sub", "unknown")
-                # For audit purposes, we'll use username as identifier
-                # In production, you might want to store user_id in JWT payload
-            except Exception as e:
-                logger.debug(f"Could not extract user from token: {e}")
-        
-        # Log request details
-        if request.method in ["POST", "PUT", "PATCH", "DELETE"]:
-            try:
-                # Read body for audit log (be careful with large bodies)
-                body_bytes = await request.body()
-                if body_bytes and len(body_bytes) < 10000:  # 10KB limit for logging
-                    try:
-                        request_body = json.loads(body_bytes.decode())
-                        # Remove sensitive fields
-                        if "password" in request_body:
-                            request_body["password"] = "***REDACTED***"
-                    except json.JSONDecodeError:
-                        request_body = "<non-json-body>"
-                
-                # Recreate request with body
-                async def receive():
-                    return {"type": "http.request", "body": body_bytes}
-                
-                request = Request(request.scope, receive)
-            except Exception as e:
-                logger.error(f"Error reading request body: {e}")
-        
-        # Process request
-        response = await call_next(request)
-        
-        # Calculate response time
-        process_time = time.time() - start_time
-        
-        # Log admin action
-        log_data = {
-            "timestamp": datetime.utcnow().isoformat(),
-            "admin_id": admin_id,
-            "admin_username": admin_username,
-            "method": request.method,
-            "path": request.url.path,
-            "query_params": dict(request.query_params),
-            "request_body": request_body,
-            "status_code": response.status_code,
-            "process_time": f"{process_time:.3f}s",
-            "client_ip": request.client.host if request.client else None,
-            "user_agent": request.headers.get("user-agent"),
-        }
-        
-        # Log level based on action type
-        if request.method == "DELETE" or "delete" in request.url.path:
-            logger.warning(f"ADMIN DELETE ACTION: {json.dumps(log_data)}")
-        elif request.method in ["POST", "PUT", "PATCH"]:
-            logger.info(f"ADMIN MODIFY ACTION: {json.dumps(log_data)}")
-        else:
-            logger.info(f"ADMIN READ ACTION: {json.dumps(log_data)}")
-        
-        return response
+SUSPICIOUS_PATTERNS = [
+    "../",  # Path traversal
+    "<script",  # XSS attempt
+    "DROP TABLE",  # SQL injection
+    "DELETE FROM",  # SQL injection
+    "UNION SELECT",  # SQL injection
+]
+
+ADMIN_SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+    "Content-Security-Policy": "default-src 'self'",
+    "Strict-Transport-Security": "max-age=31536000; includeSubDomains",
+}
 
 
-class AdminRateLimitMiddleware(BaseHTTPMiddleware):
+class AdminMiddleware:
     """
-    Specific rate limiting for admin endpoints
+    Request validation, security checks, rate limiting and audit logging for /admin
+
+    With shared rate limit storage (RATE_LIMIT_STORAGE=sqlite) the limits
+    apply per host rather than per worker; otherwise each worker counts
+    requests in its own sliding windows.
     """
-    
-    def __init__(self, app: ASGIApp, 
+
+    def __init__(self, app: ASGIApp,
                  read_limit: int = 100,  # per minute
                  write_limit: int = 30,  # per minute
-                 delete_limit: int = 10):  # per minute
-        super().__init__(app)
+                 delete_limit: int = 10,  # per minute
+                 store=None):
+        self.app = app
         self.read_limit = read_limit
         self.write_limit = write_limit
         self.delete_limit = delete_limit
-        self.request_counts = {}  # Simple in-memory store
-        
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        if store is None:
+            store = rate_limit_store if rate_limit_store.shared else SlidingWindowRateLimitStore(
+                maxsize=settings.ADMIN_RATE_LIMIT_MAX_KEYS
+            )
+        self.store = store
+        self.suspicious_patterns = [pattern.lower() for pattern in SUSPICIOUS_PATTERNS]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         # Skip admin middleware for non-admin endpoints and CORS preflight requests
-        if not request.url.path.startswith("/admin") or request.method == "OPTIONS":
-            return await call_next(request)
-        
-        # Get user identifier from JWT token
-        user_key = None
-        auth_header = request.headers.get("authorization")
+        if (
+            scope["type"] != "http"
+            or not scope["path"].startswith("/admin")
+            or scope["method"] == "OPTIONS"
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        method = scope["method"]
+        query_string = scope.get("query_string", b"").decode("latin-1")
+
+        # Validation and security checks
+        error = self.validate_query(query_string) or self.check_suspicious(scope["path"], query_string)
+        if error is not None:
+            await self._error(scope, receive, send, 400, error)
+            return
+
+        # Get admin identity from JWT token (admin verification itself is done by require_admin)
+        payload = None
+        auth_header = Headers(scope=scope).get("authorization")
         if auth_header and auth_header.startswith("Bearer "):
-            try:
-                token = auth_header.split(" ")[1]
-                payload = jwt.decode(
-                    token, 
-                    settings.JWT_SECRET_KEY, 
-                    algorithms=[settings.JWT_ALGORITHM]
+            payload = decode_token(auth_header[7:])
+            if payload is None:
+                logger.debug("Could not extract user from token")
+
+        # Rate limiting
+        if payload is not None:
+            limit, action = self.limit_for(method)
+            user_key = f"admin_{payload['sub']}"
+            retry_after = self.store.hit(f"{user_key}:{action}", limit)
+            if retry_after:
+                logger.warning(f"Admin rate limit exceeded for {user_key} - {action}")
+                await self._error(
+                    scope, receive, send, 429,
+                    f"Rate limit exceeded. Max {limit} {action} requests per minute.",
+                    headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
                 )
-                username = payload.get("sub")
-                if username:
-                    user_key = f"admin_{username}"
-            except Exception:
-                pass
-        
-        if not user_key:
-            # If we can't identify the user, let the request through
-            # The auth dependency will handle authentication
-            return await call_next(request)
-        current_minute = int(time.time() // 60)
-        
-        # Determine rate limit based on method
-        if request.method == "GET":
-            limit = self.read_limit
-            action = "read"
-        elif request.method == "DELETE":
-            limit = self.delete_limit
-            action = "delete"
-        else:
-            limit = self.write_limit
-            action = "write"
-        
-        # Check rate limit
-        rate_key = f"{user_key}:{action}:{current_minute}"
-        
-        if rate_key not in self.request_counts:
-            self.request_counts[rate_key] = 0
-        
-        self.request_counts[rate_key] += 1
-        
-        # Clean old entries (older than 2 minutes)
-        self._clean_old_entries(current_minute)
-        
-        if self.request_counts[rate_key] > limit:
-            logger.warning(f"Admin rate limit exceeded for {user_key} - {action}")
-            raise HTTPException(
-                status_code=429,
-                detail=f"Rate limit exceeded. Max {limit} {action} requests per minute."
-            )
-        
-        return await call_next(request)
-    
-    def _clean_old_entries(self, current_minute: int):
-        """Remove entries older than 2 minutes"""
-        keys_to_remove = []
-        for key in self.request_counts:
-            minute = int(key.split(":")[-1])
-            if current_minute - minute > 2:
-                keys_to_remove.append(key)
-        
-        for key in keys_to_remove:
-            del self.request_counts[key]
+                return
 
+        # Copy small request bodies for the audit log while they stream to the app
+        body = bytearray()
+        capture = method in ("POST", "PUT", "PATCH", "DELETE")
 
-class AdminSecurityMiddleware(BaseHTTPMiddleware):
-    """
-    Enhanced security checks for admin endpoints
-    """
-    
-    def __init__(self, app: ASGIApp):
-        super().__init__(app)
-        self.suspicious_patterns = [
-            "../",  # Path traversal
-            "<script",  # XSS attempt
-            "DROP TABLE",  # SQL injection
-            "DELETE FROM",  # SQL injection
-            "UNION SELECT",  # SQL injection
-        ]
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Skip admin middleware for non-admin endpoints and CORS preflight requests
-        if not request.url.path.startswith("/admin") or request.method == "OPTIONS":
-            return await call_next(request)
-        
-        # Check for suspicious patterns in URL
-        url_str = str(request.url)
+        async def receive_wrapper() -> Message:
+            nonlocal capture
+            message = await receive()
+            if capture and message["type"] == "http.request":
+                body.extend(message.get("body", b""))
+                if len(body) >= AUDIT_BODY_LIMIT:
+                    capture = False
+                    body.clear()
+            return message
+
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # Enhanced security headers for admin endpoints
+                headers = MutableHeaders(scope=message)
+                for name, value in ADMIN_SECURITY_HEADERS.items():
+                    headers[name] = value
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            self.audit(scope, payload, bytes(body), status_code, time.perf_counter() - start_time)
+
+    def validate_query(self, query_string: str) -> Optional[str]:
+        """Validate pagination parameters"""
+        if "page" not in query_string:
+            return None
+
+        page = QueryParams(query_string).get("page")
+        if page is None:
+            return None
+        try:
+            page = int(page)
+        except ValueError:
+            return "Page must be a valid integer"
+        if page < 1 or page > 10000:
+            return "Invalid page number. Must be between 1 and 10000."
+        return None
+
+    def check_suspicious(self, path: str, query_string: str) -> Optional[str]:
+        """Reject URLs containing traversal / injection patterns"""
+        url_str = f"{path}?{unquote_plus(query_string)}".lower()
         for pattern in self.suspicious_patterns:
-            if pattern.lower() in url_str.lower():
+            if pattern in url_str:
                 logger.error(f"Suspicious pattern detected in admin request: {pattern} in {url_str}")
-                raise HTTPException(
-                    status_code=400,
-                    detail="Invalid request"
-                )
-        
-        # Note: Admin verification is handled by the require_admin dependency
-        # This middleware focuses on security patterns and headers
-        
-        # Add security headers specifically for admin responses
-        response = await call_next(request)
-        
-        # Enhanced security headers for admin endpoints
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["Content-Security-Policy"] = "default-src 'self'"
-        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        
-        return response
+                return "Invalid request"
+        return None
 
+    def limit_for(self, method: str):
+        """Determine rate limit based on method"""
+        if method == "GET":
+            return self.read_limit, "read"
+        if method == "DELETE":
+            return self.delete_limit, "delete"
+        return self.write_limit, "write"
 
-class AdminRequestValidationMiddleware(BaseHTTPMiddleware):
-    """
-    Additional validation for admin requests
-    """
-    
-    def __init__(self, app: ASGIApp):
-        super().__init__(app)
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # Skip admin middleware for non-admin endpoints and CORS preflight requests
-        if not request.url.path.startswith("/admin") or request.method == "OPTIONS":
-            return await call_next(request)
-        
-        # Validate query parameters
-        query_params = request.query_params
-        
-        # Check pagination parameters
-        if "page" in query_params:
+    def audit(self, scope: Scope, payload: Optional[dict], body: bytes,
+              status_code: int, process_time: float) -> None:
+        """Log admin action"""
+        request_body = None
+        if body:
             try:
-                page = int(query_params["page"])
-                if page < 1 or page > 10000:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Invalid page number. Must be between 1 and 10000."
-                    )
-            except ValueError:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Page must be a valid integer"
-                )
-        
-        
-        
-        return await call_next(request)
+                request_body = json.loads(body.decode())
+                # Remove sensitive fields
+                if isinstance(request_body, dict) and "password" in request_body:
+                    request_body["password"] = "***REDACTED***"
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                request_body = "<non-json-body>"
+
+        method = scope["method"]
+        path = scope["path"]
+        client = scope.get("client")
+        log_data = {
+            "admin_id": payload.get("uid") if payload else None,
+            "admin_username": payload["sub"] if payload else "unknown",
+            "method": method,
+            "path": path,
+            "query_params": dict(QueryParams(scope.get("query_string", b""))),
+            "request_body": request_body,
+            "status_code": status_code,
+            "latency_ms": round(process_time * 1000, 2),
+            "client_ip": client[0] if client else None,
+            "user_agent": Headers(scope=scope).get("user-agent"),
+        }
+
+        # Log level based on action type; serialized by the log writer thread
+        if method == "DELETE" or "delete" in path:
+            logger.warning("ADMIN DELETE ACTION: %s %s", method, path, extra={"audit": log_data})
+        elif method in ("POST", "PUT", "PATCH"):
+            logger.info("ADMIN MODIFY ACTION: %s %s", method, path, extra={"audit": log_data})
+        else:
+            logger.info("ADMIN READ ACTION: %s %s", method, path, extra={"audit": log_data})
+
+    async def _error(self, scope: Scope, receive: Receive, send: Send,
+                     status_code: int, detail: str, headers: Optional[dict] = None) -> None:
+        response = JSONResponse(
+            status_code=status_code,
+            content={"detail": detail, "status": status_code},
+            headers={**ADMIN_SECURITY_HEADERS, **(headers or {})},
+        )
+        await response(scope, receive, send)
 
 
 # Convenience function to add all admin middleware
 def add_admin_middleware(app):
-    """Add all admin-specific middleware to the application"""
-    app.add_middleware(AdminRequestValidationMiddleware)
-    app.add_middleware(AdminSecurityMiddleware)
-    app.add_middleware(AdminRateLimitMiddleware)
-    app.add_middleware(AdminAuditLogMiddleware)
\ No newline at end of file
+    """Add the admin middleware to the application"""
+    app.add_middleware(AdminMiddleware)
@@ -1,84 +1,174 @@
 # Core Middleware - Unified essential middleware for assignment environment
+#
+# Pure ASGI middleware: headers are added to the http.response.start message
+# and body messages are passed through untouched, so streaming responses and
+# request bodies are never buffered.
 import time
 import uuid
 import logging
-from typing import Callable
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from fastapi import HTTPException
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.logging_config import access_logger, request_id_var, should_log_access, user_var
+from app.core.metrics import HTTP_IN_FLIGHT, HTTP_REQUEST_DURATION, HTTP_REQUESTS, route_label
+from app.core.query_stats import QueryStats, query_stats_var
+from app.core.config import settings
+from app.core.tracing import end_trace, start_trace
 
 logger = logging.getLogger(__name__)
 
 
-class CoreMiddleware(BaseHTTPMiddleware):
+class CoreMiddleware:
     """Unified core middleware combining request ID, logging, timing, and security"""
 
     def __init__(self, app: ASGIApp, api_version: str = "1.0.0"):
-        super().__init__(app)
+        self.app = app
         self.api_version = api_version
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        # 1. Generate request ID
-        request_id = str(uuid.uuid4())
-        request.state.request_id = request_id
-
-        # 2. Start timing
-        start_time = time.time()
-
-        # 3. Log request
-        logger.info(
-            f"Request {request_id}: {request.method} {request.url.path} "
-            f"from {request.client.host if request.client else 'unknown'}"
-        )
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-        try:
-            # Process request
-            response = await call_next(request)
-
-            # 4. Calculate timing
-            process_time = time.time() - start_time
-
-            # 5. Add security headers
-            response.headers["X-Request-ID"] = request_id
-            response.headers["X-API-Version"] = self.api_version
-            response.headers["X-Content-Type-Options"] = "nosniff"
-            response.headers["X-Frame-Options"] = "DENY"
-            response.headers["X-XSS-Protection"] = "1; mode=block"
-            response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-            response.headers["X-Process-Time"] = str(process_time)
-
-            # 6. Log response
-            logger.info(
-                f"Response {request_id}: {response.status_code} "
-                f"({process_time:.3f}s)"
+        # 1. Generate request ID (exposed as request.state.request_id and to log records)
+        #    and collect this request's database statements (request.state.query_stats)
+        request_id = str(uuid.uuid4())
+        scope.setdefault("state", {})["request_id"] = request_id
+        request_id_token = request_id_var.set(request_id)
+        user_token = user_var.set(None)
+        query_stats = QueryStats()
+        scope["state"]["query_stats"] = query_stats
+        query_stats_token = query_stats_var.set(query_stats)
+
+        # 2. Start timing and the request's trace (root span)
+        start_time = time.perf_counter()
+        status_code = 500
+        HTTP_IN_FLIGHT.inc()
+        trace = None
+        if settings.TRACING_ENABLED:
+            trace, root_span, trace_tokens = start_trace(
+                request_id, f"{scope['method']} {scope['path']}",
+                **{"http.method": scope["method"], "http.target": scope["path"]},
             )
 
-            return response
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+                # 3. Calculate timing
+                process_time = time.perf_counter() - start_time
+
+                # 4. Add security headers
+                headers = MutableHeaders(scope=message)
+                headers["X-Request-ID"] = request_id
+                headers["X-API-Version"] = self.api_version
+                headers["X-Content-Type-Options"] = "nosniff"
+                headers["X-Frame-Options"] = "DENY"
+                headers["X-XSS-Protection"] = "1; mode=block"
+                headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+                headers["X-Process-Time"] = str(process_time)
+                headers["Server-Timing"] = (
+                    f'db;dur={query_stats.duration_ms:.1f};desc="{query_stats.count} queries", '
+                    f"app;dur={process_time * 1000:.1f}"
+                )
+            await send(message)
 
+        try:
+            await self.app(scope, receive, send_wrapper)
         except Exception as e:
-            process_time = time.time() - start_time
+            process_time = time.perf_counter() - start_time
             logger.error(
-                f"Error {request_id}: {str(e)} ({process_time:.3f}s)", 
+                "Error %s: %s (%.3fs)", request_id, e, process_time,
                 exc_info=True
             )
             raise
+        finally:
+            # 5. Metrics, labelled by route template
+            elapsed = time.perf_counter() - start_time
+            HTTP_IN_FLIGHT.dec()
+            route = route_label(scope)
+            HTTP_REQUESTS.labels(scope["method"], route, status_code).inc()
+            HTTP_REQUEST_DURATION.labels(scope["method"], route).observe(elapsed)
+            if trace is not None:
+                root_span.name = f"{scope['method']} {route}"
+                root_span.set_attribute("http.route", route)
+                root_span.set_attribute("http.status_code", status_code)
+                if status_code >= 500:
+                    root_span.set_error(f"HTTP {status_code}")
+                    trace.failed = True
+                end_trace(trace, root_span, trace_tokens)
+
+            # 6. Access log, one sampled record per request
+            latency_ms = elapsed * 1000
+            if access_logger.isEnabledFor(logging.INFO) and should_log_access(status_code, latency_ms):
+                client = scope.get("client")
+                access_logger.info(
+                    "%s %s %s", scope["method"], scope["path"], status_code,
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status_code,
+                        "latency_ms": round(latency_ms, 2),
+                        "db_queries": query_stats.count,
+                        "db_ms": round(query_stats.duration_ms, 2),
+                        "client": client[0] if client else None,
+                    },
+                )
+            request_id_var.reset(request_id_token)
+            user_var.reset(user_token)
+            query_stats_var.reset(query_stats_token)
+
 
+class RequestTooLarge(HTTPException):
+    """Raised from receive() once a streamed request body passes the size limit"""
+
+    def __init__(self, max_size: int):
+        super().__init__(status_code=413, detail="Request entity too large")
+        self.max_size = max_size
 
-class RequestSizeMiddleware(BaseHTTPMiddleware):
-    """Request size limitation middleware"""
+
+class RequestSizeMiddleware:
+    """
+    Request size limitation middleware
+
+    Requests declaring a larger Content-Length are rejected up front; bodies
+    without one (chunked uploads) are counted as they stream in and fail
+    with 413 as soon as they pass the limit.
+    """
 
     def __init__(self, app: ASGIApp, max_size: int = 5 * 1024 * 1024):  # 5MB
-        super().__init__(app)
+        self.app = app
         self.max_size = max_size
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        if request.headers.get("content-length"):
-            content_length = int(request.headers["content-length"])
-            if content_length > self.max_size:
-                logger.warning(f"Request too large: {content_length} bytes")
-                return Response(
-                    content="Request entity too large",
-                    status_code=413
-                )
-        
-        return await call_next(request)
\ No newline at end of file
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit():
+            if int(content_length) > self.max_size:
+                logger.warning("Request too large: %s bytes", content_length)
+                await send({
+                    "type": "http.response.start",
+                    "status": 413,
+                    "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+                })
+                await send({"type": "http.response.body", "body": b"Request entity too large"})
+                return
+
+        received = 0
+
+        async def receive_wrapper() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    logger.warning("Request too large: more than %s bytes streamed", received)
+                    raise RequestTooLarge(self.max_size)
+            return message
+
+        await self.app(scope, receive_wrapper, send)
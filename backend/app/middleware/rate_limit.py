@@ -1,54 +1,103 @@
-import os
-from fastapi import Request
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
+"""
+In-process token-bucket rate limiting
 
+Requests are keyed by the JWT subject (signature checked, no DB lookup) or,
+for anonymous requests, by client IP. Each scope (chat, auth, read) has its
+own budget of N requests per minute, refilled continuously. Buckets live in
+the backend chosen by RATE_LIMIT_STORAGE (see rate_limit_store).
+"""
+import math
+from typing import Callable, Dict
 
-# Create limiter instance
-def get_identifier(request: Request):
-    """Get identifier for rate limiting (IP address or user ID if authenticated)"""
-    # Try to get user ID from JWT token if available
-    try:
-        from app.auth.dependencies import get_current_user_optional
-        from app.database import SessionLocal
+from fastapi import HTTPException, Request, status
 
-        # Get authorization header
-        auth_header = request.headers.get("Authorization", "")
-        if auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-            db = SessionLocal()
-            try:
-                user = get_current_user_optional(token=token, db=db)
-                if user:
-                    return f"user:{user.user_id}"
-            finally:
-                db.close()
-    except:
-        pass
+from app.auth.jwt import decode_token
+from app.core.config import settings
+from app.middleware.rate_limit_store import rate_limit_store
 
-    # Fallback to IP address
-    return get_remote_address(request)
 
+class RateLimitExceeded(HTTPException):
+    """Raised when a key has no tokens left in its bucket"""
 
-# Create limiter with custom key function
-limiter = Limiter(key_func=get_identifier)
+    def __init__(self, scope: str, limit: int, retry_after: float):
+        self.scope = scope
+        self.limit = limit
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Rate limit exceeded: {limit} per minute",
+            headers={
+                "Retry-After": str(self.retry_after),
+                "X-RateLimit-Limit": str(limit),
+            },
+        )
 
-# Rate limit configurations from environment
-RATE_LIMIT_PER_MINUTE = int(os.getenv("RATE_LIMIT_PER_MINUTE", "100"))
-CHAT_RATE_LIMIT_PER_MINUTE = int(os.getenv("CHAT_RATE_LIMIT_PER_MINUTE", "20"))
 
+def get_identifier(request: Request) -> str:
+    """Rate limit key: JWT subject if a valid bearer token is present, otherwise client IP"""
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        payload = decode_token(auth_header[7:])
+        if payload is not None:
+            return f"user:{payload.get('uid', payload['sub'])}"
 
-# Standard rate limit decorator
-def rate_limit(limit: str = f"{RATE_LIMIT_PER_MINUTE}/minute"):
-    """Standard rate limit decorator"""
-    return limiter.limit(limit)
+    return f"ip:{request.client.host if request.client else 'unknown'}"
 
 
-# Chat-specific rate limit decorator
-def chat_rate_limit(limit: str = f"{CHAT_RATE_LIMIT_PER_MINUTE}/minute"):
-    """Chat-specific rate limit decorator"""
-    return limiter.limit(limit)
+class Limiter:
+    """Applies per-scope token buckets to requests"""
+
+    def __init__(self, limits: Dict[str, int], key_func: Callable[[Request], str], store, enabled: bool = True):
+        self.limits = limits
+        self.key_func = key_func
+        self.store = store
+        self.enabled = enabled
+
+    def hit(self, scope: str, request: Request) -> None:
+        limit = self.limits[scope]
+        if not self.enabled or limit <= 0:
+            return
+
+        # Separate buckets per scope so chat traffic does not consume the read budget
+        retry_after = self.store.hit(f"{scope}:{self.key_func(request)}", limit)
+        if retry_after:
+            raise RateLimitExceeded(scope, limit, retry_after)
+
+    def reset(self) -> None:
+        self.store.clear()
+
+
+limiter = Limiter(
+    limits={
+        "chat": settings.CHAT_RATE_LIMIT_PER_MINUTE,
+        "auth": settings.AUTH_RATE_LIMIT_PER_MINUTE,
+        "read": settings.RATE_LIMIT_PER_MINUTE,
+    },
+    key_func=get_identifier,
+    store=rate_limit_store,
+    enabled=settings.RATE_LIMIT_ENABLED,
+)
+
+_dependencies: Dict[str, Callable] = {}
+
+
+def rate_limit(scope: str = "read") -> Callable:
+    """Dependency applying the given scope's budget: ``dependencies=[Depends(rate_limit("auth"))]``"""
+    if scope not in limiter.limits:
+        raise ValueError(f"Unknown rate limit scope: {scope}")
+
+    if scope not in _dependencies:
+        async def dependency(request: Request) -> None:
+            limiter.hit(scope, request)
+
+        _dependencies[scope] = dependency
+    return _dependencies[scope]
+
+
+# Chat-specific rate limit dependency
+chat_rate_limit = rate_limit("chat")
+auth_rate_limit = rate_limit("auth")
+read_rate_limit = rate_limit("read")
 
 
 # Export for use in main.py
@@ -56,6 +105,7 @@ __all__ = [
     "limiter",
     "rate_limit",
     "chat_rate_limit",
+    "auth_rate_limit",
+    "read_rate_limit",
     "RateLimitExceeded",
-    "_rate_limit_exceeded_handler",
 ]
@@ -0,0 +1,266 @@
+"""
+Rate limit storage backends
+
+Every backend implements ``hit(key, limit, period) -> retry_after``,
+allowing about ``limit`` requests per ``period`` seconds for the key.
+``retry_after`` is 0 when the request is allowed.
+
+- ``MemoryRateLimitStore``: per process, fastest, limits multiply with workers
+- ``SlidingWindowRateLimitStore``: per process, exact N-per-window counts
+  (ring buffer per key) instead of a token bucket
+- ``SQLiteRateLimitStore``: one local file shared by every worker on the host,
+  each hit is a single atomic UPSERT on a token bucket
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryRateLimitStore:
+    """
+    Token buckets (``limit`` tokens refilled over ``period``) kept as
+    (tokens, updated_at) per key in this process
+
+    Buckets are refilled lazily on access. A bucket that has been idle long
+    enough to refill completely is equivalent to a missing one, so idle
+    buckets at the LRU end are dropped as new ones arrive and the number of
+    keys is capped at ``maxsize``.
+    """
+
+    shared = False
+
+    def __init__(self, maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def hit(self, key: str, limit: int, period: float = 60.0) -> float:
+        """Take one token; returns 0 if allowed, otherwise seconds until a token is available"""
+        now = time.monotonic()
+        rate = limit / period
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = float(limit)
+        else:
+            tokens = min(limit, bucket[0] + (now - bucket[1]) * rate)
+            self._buckets.move_to_end(key)
+
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            retry_after = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            retry_after = (1 - tokens) / rate
+
+        self._expire(now, period)
+        return retry_after
+
+    def _expire(self, now: float, refill_seconds: float) -> None:
+        # Only the least recently used buckets are inspected: constant work per call
+        for _ in range(2):
+            if not self._buckets:
+                return
+            key, (_, updated_at) = next(iter(self._buckets.items()))
+            if now - updated_at < refill_seconds and len(self._buckets) <= self.maxsize:
+                return
+            del self._buckets[key]
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+    def close(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SlidingWindowRateLimitStore:
+    """
+    Per-key sliding windows kept as fixed-size ring buffers in this process
+
+    The window of ``period`` seconds is split into ``slots`` buckets; each
+    key holds one count per bucket plus their running total. A hit advances
+    the ring by at most ``slots`` buckets and touches no other key, so the
+    cost does not grow with the number of tracked keys. Keys are kept in
+    LRU order and capped at ``maxsize``; idle keys are dropped lazily.
+    """
+
+    shared = False
+
+    def __init__(self, maxsize: int = 10_000, slots: int = 6):
+        self.maxsize = maxsize
+        self.slots = slots
+        # key -> [counts, newest slot number, total]
+        self._windows: "OrderedDict[str, list]" = OrderedDict()
+
+    def hit(self, key: str, limit: int, period: float = 60.0) -> float:
+        """Count one request; returns 0 if allowed, otherwise seconds until the window has room"""
+        slot_seconds = period / self.slots
+        now = time.monotonic()
+        slot = int(now // slot_seconds)
+
+        window = self._windows.get(key)
+        if window is None:
+            window = [[0] * self.slots, slot, 0]
+            self._windows[key] = window
+        else:
+            self._windows.move_to_end(key)
+            self._advance(window, slot)
+
+        counts = window[0]
+        if window[2] >= limit:
+            # Room opens when the oldest non-empty slot leaves the window
+            for oldest in range(slot - self.slots + 1, slot + 1):
+                if counts[oldest % self.slots]:
+                    break
+            return (oldest + self.slots) * slot_seconds - now
+
+        counts[slot % self.slots] += 1
+        window[2] += 1
+        self._expire(slot)
+        return 0.0
+
+    def _advance(self, window: list, slot: int) -> None:
+        counts, newest, _ = window
+        if slot - newest >= self.slots:
+            counts[:] = [0] * self.slots
+            window[2] = 0
+        else:
+            for stale in range(newest + 1, slot + 1):
+                window[2] -= counts[stale % self.slots]
+                counts[stale % self.slots] = 0
+        window[1] = slot
+
+    def _expire(self, slot: int) -> None:
+        # Only the least recently used windows are inspected: constant work per call
+        for _ in range(2):
+            key, window = next(iter(self._windows.items()))
+            if slot - window[1] < self.slots and len(self._windows) <= self.maxsize:
+                return
+            del self._windows[key]
+
+    def clear(self) -> None:
+        self._windows.clear()
+
+    def close(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+
+# Refilled token count of the existing row, evaluated against the old values
+_REFILLED = "min(:limit, tokens + (:now - updated) * :rate)"
+
+_HIT_SQL = f"""
+INSERT INTO rate_buckets (key, tokens, updated, expires, allowed)
+VALUES (:key, :limit - 1, :now, :now + 1 / :rate, 1)
+ON CONFLICT (key) DO UPDATE SET
+    allowed = {_REFILLED} >= 1,
+    tokens = {_REFILLED} - ({_REFILLED} >= 1),
+    updated = :now,
+    expires = :now + (:limit - ({_REFILLED} - ({_REFILLED} >= 1))) / :rate
+RETURNING tokens, allowed
+"""
+
+
+class SQLiteRateLimitStore:
+    """
+    Token buckets in a SQLite file shared by all workers on the host
+
+    Each hit is one UPSERT ... RETURNING statement, so the read-modify-write
+    is atomic across processes without explicit locking. The database runs
+    with WAL and synchronous=OFF: counters are disposable and a crash only
+    loses recent hits. Rows of buckets that have refilled completely are
+    purged every ``purge_every`` hits. Hits run on the event loop: if the
+    file is locked for longer than ``busy_timeout_ms`` the request is allowed
+    (fail open), so a contended file stalls the loop for a few milliseconds
+    at most. An uncontended hit takes tens of microseconds.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5, purge_every: int = 1024):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.purge_every = purge_every
+        self._hits = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection must not cross fork() (gunicorn --preload), so reopen per process
+        if self._conn is None or self._pid != os.getpid():
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, "
+                "expires REAL NOT NULL, allowed INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def hit(self, key: str, limit: int, period: float = 60.0) -> float:
+        now = time.time()
+        rate = limit / period
+        try:
+            with self._lock:
+                conn = self._connect()
+                tokens, allowed = conn.execute(
+                    _HIT_SQL, {"key": key, "limit": limit, "now": now, "rate": rate}
+                ).fetchone()
+
+                self._hits += 1
+                if self._hits % self.purge_every == 0:
+                    conn.execute("DELETE FROM rate_buckets WHERE expires < ?", (now,))
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Rate limit storage unavailable, allowing request: {e}")
+            return 0.0
+
+        if allowed:
+            return 0.0
+        return (1 - tokens) / rate
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connect().execute("DELETE FROM rate_buckets")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT count(*) FROM rate_buckets").fetchone()[0]
+
+
+def create_rate_limit_store(storage: str = None):
+    """Build the backend selected by RATE_LIMIT_STORAGE (memory|sqlite)"""
+    storage = (storage or settings.RATE_LIMIT_STORAGE).lower()
+    if storage == "memory":
+        return MemoryRateLimitStore(maxsize=settings.RATE_LIMIT_MAX_KEYS)
+    if storage == "sqlite":
+        return SQLiteRateLimitStore(settings.RATE_LIMIT_STORAGE_PATH)
+    raise ValueError(f"Unknown RATE_LIMIT_STORAGE: {storage}")
+
+
+# Shared by the public limiter and the admin rate limit middleware
+rate_limit_store = create_rate_limit_store()
@@ -11,6 +11,7 @@ from .character import Character
 from .chat import Chat
 from .stats import UsageStat
 from .conversation_summary import ConversationSummary
+from .avatar_blob import AvatarBlob
 
 # Export all models
 __all__ = [
@@ -19,5 +20,6 @@ __all__ = [
     "Character", 
     "Chat",
     "UsageStat",
-    "ConversationSummary"
+    "ConversationSummary",
+    "AvatarBlob"
 ]
\ No newline at end of file
@@ -0,0 +1,17 @@
+"""
+Content-addressed avatar blob model
+"""
+from sqlalchemy import Column, String, Integer, DateTime
+from sqlalchemy.sql import func
+
+from .base import Base
+
+
+class AvatarBlob(Base):
+    """Reference count of one stored avatar, shared by every character that uses it"""
+    __tablename__ = "avatar_blobs"
+
+    content_hash = Column(String(64), primary_key=True)  # sha256 of the uploaded image
+    ref_count = Column(Integer, nullable=False, default=0)  # 참조 중인 캐릭터 수, GC 진행 중이면 -1
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    released_at = Column(DateTime(timezone=True), nullable=True, index=True)  # 마지막으로 참조가 해제된 시각
@@ -1,20 +1,31 @@
+import asyncio
+from collections import defaultdict
 from typing import List, Optional
 from datetime import datetime, date, timedelta
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import func, and_, select, or_
+from sqlalchemy import Select, func, and_, literal, null, select, or_, union_all
 from app.database import get_db
-from app.auth.dependencies import require_admin
+from app.sharding import ShardSessions, get_chat_shards
+from app.auth.dependencies import Principal, require_admin, require_admin_principal
+from app.auth.user_cache import invalidate_user
 from app.models import User, Chat, UsageStat, Character
 from app.schemas.user import AdminUserResponse, AdminUserPaginatedResponse
 from app.schemas.stats import AdminStatsResponse, UsageStatResponse
 from app.schemas.chat import ChatResponse, ChatRole
 from app.schemas.character import CharacterCreate, CharacterUpdate, CharacterResponse, CharacterListResponse
-from app.routers.character import create_character_response, get_avatar_path_from_filename
+from app.routers.character import character_rows, create_character_response
+from app.routers.chat import chat_rows
+from app.core.serialization import ORJSONResponse, RowSerializer
+from app.services.avatar_storage import avatar_storage
 from app.schemas.user import UserUpdate, UserResponse
 
 router = APIRouter()
 
+# Users per activity statement; each binds the IDs twice, well under
+# SQLite's limit of 32766 variables
+ACTIVITY_BATCH_SIZE = 500
+
 
 def validate_user_id(user_id: str) -> int:
     """Validate and convert user_id string to integer"""
@@ -27,12 +38,82 @@ def validate_user_id(user_id: str) -> int:
         raise HTTPException(status_code=400, detail="Invalid user ID: must be a valid integer")
 
 
+def user_activity_query(user_ids: List[int]) -> Select:
+    """
+    (user_id, characters chatted with, last activity, total tokens) for the given users
+
+    Chats and usage stats are aggregated per user in one statement: both
+    grouped selects are combined and summed, so users with only one kind
+    of row are included.
+    """
+    chats = (
+        select(
+            Chat.user_id.label("user_id"),
+            func.count(func.distinct(Chat.character_id)).label("total_chats"),
+            func.max(Chat.created_at).label("last_active"),
+            literal(0).label("total_tokens"),
+        )
+        .where(Chat.user_id.in_(user_ids))
+        .group_by(Chat.user_id)
+    )
+    tokens = (
+        select(UsageStat.user_id, literal(0), null(), func.coalesce(func.sum(UsageStat.token_count), 0))
+        .where(UsageStat.user_id.in_(user_ids))
+        .group_by(UsageStat.user_id)
+    )
+    activity = union_all(chats, tokens).subquery()
+    return select(
+        activity.c.user_id,
+        func.sum(activity.c.total_chats),
+        func.max(activity.c.last_active),
+        func.sum(activity.c.total_tokens),
+    ).group_by(activity.c.user_id)
+
+
+async def add_user_activity(shards: ShardSessions, user_responses: List[dict]) -> None:
+    """
+    Fill in the activity fields of listed users, one query per shard holding
+    any of them (and per ACTIVITY_BATCH_SIZE users on it)
+    """
+    async def load_activity(chat_db: AsyncSession, user_ids: List[int]):
+        rows = []
+        for start in range(0, len(user_ids), ACTIVITY_BATCH_SIZE):
+            result = await chat_db.execute(user_activity_query(user_ids[start:start + ACTIVITY_BATCH_SIZE]))
+            rows.extend(result.all())
+        return rows
+
+    groups = shards.group_users(user_response["user_id"] for user_response in user_responses)
+    activity = {}
+    for rows in await asyncio.gather(*(load_activity(chat_db, user_ids) for chat_db, user_ids in groups)):
+        for user_id, total_chats, last_active, total_tokens in rows:
+            activity[user_id] = (total_chats, last_active, total_tokens)
+
+    for user_response in user_responses:
+        total_chats, last_active, total_tokens = activity.get(user_response["user_id"], (0, None, 0))
+        user_response["total_chats"] = total_chats
+        user_response["total_tokens"] = total_tokens
+        user_response["last_active"] = last_active
+
+
+# User listing columns; activity fields are filled in from the chat shards
+admin_user_rows = RowSerializer(AdminUserResponse, {
+    "username": User.username,
+    "email": User.email,
+    "user_id": User.user_id,
+    "is_admin": User.is_admin,
+    "is_active": User.is_active,
+    "created_at": User.created_at,
+    "updated_at": User.updated_at,
+})
+
+
 @router.get("/users", response_model=AdminUserPaginatedResponse)
 async def get_all_users(
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1),
-    current_admin: User = Depends(require_admin),
+    current_admin: Principal = Depends(require_admin_principal),
     db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Get all users with their statistics (Admin only)"""
     skip = (page - 1) * limit
@@ -42,60 +123,19 @@ async def get_all_users(
     total = total_result.scalar()
 
     # Get users with pagination
-    users_result = await db.execute(select(User).offset(skip).limit(limit))
-    users = users_result.scalars().all()
-
-    # Build response with stats for each user
-    user_responses = []
-    for user in users:
-        # Get user stats
-        total_chats_result = await db.execute(
-            select(func.count(func.distinct(Chat.character_id)))
-            .select_from(Chat)
-            .where(Chat.user_id == user.user_id)
-        )
-        total_chats = total_chats_result.scalar()
-
-        # Get last activity
-        last_chat_result = await db.execute(
-            select(Chat)
-            .where(Chat.user_id == user.user_id)
-            .order_by(Chat.created_at.desc())
-            .limit(1)
-        )
-        last_chat = last_chat_result.scalar_one_or_none()
-        last_active = last_chat.created_at if last_chat else None
+    users_result = await db.execute(admin_user_rows.select().offset(skip).limit(limit))
+    user_responses = admin_user_rows.rows(users_result)
 
+    # Add stats for the page's users from their shards
+    await add_user_activity(shards, user_responses)
 
-        # Get total tokens used by this user
-        total_tokens_result = await db.execute(
-            select(func.coalesce(func.sum(UsageStat.token_count), 0))
-            .where(UsageStat.user_id == user.user_id)
-        )
-        total_tokens = total_tokens_result.scalar() or 0
-
-        # Create response
-        user_response = AdminUserResponse(
-            user_id=user.user_id,
-            username=user.username,
-            email=user.email,
-            is_admin=user.is_admin,
-            is_active=user.is_active,
-            created_at=user.created_at,
-            updated_at=user.updated_at,
-            total_chats=total_chats,
-            total_tokens=total_tokens,
-            last_active=last_active,
-        )
-        user_responses.append(user_response)
-
-    return AdminUserPaginatedResponse(
-        items=user_responses,
-        total=total,
-        page=page,
-        pages=(total + limit - 1) // limit,
-        limit=limit,
-    )
+    return ORJSONResponse({
+        "items": user_responses,
+        "total": total,
+        "page": page,
+        "pages": (total + limit - 1) // limit,
+        "limit": limit,
+    })
 
 
 @router.get("/users/{user_id}/chats")
@@ -104,8 +144,9 @@ async def get_user_chats(
     character_id: Optional[int] = None,
     page: int = Query(1, ge=1),
     limit: int = Query(50, ge=1),
-    current_admin: User = Depends(require_admin),
+    current_admin: Principal = Depends(require_admin_principal),
     db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Get chats for a specific user (Admin only)"""
     user_id_int = validate_user_id(user_id)
@@ -119,42 +160,41 @@ async def get_user_chats(
     skip = (page - 1) * limit
 
     # Build query
-    query = select(Chat).where(Chat.user_id == user_id_int)
+    query = chat_rows.select().where(Chat.user_id == user_id_int)
     count_query = select(func.count()).select_from(Chat).where(Chat.user_id == user_id_int)
     
     if character_id:
         query = query.where(Chat.character_id == character_id)
         count_query = count_query.where(Chat.character_id == character_id)
     
+    chat_db = shards.for_user(user_id_int)
+
     # Get total chat count
-    total_result = await db.execute(count_query)
+    total_result = await chat_db.execute(count_query)
     total = total_result.scalar()
 
     # Get chats with pagination
-    chats_result = await db.execute(
+    chats_result = await chat_db.execute(
         query.order_by(Chat.created_at.desc())
         .offset(skip)
         .limit(limit)
     )
-    chats = chats_result.scalars().all()
-
-    # Convert to response
-    chat_responses = [ChatResponse.model_validate(chat) for chat in chats]
 
-    return {
-        "items": chat_responses,
+    return ORJSONResponse({
+        "items": chat_rows.rows(chats_result),
         "total": total,
         "page": page,
         "pages": (total + limit - 1) // limit,
         "limit": limit,
-    }
+    })
 
 
 @router.get("/users/{user_id}/characters")
 async def get_user_character_stats(
     user_id: str,
-    current_admin: User = Depends(require_admin),
+    current_admin: Principal = Depends(require_admin_principal),
     db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Get character chat statistics for a specific user (Admin only)"""
     user_id_int = validate_user_id(user_id)
@@ -165,40 +205,35 @@ async def get_user_character_stats(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Get characters that the user has chatted with
-    characters_query = await db.execute(
-        select(Character, func.count(Chat.chat_id).label('chat_count'))
-        .join(Chat, Character.character_id == Chat.character_id)
+    # Aggregate the user's chats per character on the user's shard
+    stats_result = await shards.for_user(user_id_int).execute(
+        select(
+            Chat.character_id,
+            func.count(Chat.chat_id).label('chat_count'),
+            func.min(Chat.created_at).label('first_chat_time'),
+            func.max(Chat.created_at).label('last_chat_time'),
+            # Count unique conversation sessions (simplified - just count days with chats)
+            func.count(func.distinct(func.date(Chat.created_at))).label('conversation_days'),
+        )
         .where(Chat.user_id == user_id_int)
-        .group_by(Character.character_id)
+        .group_by(Chat.character_id)
         .order_by(func.max(Chat.created_at).desc())
     )
-    
+    rows = stats_result.all()
+
+    # Characters live in the main database
+    characters_result = await db.execute(
+        select(Character).where(Character.character_id.in_([row.character_id for row in rows]))
+    )
+    characters = {character.character_id: character for character in characters_result.scalars()}
+
     character_stats = []
-    for character, chat_count in characters_query:
-        # Get first and last chat times
-        first_chat_result = await db.execute(
-            select(Chat.created_at)
-            .where(and_(Chat.user_id == user_id_int, Chat.character_id == character.character_id))
-            .order_by(Chat.created_at.asc())
-            .limit(1)
-        )
-        first_chat_time = first_chat_result.scalar()
-        
-        last_chat_result = await db.execute(
-            select(Chat.created_at)
-            .where(and_(Chat.user_id == user_id_int, Chat.character_id == character.character_id))
-            .order_by(Chat.created_at.desc())
-            .limit(1)
-        )
-        last_chat_time = last_chat_result.scalar()
-        
-        # Count unique conversation sessions (simplified - just count days with chats)
-        conversation_days_result = await db.execute(
-            select(func.count(func.distinct(func.date(Chat.created_at))))
-            .where(and_(Chat.user_id == user_id_int, Chat.character_id == character.character_id))
-        )
-        conversation_count = conversation_days_result.scalar() or 1
+    for row in rows:
+        character = characters.get(row.character_id)
+        if character is None:
+            continue
+        chat_count = row.chat_count
+        conversation_count = row.conversation_days or 1
         
         # Calculate average chats per conversation and duration
         avg_chats_per_conversation = chat_count / conversation_count if conversation_count > 0 else 0
@@ -212,8 +247,8 @@ async def get_user_character_stats(
             "avatar_url": character.avatar_url,
             "chatCount": conversation_count,
             "messageCount": chat_count,
-            "lastChatDate": last_chat_time,
-            "firstChatDate": first_chat_time,
+            "lastChatDate": row.last_chat_time,
+            "firstChatDate": row.first_chat_time,
             "avgMessagesPerChat": round(avg_chats_per_conversation, 1),
             "avgChatDuration": avg_chat_duration
         })
@@ -226,8 +261,9 @@ async def get_user_usage_stats(
     user_id: str,
     start_date: Optional[date] = Query(None, description="Start date (YYYY-MM-DD)"),
     end_date: Optional[date] = Query(None, description="End date (YYYY-MM-DD)"),
-    current_admin: User = Depends(require_admin),
+    current_admin: Principal = Depends(require_admin_principal),
     db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Get usage statistics for a specific user (Admin only)"""
     user_id_int = validate_user_id(user_id)
@@ -253,7 +289,7 @@ async def get_user_usage_stats(
         )
     ).order_by(UsageStat.usage_date.desc())
     
-    result = await db.execute(query)
+    result = await shards.for_user(user_id_int).execute(query)
     stats = result.scalars().all()
 
     return [UsageStatResponse.model_validate(stat) for stat in stats]
@@ -263,7 +299,10 @@ async def get_user_usage_stats(
 
 @router.post("/users/{user_id}/toggle-admin", response_model=AdminUserResponse)
 async def toggle_admin_status(
-    user_id: str, current_admin: User = Depends(require_admin), db: AsyncSession = Depends(get_db)
+    user_id: str,
+    current_admin: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Toggle admin status for a user (Admin only)"""
     user_id_int = validate_user_id(user_id)
@@ -278,49 +317,17 @@ async def toggle_admin_status(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Toggle admin status
+    # Toggle admin status and revoke tokens carrying the old claims
     user.is_admin = not user.is_admin
+    user.token_version = (user.token_version or 0) + 1
     await db.commit()
-    await db.refresh(user)
+    invalidate_user(user)
 
-    # Get user stats to return complete AdminUserResponse
-    total_chats_result = await db.execute(
-        select(func.count(func.distinct(Chat.character_id)))
-        .select_from(Chat)
-        .where(Chat.user_id == user.user_id)
-    )
-    total_chats = total_chats_result.scalar()
-
-    # Get last activity
-    last_chat_result = await db.execute(
-        select(Chat)
-        .where(Chat.user_id == user.user_id)
-        .order_by(Chat.created_at.desc())
-        .limit(1)
-    )
-    last_chat = last_chat_result.scalar_one_or_none()
-    last_active = last_chat.created_at if last_chat else None
-
-    # Get total tokens used by this user
-    total_tokens_result = await db.execute(
-        select(func.coalesce(func.sum(UsageStat.token_count), 0))
-        .where(UsageStat.user_id == user.user_id)
-    )
-    total_tokens = total_tokens_result.scalar() or 0
-
-    # Return complete AdminUserResponse
-    return AdminUserResponse(
-        user_id=user.user_id,
-        username=user.username,
-        email=user.email,
-        is_admin=user.is_admin,
-        is_active=user.is_active,
-        created_at=user.created_at,
-        updated_at=user.updated_at,
-        total_chats=total_chats,
-        total_tokens=total_tokens,
-        last_active=last_active,
-    )
+    # Return the user as the listing does
+    user_result = await db.execute(admin_user_rows.select().where(User.user_id == user_id_int))
+    user_responses = admin_user_rows.rows(user_result)
+    await add_user_activity(shards, user_responses)
+    return ORJSONResponse(user_responses[0])
 
 
 @router.put("/users/{user_id}")
@@ -343,8 +350,13 @@ async def update_user(
     for field, value in update_data.items():
         setattr(user, field, value)
     
+    # is_active is carried in token claims; revoke tokens issued before the change
+    if "is_active" in update_data:
+        user.token_version = (user.token_version or 0) + 1
+    
     user.updated_at = datetime.utcnow()
     await db.commit()
+    invalidate_user(user)
     await db.refresh(user)
     
     return {"message": "User updated successfully", "user": UserResponse.model_validate(user)}
@@ -352,7 +364,10 @@ async def update_user(
 
 @router.delete("/users/{user_id}")
 async def delete_user(
-    user_id: str, current_admin: User = Depends(require_admin), db: AsyncSession = Depends(get_db)
+    user_id: str,
+    current_admin: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Delete a user and all their data (Admin only)"""
     user_id_int = validate_user_id(user_id)
@@ -366,9 +381,20 @@ async def delete_user(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Delete user (cascading will handle related data)
+    # The cascade deletes the user's characters; drop their avatar references with them
+    avatar_urls = await db.scalars(
+        select(Character.avatar_url).where(
+            Character.created_by == user_id_int, Character.avatar_url.is_not(None)
+        )
+    )
+    for avatar_url in avatar_urls.all():
+        await avatar_storage.release(db, avatar_url)
+
+    # Delete user (cascading will handle related data; sharded chat data is removed explicitly)
+    await shards.delete_user_data(user_id_int)
     await db.delete(user)
-    await db.commit()
+    await shards.commit_all()
+    invalidate_user(user)
     
     return {"message": f"User {user.username} and all related data deleted successfully"}
 
@@ -381,12 +407,13 @@ async def get_all_characters(
     limit: int = Query(20, ge=1),
     search: Optional[str] = None,
     is_active: Optional[bool] = None,
-    current_admin: User = Depends(require_admin),
+    current_admin: Principal = Depends(require_admin_principal),
     db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Get all characters across all users (Admin only) with statistics"""
     # Build query
-    query = select(Character)
+    query = character_rows.select()
     
     # Apply filters
     if search:
@@ -408,36 +435,42 @@ async def get_all_characters(
     # Get paginated results
     query = query.order_by(Character.created_at.desc()).offset(skip).limit(limit)
     result = await db.execute(query)
-    characters = result.scalars().all()
-    
+    characters = character_rows.rows(result)
+    
+    # Chat count and unique users per character, merged across shards.
+    # A user's chats never span shards, so per-shard distinct user counts add up.
+    character_ids = [character["character_id"] for character in characters]
+
+    async def count_character_chats(chat_db: AsyncSession):
+        result = await chat_db.execute(
+            select(
+                Chat.character_id,
+                func.count(Chat.chat_id),
+                func.count(func.distinct(Chat.user_id)),
+            )
+            .where(Chat.character_id.in_(character_ids))
+            .group_by(Chat.character_id)
+        )
+        return result.all()
+
+    chat_counts = defaultdict(int)
+    unique_users = defaultdict(int)
+    for rows in await shards.fan_out(count_character_chats):
+        for character_id, chat_count, user_count in rows:
+            chat_counts[character_id] += chat_count
+            unique_users[character_id] += user_count
+
     # Enhance characters with statistics
-    enhanced_characters = []
     for character in characters:
-        # Get chat count for this character
-        chat_count_query = select(func.count(Chat.chat_id)).where(
-            Chat.character_id == character.character_id
-        )
-        chat_count = await db.scalar(chat_count_query) or 0
-        
-        # Get unique users count for this character
-        unique_users_query = select(func.count(func.distinct(Chat.user_id))).where(
-            Chat.character_id == character.character_id
-        )
-        unique_users = await db.scalar(unique_users_query) or 0
-        
-        # Create response with statistics
-        char_response = create_character_response(character)
-        char_response.chat_count = chat_count
-        char_response.unique_users = unique_users
-        
-        enhanced_characters.append(char_response)
+        character["chat_count"] = chat_counts[character["character_id"]]
+        character["unique_users"] = unique_users[character["character_id"]]
     
-    return CharacterListResponse(
-        characters=enhanced_characters,
-        total=total,
-        skip=skip,
-        limit=limit,
-    )
+    return ORJSONResponse({
+        "characters": characters,
+        "total": total,
+        "skip": skip,
+        "limit": limit,
+    })
 
 
 @router.post("/characters", response_model=CharacterResponse, status_code=201)
@@ -507,24 +540,20 @@ async def delete_character_admin(
     character_id: int,
     current_admin: User = Depends(require_admin),
     db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Delete any character (Admin only)"""
     character = await db.get(Character, character_id)
     if not character:
         raise HTTPException(status_code=404, detail="Character not found")
     
-    # Delete avatar file if it exists
-    if character.avatar_url:
-        avatar_path = get_avatar_path_from_filename(f"{character.avatar_url}.png")
-        if avatar_path.exists():
-            try:
-                avatar_path.unlink()
-            except Exception:
-                pass  # Don't fail deletion if avatar file can't be removed
+    # Drop the avatar reference; the blob is collected once nothing uses it
+    await avatar_storage.release(db, character.avatar_url)
 
-    # Delete character (cascading will handle related data)
+    # Delete character (cascading will handle related data; sharded chat data is removed explicitly)
+    await shards.delete_character_data(character_id)
     await db.delete(character)
-    await db.commit()
+    await shards.commit_all()
     
     return {"message": f"Character {character.name} and all related data deleted successfully"}
 
@@ -2,21 +2,22 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from datetime import timedelta
 
-from app.database import get_db
+from app.database import get_db, get_read_db
+from app.sharding import ShardSessions, get_chat_shards
 from app.models import User, UsageStat
 from app.schemas.user import UserCreate, UserResponse, TokenResponse, UserLogin, AdminLogin, UserWithStats
 from sqlalchemy import func
 from app.auth.jwt import (
-    create_access_token,
-    verify_password,
-    get_password_hash,
+    create_user_access_token,
     validate_password,
     ACCESS_TOKEN_EXPIRE_HOURS,
 )
 from app.auth.dependencies import get_current_user
-from app.middleware.rate_limit import rate_limit
+from app.auth.hashing import check_password, hash_password
+from app.middleware.rate_limit import auth_rate_limit, read_rate_limit
 import logging
 
 logger = logging.getLogger(__name__)
@@ -29,6 +30,7 @@ auth_router = APIRouter()
     status_code=status.HTTP_201_CREATED,
     summary="Register new user",
     description="Create a new user account with username, email, and password",
+    dependencies=[Depends(auth_rate_limit)],
 )
 async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     """
@@ -72,14 +74,26 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
             detail="Password does not meet security requirements",
         )
 
+    # 해싱 중에 쓰기 커넥션을 잡고 있지 않도록 조회 트랜잭션 종료
+    await db.commit()
+
     # 새 사용자 생성
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     db_user = User(
         username=user_data.username, email=user_data.email, password_hash=hashed_password
     )
 
     db.add(db_user)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # 해싱하는 동안 같은 사용자명/이메일로 다른 가입이 먼저 커밋된 경우
+        await db.rollback()
+        result = await db.execute(select(User.user_id).where(User.username == user_data.username))
+        taken = "Username" if result.first() else "Email"
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"{taken} already registered"
+        )
     await db.refresh(db_user)
 
     return db_user
@@ -90,8 +104,9 @@ async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     response_model=TokenResponse,
     summary="User login",
     description="Authenticate user and receive JWT token",
+    dependencies=[Depends(auth_rate_limit)],
 )
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_read_db)):
     """
     Authenticate user and generate JWT token.
 
@@ -112,7 +127,9 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSessi
     # 사용자 인증
     result = await db.execute(select(User).where(User.username == form_data.username))
     user = result.scalar_one_or_none()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    # 해싱 대기 중에 읽기 커넥션을 잡고 있지 않도록 세션 종료 (컬럼은 이미 로드됨)
+    await db.close()
+    if not user or not await check_password(form_data.password, user.password_hash):
         logger.warning(f"Failed login attempt for username: {form_data.username}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -122,9 +139,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSessi
 
     # JWT 토큰 생성
     access_token_expires = timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
+    access_token = create_user_access_token(user, expires_delta=access_token_expires)
 
     logger.info(f"User {user.username} logged in successfully")
     return {"access_token": access_token, "token_type": "bearer", "user": user}
@@ -136,21 +151,21 @@ async def logout():
     return {"message": "Successfully logged out"}
 
 
-@auth_router.get("/me", response_model=UserResponse)
+@auth_router.get("/me", response_model=UserResponse, dependencies=[Depends(read_rate_limit)])
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
     """현재 사용자 정보 조회"""
     return current_user
 
 
-@auth_router.get("/me/stats", response_model=UserWithStats)
+@auth_router.get("/me/stats", response_model=UserWithStats, dependencies=[Depends(read_rate_limit)])
 async def get_current_user_stats(
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    shards: ShardSessions = Depends(get_chat_shards)
 ):
     """현재 사용자 통계 정보 조회 (토큰 사용량 포함)"""
     
     # Get user's total stats
-    stats_result = await db.execute(
+    stats_result = await shards.for_user(current_user.user_id).execute(
         select(
             func.coalesce(func.sum(UsageStat.chat_count), 0).label('total_chats'),
             func.coalesce(func.sum(UsageStat.message_count), 0).label('total_messages'),
@@ -184,8 +199,9 @@ async def get_current_user_stats(
     response_model=TokenResponse,
     summary="Admin login",
     description="Authenticate admin user and receive JWT token",
+    dependencies=[Depends(auth_rate_limit)],
 )
-async def admin_login(admin_data: AdminLogin, db: AsyncSession = Depends(get_db)):
+async def admin_login(admin_data: AdminLogin, db: AsyncSession = Depends(get_read_db)):
     """
     Authenticate admin user and generate JWT token.
     
@@ -205,9 +221,11 @@ async def admin_login(admin_data: AdminLogin, db: AsyncSession = Depends(get_db)
     # Find user by username (adminId)
     result = await db.execute(select(User).where(User.username == admin_data.adminId))
     user = result.scalar_one_or_none()
+    # Release the read connection before waiting for the hashing pool (columns are loaded)
+    await db.close()
     
     # Verify user exists and password is correct
-    if not user or not verify_password(admin_data.password, user.password_hash):
+    if not user or not await check_password(admin_data.password, user.password_hash):
         logger.warning(f"Failed admin login attempt for adminId: {admin_data.adminId}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -225,9 +243,7 @@ async def admin_login(admin_data: AdminLogin, db: AsyncSession = Depends(get_db)
     
     # Generate JWT token
     access_token_expires = timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
+    access_token = create_user_access_token(user, expires_delta=access_token_expires)
     
     logger.info(f"Admin {user.username} logged in successfully")
     return {"access_token": access_token, "token_type": "bearer", "user": user}
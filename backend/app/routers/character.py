@@ -1,18 +1,26 @@
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, or_, and_, func
 import aiofiles
+import asyncio
 import os
 import uuid
 import logging
 from datetime import datetime
-from pathlib import Path
 
 from app.database import get_db
+from app.sharding import ShardSessions, get_chat_shards
 from app.core.auth import get_current_user
+from app.auth.dependencies import Principal, get_current_principal
+from app.middleware.rate_limit import read_rate_limit
 from app.models import User, Character
+from app.core.config import settings
+from app.core.serialization import ORJSONResponse, RowSerializer, dumps
+from app.services.avatar_service import avatar_response
+from app.services.avatar_storage import avatar_storage, hash_file
+from app.services.catalogue_cache import catalogue_cache, normalize_search
+from app.services.image_processing import InvalidImage
 from app.schemas.character import (
     CharacterCreate,
     CharacterUpdate,
@@ -24,17 +32,15 @@ from app.schemas.character import (
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Upload directory for character avatars
-UPLOAD_DIR = Path("app/uploads/avatars")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+# Uploads are staged next to the blobs they become (same filesystem); created at startup
+UPLOAD_DIR = avatar_storage.root
+
+# Uploads are copied to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 64 * 1024
 
 # Supported image formats for avatars
 SUPPORTED_IMAGE_FORMATS = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
 
-def get_avatar_path_from_filename(filename: str) -> Path:
-    """Get the avatar file path from filename"""
-    return UPLOAD_DIR / filename
-
 def create_character_response(character: Character) -> CharacterResponse:
     """Create a CharacterResponse with avatar_url"""
     response_data = character.__dict__.copy()
@@ -46,6 +52,23 @@ def create_character_response(character: Character) -> CharacterResponse:
     return CharacterResponse.model_validate(response_data)
 
 
+# List endpoints select these columns and serialize the rows directly
+character_rows = RowSerializer(CharacterResponse, {
+    "name": Character.name,
+    "gender": Character.gender,
+    "intro": Character.intro,
+    "personality_tags": Character.personality_tags,
+    "interest_tags": Character.interest_tags,
+    "prompt": Character.prompt,
+    "character_id": Character.character_id,
+    "created_by": Character.created_by,
+    "is_active": Character.is_active,
+    "created_at": Character.created_at,
+    "updated_at": Character.updated_at,
+    "avatar_url": Character.avatar_url,
+})
+
+
 @router.post("/", response_model=CharacterResponse, status_code=201)
 async def create_character(
     character_create: CharacterCreate,
@@ -62,17 +85,17 @@ async def create_character(
     return create_character_response(character)
 
 
-@router.get("/", response_model=CharacterListResponse)
+@router.get("/", response_model=CharacterListResponse, dependencies=[Depends(read_rate_limit)])
 async def list_characters(
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1),
     search: Optional[str] = None,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db),
 ):
     """List characters with pagination and filtering"""
     # Get only characters created by the current user
-    query = select(Character).where(Character.created_by == current_user.user_id)
+    query = character_rows.select().where(Character.created_by == current_user.user_id)
 
     # Search filter
     if search:
@@ -91,27 +114,33 @@ async def list_characters(
     # Get paginated results
     query = query.order_by(Character.created_at.desc()).offset(skip).limit(limit)
     result = await db.execute(query)
-    characters = result.scalars().all()
 
-    return CharacterListResponse(
-        characters=[create_character_response(char) for char in characters],
-        total=total,
-        skip=skip,
-        limit=limit,
-    )
+    return ORJSONResponse({
+        "characters": character_rows.rows(result),
+        "total": total,
+        "skip": skip,
+        "limit": limit,
+    })
 
 
-@router.get("/available", response_model=CharacterListResponse)
+@router.get("/available", response_model=CharacterListResponse, dependencies=[Depends(read_rate_limit)])
 async def list_available_characters(
+    request: Request,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1),
     search: Optional[str] = None,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db),
 ):
-    """List all active characters available for selection"""
+    """List all active characters available for selection (cached, revalidated with ETag)"""
+    search = normalize_search(search)
+    cache_key = catalogue_cache.key(search, skip, limit)
+    entry = catalogue_cache.get(cache_key)
+    if entry is not None:
+        return entry.response(request)
+
     # Get all active characters regardless of creator
-    query = select(Character).where(Character.is_active == True)
+    query = character_rows.select().where(Character.is_active == True)
 
     # Search filter
     if search:
@@ -130,20 +159,20 @@ async def list_available_characters(
     # Get paginated results - order by created_at to show newest first
     query = query.order_by(Character.created_at.desc()).offset(skip).limit(limit)
     result = await db.execute(query)
-    characters = result.scalars().all()
 
-    return CharacterListResponse(
-        characters=[create_character_response(char) for char in characters],
-        total=total,
-        skip=skip,
-        limit=limit,
-    )
+    body = dumps({
+        "characters": character_rows.rows(result),
+        "total": total,
+        "skip": skip,
+        "limit": limit,
+    })
+    return catalogue_cache.store(cache_key, body).response(request)
 
 
 
-@router.get("/active", response_model=CharacterResponse)
+@router.get("/active", response_model=CharacterResponse, dependencies=[Depends(read_rate_limit)])
 async def get_active_character(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db),
 ):
     """Get the currently active character for the user"""
@@ -163,10 +192,10 @@ async def get_active_character(
     return create_character_response(character)
 
 
-@router.get("/{character_id}", response_model=CharacterResponse)
+@router.get("/{character_id}", response_model=CharacterResponse, dependencies=[Depends(read_rate_limit)])
 async def get_character(
     character_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db),
 ):
     """Get a specific character"""
@@ -219,6 +248,7 @@ async def delete_character(
     character_id: int,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Delete a character"""
     # Query by character_id column
@@ -232,18 +262,13 @@ async def delete_character(
     if character.created_by != current_user.user_id:
         raise HTTPException(status_code=403, detail="Only the creator can delete this character")
 
-    # Delete avatar file if it exists
-    if character.avatar_url:
-        avatar_path = get_avatar_path_from_filename(f"{character.avatar_url}.png")
-        if avatar_path.exists():
-            try:
-                avatar_path.unlink()
-            except Exception as e:
-                # Log error but don't fail the deletion
-                logger.warning(f"Failed to delete avatar file during character deletion: {e}")
+    # The avatar blob is collected once no character references it
+    await avatar_storage.release(db, character.avatar_url)
 
+    # Sharded chat data is not covered by the ORM cascade
+    await shards.delete_character_data(character_id)
     await db.delete(character)
-    await db.commit()
+    await shards.commit_all()
 
     return {"message": "Character deleted successfully"}
 
@@ -293,9 +318,11 @@ async def select_character(
 @router.get("/{character_id}/avatar")
 async def get_character_avatar(
     character_id: int,
+    request: Request,
+    size: Optional[int] = Query(None, ge=1, description="Thumbnail edge in pixels; the closest larger thumbnail is served"),
     db: AsyncSession = Depends(get_db),
 ):
-    """Get a character's avatar image"""
+    """Get a character's avatar image (revalidated with ETag, since uploads replace it)"""
     # Check if character exists
     # Query by character_id column
     query = select(Character).where(Character.character_id == character_id)
@@ -308,15 +335,14 @@ async def get_character_avatar(
     if not character.avatar_url:
         raise HTTPException(status_code=404, detail="No avatar set for this character")
     
-    # avatar_url contains the filename
-    avatar_path = get_avatar_path_from_filename(f"{character.avatar_url}.png")
-    if not avatar_path.exists():
+    # avatar_url contains the content key
+    avatar, media_type = await avatar_storage.find(character.avatar_url, size)
+    if avatar is None:
         raise HTTPException(status_code=404, detail="Avatar file not found")
     
-    return FileResponse(
-        path=str(avatar_path),
-        media_type="image/png",
-        filename=f"character_{character_id}_avatar.png"
+    return avatar_response(
+        request, avatar, media_type,
+        filename=f"character_{character_id}_avatar{avatar.path.suffix}",
     )
 
 
@@ -347,44 +373,61 @@ async def upload_character_avatar(
     # Validate file type is PNG or can be converted
     if file.content_type not in ["image/png", "image/jpeg", "image/jpg", "image/gif", "image/webp"]:
         raise HTTPException(status_code=400, detail="Unsupported image format. Please upload PNG, JPEG, GIF, or WebP")
-    
-    # If character already has an avatar, delete the old file
-    if character.avatar_url:
-        old_avatar_path = get_avatar_path_from_filename(f"{character.avatar_url}.png")
-        if old_avatar_path.exists():
-            try:
-                old_avatar_path.unlink()
-            except Exception:
-                pass
-    
-    # Generate unique filename for avatar
-    avatar_filename = str(uuid.uuid4())
-    avatar_path = get_avatar_path_from_filename(f"{avatar_filename}.png")
+
+    # Give the (single, with split SQLite pools) writer connection back while the
+    # upload streams in and is hashed; the reference swap below takes it again
+    await db.close()
+
+    upload_path = UPLOAD_DIR / f".{uuid.uuid4()}.upload"
+    avatar_key = None
     
     try:
-        # Save file as PNG (all avatars stored as PNG)
-        async with aiofiles.open(avatar_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+        # Stream the upload to disk in chunks, enforcing the size limit
+        received = 0
+        async with aiofiles.open(upload_path, 'wb') as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                received += len(chunk)
+                if received > settings.AVATAR_MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="Avatar image is too large")
+                await f.write(chunk)
         
-        # Update character's avatar_url with just the filename (without extension)
-        character.avatar_url = avatar_filename
-        character.updated_at = datetime.utcnow()
+        # Hold a reference before transcoding so the collector leaves the blob alone
+        key = await asyncio.to_thread(hash_file, upload_path)
+        await avatar_storage.acquire(db, key)
         await db.commit()
+        avatar_key = key
+        
+        # Decode and re-encode to WebP plus thumbnails in a worker process (skipped for known images)
+        try:
+            written = await avatar_storage.ensure(upload_path, key)
+        except InvalidImage:
+            raise HTTPException(status_code=400, detail="File is not a valid PNG, JPEG, GIF or WebP image")
+        
+        if written:
+            logger.debug(f"Stored avatar {key} for character {character_id}: {sum(written.values())} bytes")
+        
+        # Swap the reference in the same transaction as the avatar_url change
+        await avatar_storage.set_avatar(db, character_id, key)
+        await db.commit()
+        avatar_key = None
         
         return {
             "message": "Avatar uploaded successfully",
-            "avatar_url": character.avatar_url
+            "avatar_url": key,
+            "sizes": settings.AVATAR_THUMBNAIL_SIZES,
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
-        # Try to clean up the file if save failed
-        if avatar_path.exists():
-            try:
-                avatar_path.unlink()
-            except Exception:
-                pass
         raise HTTPException(status_code=500, detail=f"Failed to save avatar: {str(e)}")
+    finally:
+        # A failed upload gives back its reference; the collector removes any files
+        if avatar_key is not None:
+            await db.rollback()
+            await avatar_storage.release(db, avatar_key)
+            await db.commit()
+        await asyncio.to_thread(upload_path.unlink, missing_ok=True)
 
 
 @router.delete("/{character_id}/avatar")
@@ -406,22 +449,9 @@ async def delete_character_avatar(
     if not current_user.is_admin and character.created_by != current_user.user_id:
         raise HTTPException(status_code=403, detail="Access denied to this character")
     
-    # Check if character has an avatar
-    if not character.avatar_url:
+    # Clear avatar_url and drop the reference; the collector removes the files later
+    if await avatar_storage.set_avatar(db, character_id, None) is None:
         raise HTTPException(status_code=404, detail="Character has no avatar")
-    
-    # Delete the avatar file
-    avatar_path = get_avatar_path_from_filename(f"{character.avatar_url}.png")
-    if avatar_path.exists():
-        try:
-            avatar_path.unlink()
-        except Exception as e:
-            # Log error but continue with database update
-            logger.warning(f"Failed to delete avatar file: {e}")
-    
-    # Clear avatar_url and update timestamp
-    character.avatar_url = None
-    character.updated_at = datetime.utcnow()
     await db.commit()
     
     return {"message": "Avatar deleted successfully"}
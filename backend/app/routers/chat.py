@@ -9,14 +9,30 @@ import json
 from datetime import datetime
 
 from app.database import get_db
+from app.sharding import ShardSessions, get_chat_shards, open_chat_session
 from app.core.auth import get_current_user
+from app.auth.dependencies import Principal, get_current_principal
+from app.middleware.rate_limit import chat_rate_limit, read_rate_limit
 from app.models import User, Chat, Character, ConversationSummary
 from app.schemas.chat import ChatCreate, ChatResponse, ChatRole, ChatMessageResponse
 from app.services.chat_service import ChatService
 from app.services.claude_service import claude_service
+from app.core.lifecycle import lifecycle, reject_when_draining
+from app.core.tracing import mark_error, span, traced
+from app.core.serialization import ORJSONResponse, RowSerializer
 
 router = APIRouter()
 
+# Chat listings select these columns and serialize the rows directly
+chat_rows = RowSerializer(ChatResponse, {
+    "chat_id": Chat.chat_id,
+    "user_id": Chat.user_id,
+    "character_id": Chat.character_id,
+    "role": Chat.role,
+    "content": Chat.content,
+    "created_at": Chat.created_at,
+})
+
 
 async def get_recent_chats(
     db: AsyncSession,
@@ -54,6 +70,7 @@ async def get_conversation_summary(
     return summary.summary if summary else None
 
 
+@traced("chat.generate_conversation_summary")
 async def generate_conversation_summary(
     db: AsyncSession,
     user_id: int,
@@ -102,6 +119,9 @@ async def generate_conversation_summary(
         
         messages = [{"role": "user", "content": summary_prompt}]
         
+        # End the read transaction so the shared writer connection is not held during the Claude call
+        await db.commit()
+        
         summary_text, _ = await claude_service.generate_response(
             messages=messages,
             system_prompt="당신은 대화 내용을 정확하고 간결하게 요약하는 전문가입니다. 이전 요약이 있다면 그것을 바탕으로 새로운 정보를 통합하여 포괄적인 요약을 만들어주세요.",
@@ -138,44 +158,103 @@ async def generate_conversation_summary(
         return summary_text
 
 
-@router.post("", response_model=ChatMessageResponse)
-@router.post("/", response_model=ChatMessageResponse)
+async def complete_exchange(
+    user_id: int,
+    character: Character,
+    user_chat: Chat,
+    messages: List[dict],
+    conversation_summary: Optional[str],
+    recent_chats: List[Chat],
+) -> Chat:
+    """Generate the reply to a saved user chat and store it, in a session of its own"""
+    async with open_chat_session(user_id) as chat_db:
+        # Generate Claude API response
+        claude_response, total_tokens = await claude_service.generate_chat_response(
+            user_message=user_chat.content,
+            character_prompt=character.prompt,
+            conversation_history=messages[:-1],  # Exclude current message
+            conversation_summary=conversation_summary
+        )
+        
+        with span("chat.save_ai_message", tokens=total_tokens):
+            # Create AI message
+            ai_chat = Chat(
+                user_id=user_id,
+                character_id=character.character_id,
+                role=ChatRole.ASSISTANT,
+                content=claude_response,
+                token_cost=total_tokens
+            )
+            chat_db.add(ai_chat)
+            await chat_db.commit()
+            await chat_db.refresh(ai_chat)
+            
+            # Update usage statistics with token information
+            try:
+                await ChatService.update_usage_stats(
+                    chat_db, user_id, character.character_id, total_tokens
+                )
+            except Exception as e:
+                # Failed to update usage stats, continuing
+                # Don't fail the whole request just because of stats update
+                await chat_db.rollback()
+                # Re-commit the chat messages
+                await chat_db.commit()
+        
+        # Check if we need to generate a summary (every 20 chats)
+        total_chats = len(recent_chats) + 2  # Include current exchange
+        if total_chats % 20 == 0:
+            await generate_conversation_summary(
+                chat_db, user_id, character.character_id, 
+                recent_chats + [user_chat, ai_chat]
+            )
+        return ai_chat
+
+
+@router.post("", response_model=ChatMessageResponse, dependencies=[Depends(reject_when_draining), Depends(chat_rate_limit)])
+@router.post("/", response_model=ChatMessageResponse, dependencies=[Depends(reject_when_draining), Depends(chat_rate_limit)])
 async def send_chat(
     chat_create: ChatCreate,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Send a message and get AI response synchronously"""
+    # Chats, summaries and usage stats live in the user's shard
+    chat_db = shards.for_user(current_user.user_id)
     try:
         
         # Validate character exists
-        character = await db.get(Character, chat_create.character_id)
+        with span("chat.load_character"):
+            character = await db.get(Character, chat_create.character_id)
         if not character:
             raise HTTPException(status_code=404, detail="Character not found")
         
         
         # Create user chat
-        user_chat = Chat(
-            user_id=current_user.user_id,
-            character_id=character.character_id,
-            role=ChatRole.USER,
-            content=chat_create.content,
-        )
-        db.add(user_chat)
-        await db.commit()
-        await db.refresh(user_chat)
+        with span("chat.save_user_message"):
+            user_chat = Chat(
+                user_id=current_user.user_id,
+                character_id=character.character_id,
+                role=ChatRole.USER,
+                content=chat_create.content,
+            )
+            chat_db.add(user_chat)
+            await chat_db.commit()
+            await chat_db.refresh(user_chat)
         
  
         
-        # Get recent conversation history
-        recent_chats = await get_recent_chats(
-            db, current_user.user_id, character.character_id, limit=20
-        )
-        
-        # Get conversation summary
-        conversation_summary = await get_conversation_summary(
-            db, current_user.user_id, character.character_id
-        )
+        with span("chat.load_history"):
+            # Get recent conversation history
+            recent_chats = await get_recent_chats(
+                chat_db, current_user.user_id, character.character_id, limit=20
+            )
+            
+            # Get conversation summary
+            conversation_summary = await get_conversation_summary(
+                chat_db, current_user.user_id, character.character_id
+            )
         
         # Prepare messages for Claude
         messages = []
@@ -191,49 +270,17 @@ async def send_chat(
         if conversation_summary:
             system_prompt += f"\n\n[이전 대화 요약]\n{conversation_summary}\n\n위 요약을 참고하여 일관성 있는 대화를 이어가주세요."
         
-        # Generate Claude API response
-        claude_response, total_tokens = await claude_service.generate_chat_response(
-            user_message=user_chat.content,
-            character_prompt=character.prompt,
-            conversation_history=messages[:-1],  # Exclude current message
-            conversation_summary=conversation_summary
-        )
+        # End the read transactions so the shared writer connection is not held during the Claude call
+        await shards.commit_all()
         
-        # Create AI message
-        ai_chat = Chat(
-            user_id=current_user.user_id,
-            character_id=character.character_id,
-            role=ChatRole.ASSISTANT,
-            content=claude_response,
-            token_cost=total_tokens
+        # The reply is generated and stored by a task of its own: if this request is cancelled
+        # (client gone, worker shutting down) the answer already paid for is still saved
+        ai_chat = await lifecycle.shield(
+            complete_exchange(
+                current_user.user_id, character, user_chat, messages, conversation_summary, recent_chats
+            ),
+            kind="chat",
         )
-        db.add(ai_chat)
-        await db.commit()
-        await db.refresh(ai_chat)
-        
-        # Log response type
-        is_fallback = not claude_service.is_available() or "AI 서비스에 일시적인 문제" in claude_response
-        response_type = "FALLBACK" if is_fallback else "CLAUDE_API"
-        
-        # Update usage statistics with token information
-        try:
-            await ChatService.update_usage_stats(
-                db, current_user.user_id, character.character_id, total_tokens
-            )
-        except Exception as e:
-            # Failed to update usage stats, continuing
-            # Don't fail the whole request just because of stats update
-            await db.rollback()
-            # Re-commit the chat messages
-            await db.commit()
-        
-        # Check if we need to generate a summary (every 20 chats)
-        total_chats = len(recent_chats) + 2  # Include current exchange
-        if total_chats % 20 == 0:
-            await generate_conversation_summary(
-                db, current_user.user_id, character.character_id, 
-                recent_chats + [user_chat, ai_chat]
-            )
         
         # Return both user and AI messages
         return ChatMessageResponse(
@@ -247,6 +294,7 @@ async def send_chat(
         # Unexpected error in send_chat
         import traceback
         traceback.print_exc()
+        mark_error(f"{type(e).__name__}: {e}")
         
         # Create error response
         error_chat = Chat(
@@ -256,9 +304,9 @@ async def send_chat(
             content="죄송합니다. 현재 AI 서비스에 문제가 있어 응답을 생성할 수 없습니다. 잠시 후 다시 시도해주세요.",
             token_cost=0
         )
-        db.add(error_chat)
-        await db.commit()
-        await db.refresh(error_chat)
+        chat_db.add(error_chat)
+        await chat_db.commit()
+        await chat_db.refresh(error_chat)
         
         return ChatMessageResponse(
             user_message=ChatResponse.model_validate(user_chat),
@@ -266,14 +314,15 @@ async def send_chat(
         )
 
 
-@router.get("")
-@router.get("/")
+@router.get("", response_model=List[ChatResponse], dependencies=[Depends(read_rate_limit)])
+@router.get("/", response_model=List[ChatResponse], dependencies=[Depends(read_rate_limit)])
 async def get_chats(
     character_id: int,
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Get chats between user and character"""
     # Verify character exists
@@ -282,25 +331,26 @@ async def get_chats(
         raise HTTPException(status_code=404, detail="Character not found")
     
     # Get chats
-    query = select(Chat).where(
+    query = chat_rows.select().where(
         Chat.user_id == current_user.user_id,
         Chat.character_id == character_id
     ).order_by(Chat.created_at.desc()).offset(skip).limit(limit)
     
-    result = await db.execute(query)
-    chats = result.scalars().all()
+    result = await shards.for_user(current_user.user_id).execute(query)
+    chats = chat_rows.rows(result)
     
     # Return in chronological order
     chats.reverse()
     
-    return [ChatResponse.model_validate(chat) for chat in chats]
+    return ORJSONResponse(chats)
 
 
-@router.post("/end-conversation/{character_id}")
+@router.post("/end-conversation/{character_id}", dependencies=[Depends(reject_when_draining)])
 async def end_conversation(
     character_id: int,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
+    shards: ShardSessions = Depends(get_chat_shards),
 ):
     """Force conversation summarization for a character"""
     # Verify character exists
@@ -308,9 +358,13 @@ async def end_conversation(
     if not character:
         raise HTTPException(status_code=404, detail="Character not found")
     
+    # Release the main session; summarization may wait on the Claude API
+    await db.commit()
+    chat_db = shards.for_user(current_user.user_id)
+    
     # Get recent chats
     recent_chats = await get_recent_chats(
-        db, current_user.user_id, character_id, limit=50
+        chat_db, current_user.user_id, character_id, limit=50
     )
     
     if not recent_chats:
@@ -318,7 +372,7 @@ async def end_conversation(
     
     # Generate summary (force=True for end conversation)
     summary = await generate_conversation_summary(
-        db, current_user.user_id, character_id, recent_chats, force_summary=True
+        chat_db, current_user.user_id, character_id, recent_chats, force_summary=True
     )
     
     return {
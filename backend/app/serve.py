@@ -0,0 +1,259 @@
+"""
+Server launcher
+
+Usage:
+    python -m app.serve [--workers N] [--host HOST] [--port PORT] [--reload] [--print-config]
+
+Runs the app under gunicorn with uvicorn workers. The worker count is sized
+from the CPUs and memory this process may actually use (the container's
+cgroup limits, not the host's), uvloop and httptools are used when
+installed, and keep-alive, backlog, worker recycling and drain timeouts
+come from the SERVER_* settings. The hooks in gunicorn.conf.py (metrics
+files, --preload) still apply. The effective configuration is printed at
+boot.
+
+``--reload`` runs a single uvicorn process that restarts on code changes
+(development). Without gunicorn (Windows) the workers are started by
+uvicorn, which neither recycles nor replaces them.
+"""
+import argparse
+import importlib.util
+import math
+import os
+import runpy
+import sys
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import BACKEND_DIR, settings
+
+APP = "app.main:app"
+GUNICORN_CONFIG = BACKEND_DIR / "gunicorn.conf.py"
+
+# Slack between the end of the shutdown handlers and gunicorn killing the worker
+SHUTDOWN_MARGIN_SECONDS = 2
+
+EVENT_LOOP = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+HTTP_PROTOCOL = "httptools" if importlib.util.find_spec("httptools") else "h11"
+HAS_GUNICORN = importlib.util.find_spec("gunicorn") is not None
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        return Path(path).read_text().strip()
+    except OSError:
+        return None
+
+
+def cpu_limit() -> Tuple[float, str]:
+    """CPUs this process may use and where the number comes from"""
+    if hasattr(os, "sched_getaffinity"):
+        cpus, source = float(len(os.sched_getaffinity(0))), "affinity"
+    else:
+        cpus, source = float(os.cpu_count() or 1), "cpu_count"
+
+    quota = None
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")  # cgroup v2: "<quota> <period>" or "max <period>"
+    if cpu_max and not cpu_max.startswith("max"):
+        limit, period = cpu_max.split()
+        quota = int(limit) / int(period)
+    else:
+        limit, period = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"), _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if limit and period and int(limit) > 0:
+            quota = int(limit) / int(period)
+    if quota is not None and quota < cpus:
+        return quota, "cgroup quota"
+    return cpus, source
+
+
+def memory_limit() -> Tuple[int, str]:
+    """Bytes of memory this process may use and where the number comes from"""
+    physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") if hasattr(os, "sysconf") else 0
+    limit = None
+    memory_max = _read("/sys/fs/cgroup/memory.max")  # cgroup v2: bytes or "max"
+    if memory_max and memory_max != "max":
+        limit = int(memory_max)
+    else:
+        # cgroup v1 reports "no limit" as a huge number
+        memory_max = _read("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+        if memory_max:
+            limit = int(memory_max)
+    if limit is not None and (not physical or limit < physical):
+        return limit, "cgroup limit"
+    return physical, "physical"
+
+
+def size_workers() -> Tuple[int, str]:
+    """Worker count from SERVER_WORKERS or the CPU and memory limits, with the reasoning"""
+    if settings.SERVER_WORKERS:
+        return settings.SERVER_WORKERS, "SERVER_WORKERS"
+
+    cpus, cpu_source = cpu_limit()
+    by_cpu = max(1, math.floor(cpus * settings.SERVER_WORKERS_PER_CPU))
+    memory, memory_source = memory_limit()
+    by_memory = max(1, memory // (settings.SERVER_WORKER_MEMORY_MB * 1024 * 1024)) if memory else by_cpu
+    workers = max(1, min(by_cpu, by_memory, settings.SERVER_MAX_WORKERS))
+    reason = (
+        f"{cpus:g} CPUs ({cpu_source}) x {settings.SERVER_WORKERS_PER_CPU:g} = {by_cpu}, "
+        f"{memory / 2**30:.1f} GiB ({memory_source}) / {settings.SERVER_WORKER_MEMORY_MB} MiB = {by_memory}, "
+        f"max {settings.SERVER_MAX_WORKERS}"
+    )
+    return workers, reason
+
+
+def drain_timeout(readiness_delay: float = 0) -> int:
+    """
+    Seconds a stopping worker waits for open requests
+
+    The graceful timeout is shared by the readiness delay, this drain and
+    the shutdown handlers (SHUTDOWN_TIMEOUT_SECONDS), in that order.
+    """
+    reserved = readiness_delay + settings.SHUTDOWN_TIMEOUT_SECONDS + SHUTDOWN_MARGIN_SECONDS
+    return max(1, math.floor(settings.SERVER_GRACEFUL_TIMEOUT_SECONDS - reserved))
+
+
+def gunicorn_options(host: str, port: int, workers: int) -> Dict[str, Any]:
+    return {
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "worker_class": "app.serve.UvicornWorker",
+        "backlog": settings.SERVER_BACKLOG,
+        "keepalive": settings.SERVER_KEEPALIVE_SECONDS,
+        "max_requests": settings.SERVER_MAX_REQUESTS,
+        "max_requests_jitter": settings.SERVER_MAX_REQUESTS_JITTER,
+        "timeout": settings.SERVER_TIMEOUT_SECONDS,
+        "graceful_timeout": settings.SERVER_GRACEFUL_TIMEOUT_SECONDS,
+        "preload_app": settings.SERVER_PRELOAD,
+        "readiness_delay": settings.SHUTDOWN_READINESS_DELAY_SECONDS,
+        "drain_timeout": drain_timeout(settings.SHUTDOWN_READINESS_DELAY_SECONDS),
+        "shutdown_timeout": settings.SHUTDOWN_TIMEOUT_SECONDS,
+    }
+
+
+def uvicorn_options(host: str, port: int, workers: int, reload: bool) -> Dict[str, Any]:
+    options = {
+        "host": host,
+        "port": port,
+        "loop": EVENT_LOOP,
+        "http": HTTP_PROTOCOL,
+        "backlog": settings.SERVER_BACKLOG,
+        "timeout_keep_alive": settings.SERVER_KEEPALIVE_SECONDS,
+        "timeout_graceful_shutdown": drain_timeout(),
+    }
+    if reload:
+        options["reload"] = True
+    else:
+        options["workers"] = workers
+    return options
+
+
+if HAS_GUNICORN:
+    import asyncio
+
+    from gunicorn.app.base import BaseApplication
+    from gunicorn.arbiter import Arbiter
+    from uvicorn import Server
+    from uvicorn.workers import UvicornWorker as _UvicornWorker
+
+    from app.core.lifecycle import lifecycle
+
+    class DrainingServer(Server):
+        """
+        uvicorn server that turns not ready before it stops
+
+        On the first stop signal the worker keeps serving for
+        SHUTDOWN_READINESS_DELAY_SECONDS while readiness reports "not ready"
+        and new chats are refused, so load balancers move traffic away
+        before the listening socket closes. A second signal stops at once.
+        """
+
+        def handle_exit(self, sig, frame) -> None:
+            delay = settings.SHUTDOWN_READINESS_DELAY_SECONDS
+            if lifecycle.draining or delay <= 0:
+                lifecycle.begin_drain()
+                super().handle_exit(sig, frame)
+                return
+            lifecycle.begin_drain()
+            asyncio.get_running_loop().call_later(delay, super().handle_exit, sig, frame)
+
+    class UvicornWorker(_UvicornWorker):
+        """uvicorn worker with the launcher's loop, HTTP parser, drain timeout and readiness delay"""
+
+        CONFIG_KWARGS = {
+            "loop": EVENT_LOOP,
+            "http": HTTP_PROTOCOL,
+            "timeout_graceful_shutdown": drain_timeout(settings.SHUTDOWN_READINESS_DELAY_SECONDS),
+        }
+
+        async def _serve(self) -> None:
+            self.config.app = self.wsgi
+            server = DrainingServer(config=self.config)
+            self._install_sigquit_handler()
+            await server.serve(sockets=self.sockets)
+            if not server.started:
+                sys.exit(Arbiter.WORKER_BOOT_ERROR)
+
+    class GunicornServer(BaseApplication):
+        """gunicorn with gunicorn.conf.py's hooks and the launcher's options"""
+
+        def __init__(self, options: Dict[str, Any]):
+            self.options = options
+            super().__init__()
+
+        def load_config(self) -> None:
+            # Same handling as gunicorn's own --config: unknown names are ignored
+            for name, value in runpy.run_path(str(GUNICORN_CONFIG)).items():
+                if name in self.cfg.settings:
+                    self.cfg.set(name, value)
+            for name, value in self.options.items():
+                if name in self.cfg.settings:
+                    self.cfg.set(name, value)
+
+        def load(self):
+            from app.main import app
+
+            return app
+
+
+def print_config(server: str, options: Dict[str, Any], workers_reason: Optional[str]) -> None:
+    print(f"Starting {server} ({EVENT_LOOP} loop, {HTTP_PROTOCOL} parser)", flush=True)
+    for name, value in options.items():
+        print(f"  {name:<26}{value}", flush=True)
+    if workers_reason:
+        print(f"  {'workers sized from':<26}{workers_reason}", flush=True)
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default=settings.HOST)
+    parser.add_argument("--port", type=int, default=settings.PORT)
+    parser.add_argument("--workers", type=int, default=None, help="overrides SERVER_WORKERS and the sizing")
+    parser.add_argument("--reload", action="store_true", help="single process, restarted on code changes")
+    parser.add_argument("--print-config", action="store_true", help="print the configuration and exit")
+    args = parser.parse_args(argv)
+
+    if args.workers:
+        workers, reason = args.workers, "--workers"
+    elif args.reload:
+        workers, reason = 1, None
+    else:
+        workers, reason = size_workers()
+
+    if HAS_GUNICORN and not args.reload:
+        server, options = "gunicorn", gunicorn_options(args.host, args.port, workers)
+    else:
+        server, options = "uvicorn", uvicorn_options(args.host, args.port, workers, args.reload)
+    print_config(server, options, reason)
+    if args.print_config:
+        return
+
+    if server == "gunicorn":
+        GunicornServer(options).run()
+    else:
+        import uvicorn
+
+        uvicorn.run(APP, **options)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,180 @@
+"""
+Avatar image serving
+
+Avatar files are read off the event loop and kept in a per-worker LRU
+bounded by total bytes, so repeated requests for popular avatars (the
+character list page) are answered from memory. Files above the per-item
+limit are streamed from disk, but their validators are cached too. Every response carries a
+strong ETag (hash of the content) and Last-Modified; conditional requests
+that still match get an empty 304.
+
+URLs that name one immutable file (``/images/avatars/{name}``: names are
+content hashes, see ``avatar_storage``) are cacheable forever. URLs whose content changes
+on upload (``/characters/{id}/avatar``) must be revalidated, which costs a
+304 once the client has the current version.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+from app.core.cache import BytesTTLCache
+from app.core.config import settings
+from app.core.http_cache import etag_matches
+from app.services.image_processing import AVATAR_MEDIA_TYPE, avatar_filename, pick_thumbnail_size
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+
+# Cache cost of an entry that only holds validators (file too large to keep)
+METADATA_ENTRY_BYTES = 256
+
+
+@dataclass(frozen=True)
+class AvatarFile:
+    """
+    Avatar validators plus its bytes
+
+    ``body`` is None for files larger than AVATAR_CACHE_MAX_ITEM_BYTES; those
+    are streamed from ``path`` and only their validators are cached.
+    """
+
+    path: Path
+    etag: str
+    mtime: float
+    body: Optional[bytes] = None
+
+    @property
+    def last_modified(self) -> str:
+        return formatdate(self.mtime, usegmt=True)
+
+    def __len__(self) -> int:
+        return len(self.body) if self.body is not None else METADATA_ENTRY_BYTES
+
+
+avatar_cache = BytesTTLCache(
+    name="avatar",
+    ttl=settings.AVATAR_CACHE_TTL_SECONDS,
+    maxbytes=settings.AVATAR_CACHE_MAX_BYTES,
+    max_item_bytes=settings.AVATAR_CACHE_MAX_ITEM_BYTES,
+)
+
+
+def _read_blob(path: Path) -> Optional[AvatarFile]:
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size <= settings.AVATAR_CACHE_MAX_ITEM_BYTES:
+                body = f.read()
+                digest.update(body)
+            else:
+                body = None
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return None
+    return AvatarFile(path=path, etag=f'"{digest.hexdigest()[:32]}"', mtime=stat.st_mtime, body=body)
+
+
+async def load_avatar(path: Path) -> Optional[AvatarFile]:
+    """Avatar file contents from the cache, or read in a worker thread; None if missing"""
+    key = str(path)
+    blob = avatar_cache.get(key)
+    if blob is None:
+        blob = await asyncio.to_thread(_read_blob, path)
+        if blob is not None:
+            avatar_cache.set(key, blob)
+    return blob
+
+
+async def find_avatar(directory: Path, name: str,
+                      size: Optional[int] = None) -> Tuple[Optional[AvatarFile], Optional[str]]:
+    """
+    Normalized WebP avatar (or the thumbnail closest to ``size``) and its media type
+
+    Avatars uploaded before transcoding existed are plain PNG files without
+    thumbnails; they are served as they are.
+    """
+    thumbnail = pick_thumbnail_size(size, settings.AVATAR_THUMBNAIL_SIZES)
+    blob = await load_avatar(directory / avatar_filename(name, thumbnail))
+    if blob is not None:
+        return blob, AVATAR_MEDIA_TYPE
+    blob = await load_avatar(directory / f"{name}.png")
+    if blob is not None:
+        return blob, "image/png"
+    return None, None
+
+
+def avatar_files(directory: Path, name: str) -> List[Path]:
+    """Every file that may belong to an avatar name"""
+    names = [f"{name}.png", avatar_filename(name)]
+    names += [avatar_filename(name, size) for size in settings.AVATAR_THUMBNAIL_SIZES]
+    return [directory / filename for filename in names]
+
+
+def _unlink_all(paths: List[Path]) -> None:
+    for path in paths:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to delete avatar file {path}: {e}")
+
+
+async def delete_avatar(directory: Path, name: str) -> None:
+    """Drop an avatar and its thumbnails from the cache and from disk"""
+    paths = avatar_files(directory, name)
+    for path in paths:
+        invalidate_avatar(path)
+    await asyncio.to_thread(_unlink_all, paths)
+
+
+def invalidate_avatar(path: Path) -> None:
+    """Forget a cached avatar after its file was replaced or deleted (this worker only)"""
+    avatar_cache.invalidate(str(path))
+
+
+def is_not_modified(request: Request, blob: AvatarFile) -> bool:
+    """Evaluate If-None-Match (takes precedence) or If-Modified-Since against the blob"""
+    matched = etag_matches(request, blob.etag)
+    if matched is not None:
+        return matched
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(blob.mtime) <= since
+    return False
+
+
+def avatar_response(request: Request, blob: AvatarFile, media_type: str,
+                    immutable: bool = False, filename: Optional[str] = None) -> Response:
+    """Full response or 304 for an avatar, with validators and cache headers"""
+    headers = {
+        "ETag": blob.etag,
+        "Last-Modified": blob.last_modified,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+    }
+    if is_not_modified(request, blob):
+        return Response(status_code=304, headers=headers)
+
+    if blob.body is None:
+        return FileResponse(blob.path, media_type=media_type, headers=headers, filename=filename)
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return Response(content=blob.body, media_type=media_type, headers=headers)
@@ -0,0 +1,231 @@
+"""
+Content-addressed avatar storage
+
+An avatar is named by the SHA-256 of the uploaded image, and its WebP
+files live under AVATAR_STORAGE_DIR in a two-level tree
+(``ab/cd/abcd….webp`` plus thumbnails), so no directory grows past a few
+hundred entries. Identical uploads share one blob and skip transcoding.
+
+The ``avatar_blobs`` table counts the characters referencing each blob.
+References are taken and dropped in the same transaction that changes
+``characters.avatar_url`` (``set_avatar``); nothing is deleted inline. A
+background task removes blobs that stayed unreferenced for
+AVATAR_GC_GRACE_SECONDS. It first claims a blob (``ref_count`` 0 → -1) so an upload of the same image
+cannot take a reference while its files are being deleted.
+
+Names that are not content hashes are avatars stored before this layout
+(flat PNG/WebP files); they are still served from the legacy directories
+but never counted or collected. ``python -m app.avatar_import`` imports
+them.
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.core.config import settings
+from app.models import AvatarBlob, Character
+from app.services.avatar_service import AvatarFile, delete_avatar, find_avatar
+from app.services.image_processing import avatar_filename, image_processor
+
+logger = logging.getLogger(__name__)
+
+CONTENT_KEY_LENGTH = 64
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# ref_count of a blob whose files are being deleted
+COLLECTING = -1
+
+
+def is_content_key(name: str) -> bool:
+    """Whether an avatar name is a content hash (as opposed to a legacy file name)"""
+    return len(name) == CONTENT_KEY_LENGTH and all(c in "0123456789abcdef" for c in name)
+
+
+def hash_file(path: Path) -> str:
+    """Content key of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AvatarStorage:
+    """Blob files on disk plus their reference counts in the database"""
+
+    def __init__(self, root: Path, legacy_dirs: Sequence[Path] = ()):
+        self.root = root
+        # The storage root itself held flat legacy files too
+        self.legacy_dirs = [root, *legacy_dirs]
+
+    def blob_dir(self, key: str) -> Path:
+        return self.root / key[:2] / key[2:4]
+
+    def has_blob(self, key: str) -> bool:
+        # transcode_avatar writes the full-size file last, after every thumbnail
+        return (self.blob_dir(key) / avatar_filename(key)).is_file()
+
+    async def find(self, name: str, size: Optional[int] = None) -> Tuple[Optional[AvatarFile], Optional[str]]:
+        """Avatar file (or thumbnail) and media type for a stored name; (None, None) if missing"""
+        if is_content_key(name):
+            return await find_avatar(self.blob_dir(name), name, size)
+        if not name or "/" in name or "\\" in name or ".." in name:
+            return None, None
+        for directory in self.legacy_dirs:
+            avatar, media_type = await find_avatar(directory, name, size)
+            if avatar is not None:
+                return avatar, media_type
+        return None, None
+
+    def legacy_file(self, name: str) -> Optional[Path]:
+        """Source image of a legacy avatar name, if it is still on disk"""
+        for directory in self.legacy_dirs:
+            for path in (directory / avatar_filename(name), directory / f"{name}.png"):
+                if path.is_file():
+                    return path
+        return None
+
+    async def ensure(self, source: Path, key: str) -> Dict[str, int]:
+        """
+        Transcode an upload into its blob unless an identical image is stored
+
+        The caller must hold a reference to the key (``acquire``, committed)
+        so the collector cannot remove the files meanwhile. Returns the
+        bytes written, empty when the upload was deduplicated.
+        """
+        if await asyncio.to_thread(self.has_blob, key):
+            return {}
+        directory = self.blob_dir(key)
+        await asyncio.to_thread(directory.mkdir, parents=True, exist_ok=True)
+        return await image_processor.transcode_avatar(source, directory, key)
+
+    async def acquire(self, db: AsyncSession, key: str) -> None:
+        """Count one more reference to a blob (flushed, committed by the caller)"""
+        result = await db.execute(
+            update(AvatarBlob)
+            .where(AvatarBlob.content_hash == key, AvatarBlob.ref_count >= 0)
+            .values(ref_count=AvatarBlob.ref_count + 1, released_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            return
+        db.add(AvatarBlob(content_hash=key, ref_count=1))
+        try:
+            await db.flush()
+        except IntegrityError:
+            # The blob is being collected, or the same image is being uploaded concurrently
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Avatar storage is busy, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+
+    async def release(self, db: AsyncSession, name: Optional[str]) -> None:
+        """Drop one reference to a blob; legacy names are ignored"""
+        if not name or not is_content_key(name):
+            return
+        await db.execute(
+            update(AvatarBlob)
+            .where(AvatarBlob.content_hash == name, AvatarBlob.ref_count > 0)
+            .values(ref_count=AvatarBlob.ref_count - 1, released_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+
+    async def set_avatar(self, db: AsyncSession, character_id: int, name: Optional[str]) -> Optional[str]:
+        """
+        Point a character at an avatar (None clears it), moving the references
+
+        The caller's reference to ``name`` becomes the character's. avatar_url
+        is read here and only replaced if it still holds the value read, so an
+        upload or delete that committed in the meantime is seen and the
+        reference dropped is the one actually replaced. Returns the previous
+        name (flushed, committed by the caller); 404 if the character is gone.
+        """
+        while True:
+            row = (await db.execute(
+                select(Character.avatar_url).where(Character.character_id == character_id)
+            )).first()
+            if row is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Character not found")
+            previous = row.avatar_url
+            result = await db.execute(
+                update(Character)
+                .where(Character.character_id == character_id, Character.avatar_url == previous)
+                .values(avatar_url=name, updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                break
+
+        # Also right for the same image again: the caller's reference is then the extra one
+        await self.release(db, previous)
+        return previous
+
+    async def collect_garbage(self, session_factory: async_sessionmaker, grace_seconds: float,
+                              batch_size: int) -> List[str]:
+        """Delete blobs unreferenced for ``grace_seconds``; returns the removed keys"""
+        cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+        async with session_factory() as db:
+            candidates = (await db.execute(
+                select(AvatarBlob.content_hash)
+                .where(AvatarBlob.ref_count == 0, AvatarBlob.released_at < cutoff)
+                .limit(batch_size)
+            )).scalars().all()
+            if candidates:
+                await db.execute(
+                    update(AvatarBlob)
+                    .where(AvatarBlob.content_hash.in_(candidates), AvatarBlob.ref_count == 0)
+                    .values(ref_count=COLLECTING)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+
+            # Also picks up claims left behind by a collector that died midway
+            claimed = (await db.execute(
+                select(AvatarBlob.content_hash)
+                .where(AvatarBlob.ref_count == COLLECTING)
+                .limit(batch_size)
+            )).scalars().all()
+            if not claimed:
+                return []
+
+            # Shard directories are left in place: an upload may be writing into them
+            for key in claimed:
+                await delete_avatar(self.blob_dir(key), key)
+
+            await db.execute(
+                delete(AvatarBlob)
+                .where(AvatarBlob.content_hash.in_(claimed), AvatarBlob.ref_count == COLLECTING)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        return list(claimed)
+
+
+async def run_collector(storage: AvatarStorage, session_factory: async_sessionmaker) -> None:
+    """Collect unreferenced blobs every AVATAR_GC_INTERVAL_SECONDS until cancelled"""
+    while True:
+        await asyncio.sleep(settings.AVATAR_GC_INTERVAL_SECONDS)
+        try:
+            removed = await storage.collect_garbage(
+                session_factory, settings.AVATAR_GC_GRACE_SECONDS, settings.AVATAR_GC_BATCH_SIZE
+            )
+            if removed:
+                logger.info(f"Removed {len(removed)} unreferenced avatar blobs")
+        except Exception as e:
+            logger.warning(f"Avatar garbage collection failed: {e}")
+
+
+avatar_storage = AvatarStorage(
+    Path(settings.AVATAR_STORAGE_DIR),
+    [Path(directory) for directory in settings.AVATAR_LEGACY_DIRS],
+)
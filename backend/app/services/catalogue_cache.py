@@ -0,0 +1,117 @@
+"""
+Versioned cache of the character catalogue (/characters/available)
+
+Every client starts by listing the available characters, and the list
+barely changes. Each worker keeps the serialized response bytes per
+(catalogue version, normalized search, skip, limit) together with an ETag
+computed from the bytes, so unchanged clients get a 304 and repeated
+requests skip both the COUNT and the page query.
+
+The version is bumped whenever a session commits a change to a
+``Character``: ORM inserts, updates and deletes (including cascades) as
+well as bulk UPDATE/DELETE statements are picked up by session events,
+so no endpoint has to remember to invalidate. A request keys its entry by
+the version it started with, so a response built from data that changed
+meanwhile is never served under the new version. Other workers notice a
+change once their entry expires (CATALOGUE_CACHE_TTL_SECONDS); since the
+ETag depends only on the content, it is the same on every worker.
+"""
+from dataclasses import dataclass
+from itertools import chain
+from typing import Hashable, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.cache import BytesTTLCache
+from app.core.config import settings
+from app.core.http_cache import content_etag, etag_matches
+from app.models import Character
+
+CACHE_CONTROL = "private, no-cache"
+
+# Session.info flag: the current transaction changed a character
+_CHANGED = "catalogue_changed"
+
+
+@dataclass(frozen=True)
+class CatalogueEntry:
+    """Serialized catalogue page and its ETag"""
+
+    body: bytes
+    etag: str
+
+    def __len__(self) -> int:
+        return len(self.body)
+
+    def response(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": CACHE_CONTROL}
+        if etag_matches(request, self.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+class CatalogueCache:
+    """Catalogue responses of this worker, dropped whenever the version changes"""
+
+    def __init__(self, ttl: float, maxbytes: int):
+        self.version = 0
+        self._entries = BytesTTLCache(name="catalogue", ttl=ttl, maxbytes=maxbytes)
+
+    def key(self, *parts: Hashable) -> tuple:
+        return (self.version, *parts)
+
+    def get(self, key: tuple) -> Optional[CatalogueEntry]:
+        return self._entries.get(key)
+
+    def store(self, key: tuple, body: bytes) -> CatalogueEntry:
+        entry = CatalogueEntry(body=body, etag=content_etag(body))
+        # A key from before the last bump can never be read again
+        if key[0] == self.version:
+            self._entries.set(key, entry)
+        return entry
+
+    def bump(self) -> None:
+        self.version += 1
+        self._entries.clear()
+
+
+catalogue_cache = CatalogueCache(
+    ttl=settings.CATALOGUE_CACHE_TTL_SECONDS,
+    maxbytes=settings.CATALOGUE_CACHE_MAX_BYTES,
+)
+
+
+def normalize_search(search: Optional[str]) -> Optional[str]:
+    """Search term with case and whitespace folded; None when nothing is left"""
+    if search is None:
+        return None
+    normalized = " ".join(search.split()).lower()
+    return normalized or None
+
+
+@event.listens_for(Session, "after_flush")
+def _flag_flushed_characters(session: Session, flush_context) -> None:
+    if any(isinstance(obj, Character) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info[_CHANGED] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _flag_bulk_statements(orm_execute_state) -> None:
+    if orm_execute_state.is_select:
+        return
+    if any(mapper.class_ is Character for mapper in orm_execute_state.all_mappers):
+        orm_execute_state.session.info[_CHANGED] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session: Session) -> None:
+    if session.info.pop(_CHANGED, False):
+        catalogue_cache.bump()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session: Session) -> None:
+    session.info.pop(_CHANGED, None)
@@ -8,7 +8,11 @@ from app.schemas.chat import ChatRole
 
 
 class ChatService:
-    """Service for managing chat operations and usage tracking"""
+    """Service for managing chat operations and usage tracking
+
+    Every method takes the session holding the user's chat data, i.e.
+    ShardSessions.for_user(user_id) (the main session when sharding is off).
+    """
 
     @staticmethod
     async def update_usage_stats(
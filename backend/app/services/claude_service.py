@@ -3,34 +3,108 @@ Claude API service for AI chat functionality
 """
 import os
 import asyncio
+import logging
+import time
 from typing import List, Dict, Optional, Tuple
-from anthropic import AsyncAnthropic
 from app.core.config import settings
+from app.core.lifecycle import lifecycle
+from app.core.metrics import CLAUDE_DURATION, CLAUDE_RESPONSES, CLAUDE_TOKENS
+from app.core.tracing import mark_error, span, span_var
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Stops calling the Claude API after consecutive failures
+
+    After ``failures`` errors in a row the circuit opens and chats get the
+    fallback response at once instead of waiting for another failing call.
+    Once ``reset_seconds`` have passed a single trial call is let through
+    (half open); it closes the circuit on success and reopens it on error.
+    """
+
+    def __init__(self, failures: int, reset_seconds: float):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self._trial or time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a call may go to the API now"""
+        if self.opened_at is None:
+            return True
+        if self._trial or time.monotonic() - self.opened_at < self.reset_seconds:
+            return False
+        self._trial = True
+        return True
+
+    def release(self) -> None:
+        """The call ended without an outcome (cancelled)"""
+        self._trial = False
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._trial = False
+        if self.failures > 0 and (self.opened_at is not None or self.consecutive_failures >= self.failures):
+            if self.opened_at is None:
+                logger.warning(f"Claude API circuit open after {self.consecutive_failures} failures")
+            self.opened_at = time.monotonic()
 
 
 class ClaudeService:
     """Service for integrating with Claude API"""
     
     def __init__(self):
-        # Initialize Claude client
-        api_key = getattr(settings, 'CLAUDE_API_KEY', None) or os.getenv('CLAUDE_API_KEY')
-        
-        if api_key:
+        # Claude client is created on first use: importing anthropic takes about a second
+        self.api_key = getattr(settings, 'CLAUDE_API_KEY', None) or os.getenv('CLAUDE_API_KEY')
+        self.model = "claude-3-haiku-20240307"  # Claude 3 Haiku model
+        self.max_tokens = 1000
+        self.api_available = bool(self.api_key)  # Without a key, fallback responses are used
+        self._client = None
+        self.circuit = CircuitBreaker(
+            failures=settings.CLAUDE_CIRCUIT_FAILURES, reset_seconds=settings.CLAUDE_CIRCUIT_RESET_SECONDS
+        )
+    
+    @property
+    def client(self):
+        """Anthropic client, imported and created on first access; None if unavailable"""
+        if self._client is None and self.api_available:
             try:
-                self.client = AsyncAnthropic(api_key=api_key)
-                self.model = "claude-3-haiku-20240307"  # Claude 3 Haiku model
-                self.max_tokens = 1000
-                self.api_available = True
-                # Claude API service initialized successfully
-                # Using configured Claude model
-            except Exception as e:
+                from anthropic import AsyncAnthropic
+
+                self._client = AsyncAnthropic(api_key=self.api_key)
+            except Exception:
                 # Failed to initialize Claude API client
-                self.client = None
                 self.api_available = False
-        else:
-            self.client = None
-            self.api_available = False
-            # Claude API key not found, using fallback responses
+        return self._client
+    
+    def warm_up(self) -> None:
+        """
+        Import the Anthropic SDK ahead of the first chat (run off the event loop)
+
+        Only the module is imported, no client is created, so this is also
+        safe in the gunicorn master before workers are forked.
+        """
+        if self.api_available:
+            try:
+                import anthropic  # noqa: F401
+            except ImportError:
+                self.api_available = False
     
     async def generate_response(
         self,
@@ -49,36 +123,62 @@ class ClaudeService:
         Returns:
             Tuple of (response_content, token_usage)
         """
-        # If API is not available, return fallback response
-        if not self.api_available:
-            return await self._generate_fallback_response(messages)
-        
-        try:
-            max_tokens = max_tokens or self.max_tokens
-            
-            response = await self.client.messages.create(
-                model=self.model,
-                max_tokens=max_tokens,
-                system=system_prompt,
-                messages=messages
-            )
+        with span("claude.generate_response", model=getattr(self, "model", None)) as current:
+            # If API is not available, return fallback response
+            if self.client is None:
+                return await self._generate_fallback_response(messages, reason="unavailable")
+            if not self.circuit.allow():
+                return await self._generate_fallback_response(messages, reason="circuit_open")
             
-            # Extract response content
-            content = ""
-            if response.content and len(response.content) > 0:
-                content = response.content[0].text
-            
-            # Calculate token usage
-            token_usage = response.usage.input_tokens + response.usage.output_tokens
-            
-            return content, token_usage
-            
-        except Exception as e:
-            # Claude API error occurred - return fallback response with estimated token usage
-            return await self._generate_fallback_response(messages)
+            started = time.perf_counter()
+            try:
+                max_tokens = max_tokens or self.max_tokens
+                
+                # Counted as in flight so shutdown waits for it
+                async with lifecycle.track("claude"):
+                    response = await self.client.messages.create(
+                        model=self.model,
+                        max_tokens=max_tokens,
+                        system=system_prompt,
+                        messages=messages
+                    )
+                CLAUDE_DURATION.labels("success").observe(time.perf_counter() - started)
+                
+                # Extract response content
+                content = ""
+                if response.content and len(response.content) > 0:
+                    content = response.content[0].text
+                
+                # Calculate token usage
+                token_usage = response.usage.input_tokens + response.usage.output_tokens
+                CLAUDE_TOKENS.labels("input").inc(response.usage.input_tokens)
+                CLAUDE_TOKENS.labels("output").inc(response.usage.output_tokens)
+                CLAUDE_RESPONSES.labels("api", "").inc()
+                if current is not None:
+                    current.set_attribute("input_tokens", response.usage.input_tokens)
+                    current.set_attribute("output_tokens", response.usage.output_tokens)
+                
+                self.circuit.record_success()
+                return content, token_usage
+                
+            except asyncio.CancelledError:
+                self.circuit.release()
+                raise
+            except Exception as e:
+                # Claude API error occurred - return fallback response with estimated token usage
+                self.circuit.record_failure()
+                CLAUDE_DURATION.labels("error").observe(time.perf_counter() - started)
+                mark_error(f"{type(e).__name__}: {e}")
+                return await self._generate_fallback_response(messages, reason="error")
     
-    async def _generate_fallback_response(self, messages: List[Dict[str, str]]) -> Tuple[str, int]:
+    async def _generate_fallback_response(
+        self, messages: List[Dict[str, str]], reason: str = "unavailable"
+    ) -> Tuple[str, int]:
         """Generate a simple fallback response when Claude API is not available"""
+        CLAUDE_RESPONSES.labels("fallback", reason).inc()
+        current = span_var.get()
+        if current is not None:
+            current.set_attribute("fallback", reason)
         # Simple, honest fallback without mock conversational responses
         fallback_message = "죄송합니다. 현재 AI 서비스에 일시적인 문제가 있어 응답을 생성할 수 없습니다. 잠시 후 다시 시도해주세요."
         estimated_tokens = 50  # Fixed estimate for this standard message
@@ -122,6 +222,12 @@ class ClaudeService:
     def is_available(self) -> bool:
         """Check if Claude API is available"""
         return self.api_available
+    
+    async def close(self) -> None:
+        """Close the client's HTTP connections (shutdown)"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
 
 
 # Create singleton instance
@@ -0,0 +1,191 @@
+"""
+Liveness and readiness of a worker
+
+Liveness (``/health/live``) only says that the process and its event loop
+answer; an orchestrator restarts a worker that stops answering it.
+Readiness (``/health/ready``) says whether the worker should get traffic
+and checks what requests depend on:
+
+- database: a round trip on the writer and reader pools and every chat
+  shard; one slower than HEALTH_DB_MAX_MS fails. With split SQLite pools
+  the writer is a single connection, so the round trip waits behind the
+  writes queued for it and a locked or stuck writer shows up here
+- event_loop: the lag measured by the loop monitor against
+  HEALTH_LOOP_LAG_MAX_MS
+- queues: password hashing and image processing fail when full (they
+  answer 429), the log queue is degraded when nearly full; work in flight
+  is listed
+- claude: an open circuit or a missing API key is degraded, not a
+  failure: every worker shares the upstream and chats still get the
+  fallback reply
+- lifecycle: a draining worker is never ready
+
+A failed check makes the worker "unhealthy" (503), a degraded one
+"degraded" (200). The result is reused for HEALTH_CACHE_SECONDS and
+concurrent probes share one run of the checks, so probing costs nothing.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.auth.hashing import password_hasher
+from app.core.config import settings
+from app.core.lifecycle import lifecycle
+from app.core.logging_config import log_queue_depth
+from app.core.loop_monitor import LoopMonitor
+from app.database import engine, read_engine
+from app.schemas.common import HealthCheckResponse
+from app.services.claude_service import claude_service
+from app.services.image_processing import image_processor
+from app.sharding import shard_router
+
+SERVICE = "LionRocket AI Chat"
+VERSION = "1.0.0"
+
+OK, DEGRADED, FAIL = "ok", "degraded", "fail"
+# Overall status from the worst check
+STATUS = {OK: "healthy", DEGRADED: "degraded", FAIL: "unhealthy"}
+SEVERITY = {OK: 0, DEGRADED: 1, FAIL: 2}
+
+# Share of the log queue in use from which records risk being dropped
+LOG_QUEUE_DEGRADED_RATIO = 0.9
+
+
+def _timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def liveness() -> HealthCheckResponse:
+    return HealthCheckResponse(status="healthy", service=SERVICE, version=VERSION, timestamp=_timestamp())
+
+
+async def _ping(db_engine) -> float:
+    """Milliseconds to get a pooled connection and run a statement on it"""
+    started = time.perf_counter()
+    async with db_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+    return (time.perf_counter() - started) * 1000
+
+
+async def check_database() -> Dict[str, Any]:
+    engines = {"main": engine}
+    if read_engine is not engine:
+        engines["main_read"] = read_engine
+    if shard_router is not None:
+        engines.update((f"shard{index}", shard_engine) for index, shard_engine in enumerate(shard_router.engines))
+    limit = settings.HEALTH_DB_MAX_MS / 1000
+    results = await asyncio.gather(
+        *(asyncio.wait_for(_ping(db_engine), limit) for db_engine in engines.values()),
+        return_exceptions=True,
+    )
+
+    latency, errors = {}, {}
+    for name, result in zip(engines, results):
+        if isinstance(result, asyncio.TimeoutError):
+            errors[name] = f"no answer within {settings.HEALTH_DB_MAX_MS} ms"
+        elif isinstance(result, BaseException):
+            errors[name] = f"{type(result).__name__}: {result}"
+        else:
+            latency[name] = round(result, 1)
+    check = {"status": FAIL if errors else OK, "latency_ms": latency, "max_ms": settings.HEALTH_DB_MAX_MS}
+    if errors:
+        check["errors"] = errors
+    return check
+
+
+def check_event_loop(monitor: Optional[LoopMonitor]) -> Dict[str, Any]:
+    if monitor is None:
+        # METRICS_ENABLED=false: nothing samples the loop
+        return {"status": OK, "lag_ms": None}
+    lag_ms = round(monitor.lag * 1000, 1)
+    return {
+        "status": FAIL if lag_ms > settings.HEALTH_LOOP_LAG_MAX_MS else OK,
+        "lag_ms": lag_ms,
+        "max_ms": settings.HEALTH_LOOP_LAG_MAX_MS,
+        "blocks": monitor.blocks,
+    }
+
+
+def check_queues() -> Dict[str, Any]:
+    hashing = (password_hasher.pending, password_hasher.capacity)
+    images = (image_processor.pending, image_processor.capacity)
+    logs = log_queue_depth()
+
+    status = OK
+    if hashing[0] >= hashing[1] or images[0] >= images[1]:
+        status = FAIL
+    elif logs[0] >= logs[1] * LOG_QUEUE_DEGRADED_RATIO:
+        status = DEGRADED
+    return {
+        "status": status,
+        "password_hash": {"pending": hashing[0], "capacity": hashing[1]},
+        "image_processing": {"pending": images[0], "capacity": images[1]},
+        "log_records": {"pending": logs[0], "capacity": logs[1]},
+        "in_flight": lifecycle.pending(),
+    }
+
+
+def check_claude() -> Dict[str, Any]:
+    if not claude_service.is_available():
+        return {"status": DEGRADED, "circuit": None, "detail": "API not configured, fallback replies"}
+    circuit = claude_service.circuit
+    return {
+        "status": OK if circuit.state == "closed" else DEGRADED,
+        "circuit": circuit.state,
+        "consecutive_failures": circuit.consecutive_failures,
+    }
+
+
+def _response(checks: Dict[str, Dict[str, Any]]) -> Tuple[int, HealthCheckResponse]:
+    worst = max((check["status"] for check in checks.values()), key=SEVERITY.__getitem__)
+    response = HealthCheckResponse(
+        status=STATUS[worst], service=SERVICE, version=VERSION, timestamp=_timestamp(), checks=checks
+    )
+    return (503 if worst == FAIL else 200), response
+
+
+class ReadinessProbe:
+    """Readiness checks of this worker, reused for ``ttl`` seconds"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._result: Optional[Tuple[float, int, HealthCheckResponse]] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _cached(self) -> Optional[Tuple[int, HealthCheckResponse]]:
+        if self._result is not None and time.monotonic() - self._result[0] < self.ttl:
+            return self._result[1], self._result[2]
+        return None
+
+    async def check(self, monitor: Optional[LoopMonitor] = None) -> Tuple[int, HealthCheckResponse]:
+        """Status code and body for /health/ready"""
+        if lifecycle.draining:
+            # Not cached and no database use: the engines may already be closing
+            return _response({"lifecycle": {"status": FAIL, "draining": True}})
+        cached = self._cached()
+        if cached is not None:
+            return cached
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Probes that waited for the lock get the result of the one that held it
+            cached = self._cached()
+            if cached is not None:
+                return cached
+            checks = {
+                "database": await check_database(),
+                "event_loop": check_event_loop(monitor),
+                "queues": check_queues(),
+                "claude": check_claude(),
+                "lifecycle": {"status": OK, "draining": False},
+            }
+            status_code, response = _response(checks)
+            self._result = (time.monotonic(), status_code, response)
+            return status_code, response
+
+
+readiness = ReadinessProbe(ttl=settings.HEALTH_CACHE_SECONDS)
@@ -0,0 +1,128 @@
+"""
+Avatar transcoding in a process pool
+
+Decoding and re-encoding images is CPU-bound and holds the GIL, so it runs
+in a small pool of separate processes. Uploads are decoded by Pillow
+(whatever their declared content type), orientation is fixed from EXIF,
+animated images keep their first frame, and the result is written as WebP:
+one normalized image no larger than AVATAR_MAX_DIMENSION plus one square
+thumbnail per AVATAR_THUMBNAIL_SIZES entry. Like the password hasher, jobs
+beyond the pool plus a short wait queue are rejected with 429.
+"""
+import multiprocessing
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from app.core.config import settings
+from app.core.workers import BoundedExecutor
+
+AVATAR_EXTENSION = ".webp"
+AVATAR_MEDIA_TYPE = "image/webp"
+
+# Formats accepted from uploads, as detected by Pillow
+ACCEPTED_FORMATS = {"PNG", "JPEG", "GIF", "WEBP"}
+
+
+class InvalidImage(ValueError):
+    """The upload could not be decoded as a supported image"""
+
+
+def avatar_filename(name: str, size: Optional[int] = None) -> str:
+    """File name of the normalized avatar or of one of its thumbnails"""
+    if size is None:
+        return f"{name}{AVATAR_EXTENSION}"
+    return f"{name}_{size}{AVATAR_EXTENSION}"
+
+
+def pick_thumbnail_size(requested: Optional[int], sizes: Sequence[int]) -> Optional[int]:
+    """Smallest thumbnail at least as large as requested; None means the full image"""
+    if requested is None:
+        return None
+    for size in sorted(sizes):
+        if size >= requested:
+            return size
+    return None
+
+
+def transcode_avatar(source: str, directory: str, name: str, max_dimension: int,
+                     thumbnail_sizes: List[int], quality: int, max_pixels: int) -> Dict[str, int]:
+    """
+    Decode ``source`` and write the WebP avatar and thumbnails into ``directory``
+
+    Runs in a pool process. Returns the size in bytes of every file written.
+    The thumbnails are written before the full-size file, so a transcode
+    that dies midway leaves no full-size file and is redone.
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    written = {}
+    try:
+        with warnings.catch_warnings():
+            # Treat oversized images as invalid rather than decoding them anyway
+            warnings.simplefilter("error", Image.DecompressionBombWarning)
+            with Image.open(source) as image:
+                if image.format not in ACCEPTED_FORMATS:
+                    raise InvalidImage(f"Unsupported image format: {image.format}")
+                image.seek(0)
+                image = ImageOps.exif_transpose(image)
+                image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+    except (UnidentifiedImageError, Image.DecompressionBombError, Image.DecompressionBombWarning,
+            OSError, SyntaxError) as e:
+        raise InvalidImage(str(e)) from e
+
+    outputs = [(size, ImageOps.fit(image, (size, size), Image.LANCZOS)) for size in thumbnail_sizes]
+    # The full-size file is written last: its presence marks the blob complete
+    full = image.copy()
+    full.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    outputs.append((None, full))
+
+    for size, output in outputs:
+        path = os.path.join(directory, avatar_filename(name, size))
+        # Per process: an identical upload may be transcoded concurrently
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        output.save(tmp_path, "WEBP", quality=quality, method=4)
+        os.replace(tmp_path, path)
+        written[avatar_filename(name, size)] = os.path.getsize(path)
+    return written
+
+
+class ImageProcessor(BoundedExecutor):
+    """Runs avatar transcoding in worker processes with a concurrency and queue limit"""
+
+    def __init__(self, workers: int, queue_size: int, retry_after: int = 1):
+        super().__init__(
+            # spawn: forking a process that runs an event loop and threads is unsafe
+            lambda workers: ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            ),
+            workers=workers,
+            queue_size=queue_size,
+            busy_detail="Too many image uploads, please retry shortly",
+            retry_after=retry_after,
+        )
+
+    async def transcode_avatar(self, source: Path, directory: Path, name: str) -> Dict[str, int]:
+        return await self.run(
+            transcode_avatar,
+            str(source),
+            str(directory),
+            name,
+            settings.AVATAR_MAX_DIMENSION,
+            list(settings.AVATAR_THUMBNAIL_SIZES),
+            settings.AVATAR_WEBP_QUALITY,
+            settings.AVATAR_MAX_PIXELS,
+        )
+
+    def shutdown(self) -> None:
+        # Pending transcodes are abandoned; their uploads give back the blob reference
+        super().shutdown(wait=False, cancel_futures=True)
+
+
+image_processor = ImageProcessor(
+    workers=settings.IMAGE_PROCESS_WORKERS,
+    queue_size=settings.IMAGE_PROCESS_QUEUE_SIZE,
+)
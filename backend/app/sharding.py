@@ -0,0 +1,184 @@
+"""
+Optional horizontal sharding of per-user chat data
+
+When CHAT_SHARD_COUNT > 1, rows of the chats, conversation_summaries and
+usage_stats tables live in CHAT_SHARD_COUNT separate databases, chosen by a
+stable hash of user_id. Users and characters stay in the main database.
+A user's rows always land on one shard, so per-user queries hit a single
+database and cross-user (admin) queries fan out and merge.
+
+Primary keys of sharded tables are only unique within a shard.
+"""
+import asyncio
+import zlib
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from fastapi import Depends
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.core.config import settings
+from app.core.query_stats import instrument_engine
+from app.database import (
+    AsyncSessionLocal,
+    get_db,
+    get_engine_kwargs,
+    install_sqlite_profile,
+    create_session_factory,
+)
+from app.models import Base, Chat, ConversationSummary, UsageStat
+
+T = TypeVar("T")
+
+# 샤딩 대상 테이블
+SHARDED_TABLES = [Chat.__table__, ConversationSummary.__table__, UsageStat.__table__]
+
+
+class ShardRouter:
+    """Maps user IDs to shard databases and owns their engines"""
+
+    def __init__(self, urls: List[str]):
+        self.urls = [
+            url.replace("sqlite:///", "sqlite+aiosqlite:///") if url.startswith("sqlite:///") else url
+            for url in urls
+        ]
+        self.engines = []
+        for index, url in enumerate(self.urls):
+            shard_engine = create_async_engine(url, **get_engine_kwargs(url))
+            if "sqlite" in url:
+                install_sqlite_profile(shard_engine)
+            instrument_engine(shard_engine, f"shard{index}")
+            self.engines.append(shard_engine)
+        self.session_factories = [create_session_factory(e) for e in self.engines]
+
+    @property
+    def count(self) -> int:
+        return len(self.engines)
+
+    def shard_for(self, user_id: int) -> int:
+        """Stable shard index for a user (independent of PYTHONHASHSEED)"""
+        return zlib.crc32(str(user_id).encode()) % self.count
+
+    async def create_tables(self) -> None:
+        for shard_engine in self.engines:
+            async with shard_engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all, tables=SHARDED_TABLES)
+
+    async def dispose(self) -> None:
+        for shard_engine in self.engines:
+            await shard_engine.dispose()
+
+
+def _build_shard_router() -> Optional[ShardRouter]:
+    if settings.CHAT_SHARD_COUNT <= 1:
+        return None
+    return ShardRouter(
+        [
+            settings.CHAT_SHARD_URL_TEMPLATE.format(shard=index)
+            for index in range(settings.CHAT_SHARD_COUNT)
+        ]
+    )
+
+
+shard_router = _build_shard_router()
+SHARDING_ENABLED = shard_router is not None
+
+
+class ShardSessions:
+    """
+    Per-request access to chat data sessions
+
+    Without sharding every accessor returns the request's main session, so
+    callers are written once for both modes. Shard sessions are opened lazily.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self._sessions: Dict[int, AsyncSession] = {}
+
+    def _session(self, index: int) -> AsyncSession:
+        if index not in self._sessions:
+            self._sessions[index] = shard_router.session_factories[index]()
+        return self._sessions[index]
+
+    def for_user(self, user_id: int) -> AsyncSession:
+        """Session holding the given user's chat data"""
+        if shard_router is None:
+            return self.db
+        return self._session(shard_router.shard_for(user_id))
+
+    def all(self) -> List[AsyncSession]:
+        """One session per shard (only the main session without sharding)"""
+        if shard_router is None:
+            return [self.db]
+        return [self._session(index) for index in range(shard_router.count)]
+
+    def group_users(self, user_ids: Iterable[int]) -> List[Tuple[AsyncSession, List[int]]]:
+        """The given users grouped by the session holding their chat data"""
+        if shard_router is None:
+            user_ids = list(user_ids)
+            return [(self.db, user_ids)] if user_ids else []
+        groups: Dict[int, List[int]] = defaultdict(list)
+        for user_id in user_ids:
+            groups[shard_router.shard_for(user_id)].append(user_id)
+        return [(self._session(index), ids) for index, ids in groups.items()]
+
+    async def fan_out(self, query: Callable[[AsyncSession], Awaitable[T]]) -> List[T]:
+        """Run a query against every shard concurrently and collect the results"""
+        return list(await asyncio.gather(*(query(session) for session in self.all())))
+
+    async def delete_user_data(self, user_id: int) -> None:
+        """Delete a user's sharded rows (ORM cascades cover the unsharded case)"""
+        if shard_router is not None:
+            await _delete_chat_data(self.for_user(user_id), user_id=user_id)
+
+    async def delete_character_data(self, character_id: int) -> None:
+        """Delete a character's sharded rows on every shard"""
+        if shard_router is not None:
+            await self.fan_out(lambda session: _delete_chat_data(session, character_id=character_id))
+
+    async def commit_all(self) -> None:
+        """Commit the main session and every shard session opened during the request"""
+        await self.db.commit()
+        for session in self._sessions.values():
+            await session.commit()
+
+    async def close(self) -> None:
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+
+def open_chat_session(user_id: int) -> AsyncSession:
+    """New session on the database holding a user's chat data, for work that outlives a request"""
+    if shard_router is None:
+        return AsyncSessionLocal()
+    return shard_router.session_factories[shard_router.shard_for(user_id)]()
+
+
+async def _delete_chat_data(
+    session: AsyncSession, user_id: Optional[int] = None, character_id: Optional[int] = None
+) -> None:
+    for table in SHARDED_TABLES:
+        statement = delete(table)
+        if user_id is not None:
+            statement = statement.where(table.c.user_id == user_id)
+        if character_id is not None:
+            statement = statement.where(table.c.character_id == character_id)
+        await session.execute(statement)
+
+
+# 채팅 데이터 세션 의존성
+async def get_chat_shards(db: AsyncSession = Depends(get_db)) -> ShardSessions:
+    shards = ShardSessions(db)
+    try:
+        yield shards
+    finally:
+        await shards.close()
+
+
+async def create_shard_tables() -> None:
+    """Create the sharded tables in every shard database (no-op without sharding)"""
+    if shard_router is not None:
+        await shard_router.create_tables()
@@ -0,0 +1,61 @@
+"""
+Benchmark the per-request cost of admin rate limit counting as keys grow
+
+Usage:
+    python -m benchmarks.admin_rate_limit [--hits 100000]
+
+Compares the previous dict of "user:action:minute" counters, which was
+scanned on every request, with the ring-buffer sliding windows used by
+AdminRateLimitMiddleware for in-process storage.
+"""
+import argparse
+import random
+import time
+
+from app.middleware.rate_limit_store import SlidingWindowRateLimitStore
+
+
+class DictMinuteCounters:
+    """The counting scheme AdminRateLimitMiddleware used before"""
+
+    def __init__(self):
+        self.request_counts = {}
+
+    def hit(self, key: str, limit: int, period: float = 60.0) -> float:
+        current_minute = int(time.time() // 60)
+        rate_key = f"{key}:{current_minute}"
+        self.request_counts[rate_key] = self.request_counts.get(rate_key, 0) + 1
+        keys_to_remove = [
+            k for k in self.request_counts if current_minute - int(k.split(":")[-1]) > 2
+        ]
+        for k in keys_to_remove:
+            del self.request_counts[k]
+        return 0.0 if self.request_counts[rate_key] <= limit else 1.0
+
+
+def _per_hit(store, keys: int, hits: int) -> float:
+    names = [f"admin_{i}:read" for i in range(keys)]
+    for name in names:
+        store.hit(name, 10**9)
+    start = time.perf_counter()
+    for _ in range(hits):
+        store.hit(random.choice(names), 10**9)
+    return (time.perf_counter() - start) / hits * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hits", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'tracked keys':>12}{'dict us/hit':>14}{'ring us/hit':>14}")
+    for keys in (10, 100, 1000, 10000):
+        # The old scheme is O(keys) per hit; keep its run short
+        dict_hits = max(100, args.hits // keys)
+        old = _per_hit(DictMinuteCounters(), keys, dict_hits)
+        new = _per_hit(SlidingWindowRateLimitStore(maxsize=keys), keys, args.hits)
+        print(f"{keys:>12}{old:>14.2f}{new:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
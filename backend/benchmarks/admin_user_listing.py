@@ -0,0 +1,157 @@
+"""
+Benchmark the admin user listing's activity columns against a large chat table
+
+Usage:
+    python -m benchmarks.admin_user_listing [--chats 1000000] [--users 5000]
+                                            [--pages 20,100,500] [--repeat 5]
+
+Builds a SQLite database (balanced profile) with the given number of chats
+and daily usage stats spread over the users, then fills in the activity
+columns of ``GET /admin/users`` pages of each size two ways: the previous
+path, three queries per user (distinct characters, last chat, token sum),
+and ``add_user_activity``, one grouped query for the page. Reports the
+statements executed and the best time per page, and checks that both
+paths agree.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, select, func
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.database import get_engine_kwargs, install_sqlite_profile
+from app.models import Base, Chat, UsageStat
+from app.routers.admin import add_user_activity
+from app.sharding import ShardSessions
+
+CHARACTERS = 100
+TIMESTAMP = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _populate(path: str, users: int, chats: int) -> None:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+
+    rng = random.Random(42)
+    start = datetime(2025, 1, 1)
+    with sqlite3.connect(path) as connection:
+        connection.executemany(
+            "INSERT INTO users (user_id, username, email, password_hash, is_admin, is_active, token_version,"
+            " created_at) VALUES (?, ?, ?, 'x', 0, 1, 0, ?)",
+            ((i, f"user{i}", f"user{i}@example.com", start.strftime(TIMESTAMP)) for i in range(1, users + 1)),
+        )
+        connection.executemany(
+            "INSERT INTO characters (character_id, name, gender, intro, personality_tags, interest_tags, prompt,"
+            " created_by, is_active) VALUES (?, ?, 'female', 'intro', '[]', '[]', 'prompt', 1, 1)",
+            ((i, f"character{i}") for i in range(1, CHARACTERS + 1)),
+        )
+
+        usage = {}
+
+        def chat_rows():
+            for _ in range(chats):
+                user_id = rng.randint(1, users)
+                character_id = rng.randint(1, CHARACTERS)
+                created_at = start + timedelta(seconds=rng.randint(0, 180 * 86400))
+                tokens = rng.randint(20, 400)
+                key = (user_id, character_id, created_at.date())
+                usage[key] = usage.get(key, 0) + tokens
+                yield user_id, character_id, "assistant", "reply", tokens, created_at.strftime(TIMESTAMP)
+
+        connection.executemany(
+            "INSERT INTO chats (user_id, character_id, role, content, token_cost, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            chat_rows(),
+        )
+        connection.executemany(
+            "INSERT INTO usage_stats (user_id, character_id, usage_date, chat_count, token_count)"
+            " VALUES (?, ?, ?, 1, ?)",
+            ((user_id, character_id, day.isoformat(), tokens)
+             for (user_id, character_id, day), tokens in usage.items()),
+        )
+        connection.execute("ANALYZE")
+
+
+async def _previous_path(db: AsyncSession, user_responses: list) -> None:
+    for user_response in user_responses:
+        user_id = user_response["user_id"]
+        total_chats = await db.scalar(
+            select(func.count(func.distinct(Chat.character_id))).select_from(Chat).where(Chat.user_id == user_id)
+        )
+        last_chat = (await db.execute(
+            select(Chat).where(Chat.user_id == user_id).order_by(Chat.created_at.desc()).limit(1)
+        )).scalar_one_or_none()
+        total_tokens = await db.scalar(
+            select(func.coalesce(func.sum(UsageStat.token_count), 0)).where(UsageStat.user_id == user_id)
+        )
+        user_response["total_chats"] = total_chats
+        user_response["total_tokens"] = total_tokens or 0
+        user_response["last_active"] = last_chat.created_at if last_chat else None
+        db.expunge_all()
+
+
+async def _measure(engine, counter: list, run, page: list, repeat: int):
+    best, statements, result = None, 0, None
+    for _ in range(repeat):
+        responses = [dict(user_response) for user_response in page]
+        async with AsyncSession(engine) as db:
+            counter[0] = 0
+            started = time.perf_counter()
+            await run(db, responses)
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        statements, result = counter[0], responses
+    return best, statements, result
+
+
+async def _benchmark(path: str, users: int, pages: list, repeat: int) -> None:
+    url = f"sqlite+aiosqlite:///{path}"
+    engine = create_async_engine(url, **get_engine_kwargs(url))
+    install_sqlite_profile(engine)
+    counter = [0]
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _count(*args):
+        counter[0] += 1
+
+    async def grouped_path(db: AsyncSession, user_responses: list) -> None:
+        await add_user_activity(ShardSessions(db), user_responses)
+
+    print(f"{'page':>6}{'path':>10}{'queries':>10}{'ms':>10}")
+    for size in pages:
+        # Users spread over the table, as a page of a large listing would be
+        page = [{"user_id": user_id} for user_id in range(1, users + 1, max(1, users // size))][:size]
+        previous = await _measure(engine, counter, _previous_path, page, repeat)
+        grouped = await _measure(engine, counter, grouped_path, page, repeat)
+        assert previous[2] == grouped[2], "activity paths disagree"
+        for name, (elapsed, statements, _) in (("per user", previous), ("grouped", grouped)):
+            print(f"{size:>6}{name:>10}{statements:>10}{elapsed * 1000:>10.1f}")
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chats", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--pages", default="20,100,500", help="comma separated page sizes")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "admin.db")
+        started = time.perf_counter()
+        _populate(path, args.users, args.chats)
+        print(f"{args.chats} chats, {args.users} users, {CHARACTERS} characters "
+              f"(built in {time.perf_counter() - started:.1f} s), best of {args.repeat}")
+        asyncio.run(_benchmark(path, args.users, [int(size) for size in args.pages.split(",")], args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark per-request middleware overhead: BaseHTTPMiddleware vs pure ASGI
+
+Usage:
+    python -m benchmarks.middleware_stack [--requests 5000]
+
+Requests are driven straight through the ASGI interface (no HTTP server or
+client) against a trivial endpoint, so the numbers are the cost of the
+middleware layers themselves. The "base_http" stack re-creates the previous
+layers (core, request size and the four admin middlewares) with the same
+per-request work.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.middleware.admin import AdminMiddleware
+from app.middleware.core import CoreMiddleware, RequestSizeMiddleware
+from app.middleware.rate_limit_store import SlidingWindowRateLimitStore
+
+
+class LegacyCore(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next) -> Response:
+        request.state.request_id = str(uuid.uuid4())
+        start = time.time()
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request.state.request_id
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-Process-Time"] = str(time.time() - start)
+        return response
+
+
+class LegacySize(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next) -> Response:
+        if int(request.headers.get("content-length", 0)) > 5 * 1024 * 1024:
+            return Response(status_code=413)
+        return await call_next(request)
+
+
+class LegacyAdminLayer(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next) -> Response:
+        if not request.url.path.startswith("/admin") or request.method == "OPTIONS":
+            return await call_next(request)
+        response = await call_next(request)
+        response.headers["X-Frame-Options"] = "DENY"
+        return response
+
+
+def build_app(stack: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.get("/admin/ping")
+    async def admin_ping():
+        return {"ok": True}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for _ in range(10):
+                yield b"x" * 1024
+
+        return StreamingResponse(chunks())
+
+    if stack == "base_http":
+        for _ in range(4):
+            app.add_middleware(LegacyAdminLayer)
+        app.add_middleware(LegacySize)
+        app.add_middleware(LegacyCore)
+    else:
+        app.add_middleware(AdminMiddleware, store=SlidingWindowRateLimitStore())
+        app.add_middleware(RequestSizeMiddleware)
+        app.add_middleware(CoreMiddleware)
+    return app
+
+
+async def _request(app, path: str) -> None:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+    }
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # Never disconnect; streaming responses cancel this wait when done
+        await asyncio.Event().wait()
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def _measure(app, path: str, requests: int) -> float:
+    for _ in range(100):
+        await _request(app, path)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await _request(app, path)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def main_async(requests: int) -> None:
+    apps = {"none": None, "base_http": build_app("base_http"), "asgi": build_app("asgi")}
+    bare = FastAPI()
+    bare.router.routes.extend(build_app("none").router.routes)
+    apps["none"] = bare
+
+    print(f"{'path':<14}" + "".join(f"{name + ' us/req':>18}" for name in apps))
+    for path in ("/ping", "/admin/ping", "/stream"):
+        row = [await _measure(app, path, requests) for app in apps.values()]
+        print(f"{path:<14}" + "".join(f"{value:>18.1f}" for value in row))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark the per-request cost of the rate limit storage backends
+
+Usage:
+    python -m benchmarks.rate_limit_storage [--hits 50000] [--keys 1000] [--processes 4]
+
+Every process hits random keys of one store as fast as it can, so the
+SQLite numbers include lock contention between workers sharing the file.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from app.middleware.rate_limit_store import MemoryRateLimitStore, SQLiteRateLimitStore
+
+
+def _run(store, hits: int, keys: int) -> float:
+    names = [f"read:user:{i}" for i in range(keys)]
+    start = time.perf_counter()
+    for _ in range(hits):
+        store.hit(random.choice(names), 100)
+    return (time.perf_counter() - start) / hits * 1e6
+
+
+def _worker(path: str, hits: int, keys: int, results) -> None:
+    results.put(_run(SQLiteRateLimitStore(path), hits, keys))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hits", type=int, default=50000, help="hits per process")
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'backend':<24}{'processes':>10}{'us/hit':>10}")
+    print(f"{'memory':<24}{1:>10}{_run(MemoryRateLimitStore(), args.hits, args.keys):>10.1f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ratelimit.db")
+        print(f"{'sqlite':<24}{1:>10}{_run(SQLiteRateLimitStore(path), args.hits, args.keys):>10.1f}")
+
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=_worker, args=(path, args.hits, args.keys, results))
+            for _ in range(args.processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        per_hit = [results.get() for _ in workers]
+        print(f"{'sqlite (shared)':<24}{args.processes:>10}{max(per_hit):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
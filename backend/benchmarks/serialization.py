@@ -0,0 +1,107 @@
+"""
+Benchmark list endpoint serialization per 1,000 rows
+
+Usage:
+    python -m benchmarks.serialization [--rows 1000] [--repeat 20]
+
+Compares the previous path (ORM objects, ``create_character_response`` per
+row, then FastAPI validating the result against ``response_model`` and
+encoding it with the stdlib json module) with the row serializers: the
+selected columns as tuples, zipped into dicts and encoded by orjson.
+Both paths read the same rows from an in-memory SQLite database, and the
+script checks that they produce the same JSON.
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app.core.serialization import dumps
+from app.models import Base, Character, User
+from app.routers.character import character_rows, create_character_response
+from app.schemas.character import CharacterListResponse
+
+
+def _populate(session: Session, rows: int) -> None:
+    session.add(User(user_id=1, username="bench", email="bench@example.com", password_hash="x"))
+    session.add_all(
+        Character(
+            name=f"Character {i}",
+            gender="female" if i % 2 else "male",
+            intro="A short introduction that is about as long as real ones " * 2,
+            personality_tags=["cheerful", "curious", "kind"],
+            interest_tags=["music", "travel"],
+            prompt="You are a friendly character. " * 10,
+            avatar_url=None if i % 3 else f"{i:064x}",
+            created_by=1,
+            created_at=datetime(2025, 1, 1, 12, 0, i % 60, 123456),
+        )
+        for i in range(rows)
+    )
+    session.commit()
+
+
+def _orm_path(session: Session, field, loop) -> tuple:
+    start = time.perf_counter()
+    characters = session.execute(select(Character)).scalars().all()
+    fetched = time.perf_counter()
+    content = CharacterListResponse(
+        characters=[create_character_response(character) for character in characters],
+        total=len(characters), skip=0, limit=len(characters),
+    )
+    body = JSONResponse(loop.run_until_complete(
+        serialize_response(field=field, response_content=content)
+    )).body
+    session.expunge_all()
+    return fetched - start, time.perf_counter() - fetched, body
+
+
+def _row_path(session: Session) -> tuple:
+    start = time.perf_counter()
+    result = session.execute(character_rows.select()).all()
+    fetched = time.perf_counter()
+    items = character_rows.rows(result)
+    body = dumps({"characters": items, "total": len(items), "skip": 0, "limit": len(items)})
+    return fetched - start, time.perf_counter() - fetched, body
+
+
+def _best(run, repeat: int) -> tuple:
+    results = [run() for _ in range(repeat)]
+    return min(r[0] for r in results), min(r[1] for r in results), results[-1][2]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    field = create_response_field(name="response", type_=CharacterListResponse)
+    loop = asyncio.new_event_loop()
+    with Session(engine) as session:
+        _populate(session, args.rows)
+        session.expunge_all()
+        orm = _best(lambda: _orm_path(session, field, loop), args.repeat)
+        rows = _best(lambda: _row_path(session), args.repeat)
+    loop.close()
+
+    assert json.loads(orm[2]) == json.loads(rows[2]), "serializers disagree"
+    scale = 1000 / args.rows * 1000
+    print(f"{args.rows} characters, best of {args.repeat}, ms per 1,000 rows")
+    print(f"{'path':>14}{'fetch':>10}{'serialize':>12}{'total':>10}{'bytes':>10}")
+    for name, (fetch, serialize, body) in (("orm+pydantic", orm), ("rows+orjson", rows)):
+        print(f"{name:>14}{fetch * scale:>10.2f}{serialize * scale:>12.2f}"
+              f"{(fetch + serialize) * scale:>10.2f}{len(body):>10}")
+
+
+if __name__ == "__main__":
+    main()
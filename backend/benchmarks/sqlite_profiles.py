@@ -0,0 +1,121 @@
+"""
+Benchmark chat write/read throughput across SQLite performance profiles
+
+Usage:
+    python -m benchmarks.sqlite_profiles [--writers 8] [--readers 8] [--seconds 5]
+
+Each profile gets a fresh database file. Writers insert chats in short
+transactions while readers page through recent history, mirroring the
+send_chat / get_chats mix. Lock errors are counted instead of aborting.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app.database import SQLITE_PROFILES, get_engine_kwargs, install_sqlite_profile
+from app.models import Base, Chat, Character, User
+
+
+async def _seed(session_factory) -> None:
+    async with session_factory() as db:
+        db.add(User(user_id=1, username="bench", email="bench@example.com", password_hash="x"))
+        db.add(
+            Character(
+                character_id=1,
+                name="bench",
+                gender="female",
+                intro="bench",
+                personality_tags=["a"],
+                interest_tags=["b"],
+                prompt="bench",
+                created_by=1,
+            )
+        )
+        await db.commit()
+
+
+async def _writer(session_factory, deadline: float, stats: dict) -> None:
+    while time.perf_counter() < deadline:
+        try:
+            async with session_factory() as db:
+                db.add(Chat(user_id=1, character_id=1, role="user", content="hello"))
+                db.add(Chat(user_id=1, character_id=1, role="assistant", content="hi", token_cost=10))
+                await db.commit()
+            stats["writes"] += 1
+        except OperationalError:
+            stats["lock_errors"] += 1
+
+
+async def _reader(session_factory, deadline: float, stats: dict) -> None:
+    query = (
+        select(Chat)
+        .where(Chat.user_id == 1, Chat.character_id == 1)
+        .order_by(Chat.created_at.desc())
+        .limit(20)
+    )
+    while time.perf_counter() < deadline:
+        try:
+            async with session_factory() as db:
+                (await db.execute(query)).scalars().all()
+            stats["reads"] += 1
+        except OperationalError:
+            stats["lock_errors"] += 1
+
+
+async def run_profile(profile: str, writers: int, readers: int, seconds: float) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}"
+        kwargs = get_engine_kwargs(url)
+        kwargs["echo"] = False
+        engine = create_async_engine(url, **kwargs)
+        install_sqlite_profile(engine, profile)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            journal_mode = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+        await _seed(session_factory)
+
+        stats = {"writes": 0, "reads": 0, "lock_errors": 0}
+        deadline = time.perf_counter() + seconds
+        await asyncio.gather(
+            *[_writer(session_factory, deadline, stats) for _ in range(writers)],
+            *[_reader(session_factory, deadline, stats) for _ in range(readers)],
+        )
+        await engine.dispose()
+
+    return {
+        "profile": profile,
+        "journal_mode": journal_mode,
+        "writes_per_s": stats["writes"] / seconds,
+        "reads_per_s": stats["reads"] / seconds,
+        "lock_errors": stats["lock_errors"],
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--profiles", nargs="*", default=list(SQLITE_PROFILES))
+    args = parser.parse_args()
+
+    print(f"{'profile':<12}{'journal':<10}{'writes/s':>12}{'reads/s':>12}{'lock errors':>14}")
+    for profile in args.profiles:
+        result = await run_profile(profile, args.writers, args.readers, args.seconds)
+        print(
+            f"{result['profile']:<12}{result['journal_mode']:<10}"
+            f"{result['writes_per_s']:>12.1f}{result['reads_per_s']:>12.1f}"
+            f"{result['lock_errors']:>14}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+"""
+Benchmark cold start: import time and time to the first healthy response
+
+Usage:
+    python -m benchmarks.startup [--repeat 3] [--top 10]
+                                 [--max-import-ms 3000] [--max-ready-ms 6000]
+
+Each run starts a fresh interpreter. The import phase runs
+``python -X importtime -c "import app.main"`` and reports the cumulative
+time of ``app.main`` plus the modules with the largest self time. The
+ready phase starts uvicorn on a free port against an empty SQLite
+database in a temporary directory and polls ``/health`` until it answers
+200, which includes the imports, the schema check and startup events.
+With the thresholds set the script exits non-zero when the best run is
+slower, so CI notices regressions.
+"""
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List, Tuple
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| *(\S+)")
+
+
+def _environment(tmp: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'startup.db')}",
+        RATE_LIMIT_STORAGE="memory",
+        LOG_FILE="",
+        DEBUG="false",
+        AVATAR_STORAGE_DIR=os.path.join(tmp, "avatars"),
+    )
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    return env
+
+
+def _import_run(env: Dict[str, str]) -> Tuple[float, List[Tuple[float, str]]]:
+    """Cumulative ms of app.main and (self ms, module) of every module"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    total, modules = 0.0, []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, name = match.groups()
+        modules.append((int(self_us) / 1000, name))
+        if name == "app.main":
+            total = int(cumulative_us) / 1000
+    return total, modules
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _ready_run(env: Dict[str, str], timeout: float) -> float:
+    """Milliseconds from spawning uvicorn to the first 200 from /health"""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited during startup:\n{server.stderr.read().decode()}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - start) * 1000
+            except OSError:
+                pass
+            time.sleep(0.005)
+        raise RuntimeError(f"/health did not answer within {timeout:.0f}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="modules to list by self time")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for /health")
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    parser.add_argument("--max-ready-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    imports, ready = [], []
+    for _ in range(args.repeat):
+        # A new database per run: every start is a first start
+        with tempfile.TemporaryDirectory() as tmp:
+            env = _environment(tmp)
+            imports.append(_import_run(env))
+            ready.append(_ready_run(env, args.timeout))
+
+    import_ms, modules = min(imports, key=lambda run: run[0])
+    ready_ms = min(ready)
+    print(f"best of {args.repeat} runs")
+    print(f"{'import app.main':<24}{import_ms:>10.0f} ms")
+    print(f"{'first healthy response':<24}{ready_ms:>10.0f} ms")
+    print(f"\nlargest self import times ({len(modules)} modules)")
+    for self_ms, name in sorted(modules, reverse=True)[:args.top]:
+        print(f"{name:<48}{self_ms:>8.1f} ms")
+
+    failures = []
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        failures.append(f"import took {import_ms:.0f} ms (limit {args.max_import_ms:.0f} ms)")
+    if args.max_ready_ms is not None and ready_ms > args.max_ready_ms:
+        failures.append(f"first healthy response took {ready_ms:.0f} ms (limit {args.max_ready_ms:.0f} ms)")
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Gunicorn hooks, picked up from the working directory by gunicorn and by
+``python -m app.serve`` (which sets the server options, see app/serve.py)
+
+Prometheus multiprocess mode: each worker writes its metrics to files in
+PROMETHEUS_MULTIPROC_DIR and /metrics merges them, so a scrape reports the
+whole server no matter which worker answers it. The variable has to be set
+before the workers import the app, which is why it is set here.
+
+With --preload the master imports the app once and the workers are forked
+from it: imports are paid once and the code pages are shared. Module state
+that must not cross fork() (logging and trace threads, the rate limit
+store's SQLite connection) is recreated per process; the database pools are
+reset in post_fork.
+"""
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "lionrocket-metrics")
+)
+# With --preload the app, and with it the master's metric files, is loaded before on_starting
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+
+def on_starting(server):
+    # Files left by a previous run would be merged into the new counters
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from app.core.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        # Import the Anthropic SDK once in the master instead of in every worker
+        from app.services.claude_service import claude_service
+
+        claude_service.warm_up()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from app.database import reset_pools_after_fork
+        from app.sharding import shard_router
+
+        reset_pools_after_fork(*(shard_router.engines if shard_router is not None else ()))
@@ -0,0 +1,183 @@
+"""Avatar blob reference counts: acquire/release, set_avatar under concurrency, collection"""
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database import create_session_factory, get_engine_kwargs, install_sqlite_profile
+from app.models import AvatarBlob, Base, Character, User
+from app.services.avatar_storage import COLLECTING, AvatarStorage
+from app.services.image_processing import avatar_filename
+
+
+def content_key(name: str) -> str:
+    return hashlib.sha256(name.encode()).hexdigest()
+
+
+SHARED, FIRST, SECOND = content_key("shared"), content_key("first"), content_key("second")
+
+
+@pytest_asyncio.fixture
+async def session_factory(tmp_path):
+    # A single writer connection, as with split SQLite pools
+    url = f"sqlite+aiosqlite:///{tmp_path / 'avatars.db'}"
+    engine = create_async_engine(url, **get_engine_kwargs(url, pool_size=1, max_overflow=0))
+    install_sqlite_profile(engine)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+    factory = create_session_factory(engine)
+    async with factory() as db:
+        db.add(User(user_id=1, username="owner", email="owner@example.com", password_hash="x"))
+        for character_id in (1, 2):
+            db.add(Character(
+                character_id=character_id, name=f"character{character_id}", gender="female",
+                intro="intro", personality_tags=[], interest_tags=[], prompt="prompt",
+                created_by=1, avatar_url=SHARED,
+            ))
+        db.add(AvatarBlob(content_hash=SHARED, ref_count=2))
+        await db.commit()
+    yield factory
+    await engine.dispose()
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return AvatarStorage(tmp_path / "avatars")
+
+
+async def ref_counts(session_factory) -> dict:
+    async with session_factory() as db:
+        rows = await db.execute(select(AvatarBlob.content_hash, AvatarBlob.ref_count))
+        return dict(rows.all())
+
+
+async def avatar_urls(session_factory) -> dict:
+    async with session_factory() as db:
+        rows = await db.execute(select(Character.character_id, Character.avatar_url))
+        return dict(rows.all())
+
+
+async def acquire(session_factory, storage, key: str) -> None:
+    async with session_factory() as db:
+        await storage.acquire(db, key)
+        await db.commit()
+
+
+async def set_avatar(session_factory, storage, character_id: int, key):
+    async with session_factory() as db:
+        previous = await storage.set_avatar(db, character_id, key)
+        await db.commit()
+        return previous
+
+
+@pytest.mark.asyncio
+async def test_acquire_and_release(session_factory, storage):
+    await acquire(session_factory, storage, FIRST)
+    await acquire(session_factory, storage, FIRST)
+    async with session_factory() as db:
+        await storage.release(db, FIRST)
+        # Legacy file names are not counted
+        await storage.release(db, "character_1_avatar")
+        await db.commit()
+    assert (await ref_counts(session_factory))[FIRST] == 1
+
+
+@pytest.mark.asyncio
+async def test_set_avatar_moves_the_reference(session_factory, storage):
+    await acquire(session_factory, storage, FIRST)
+    assert await set_avatar(session_factory, storage, 1, FIRST) == SHARED
+    assert await ref_counts(session_factory) == {SHARED: 1, FIRST: 1}
+
+    # The same image again keeps one reference
+    await acquire(session_factory, storage, FIRST)
+    assert await set_avatar(session_factory, storage, 1, FIRST) == FIRST
+    assert await ref_counts(session_factory) == {SHARED: 1, FIRST: 1}
+
+    assert await set_avatar(session_factory, storage, 1, None) == FIRST
+    assert await set_avatar(session_factory, storage, 1, None) is None
+    assert await ref_counts(session_factory) == {SHARED: 1, FIRST: 0}
+    assert await avatar_urls(session_factory) == {1: None, 2: SHARED}
+
+
+@pytest.mark.asyncio
+async def test_set_avatar_of_missing_character(session_factory, storage):
+    async with session_factory() as db:
+        with pytest.raises(HTTPException) as exc_info:
+            await storage.set_avatar(db, 99, FIRST)
+    assert exc_info.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_concurrent_uploads_release_the_shared_blob_once(session_factory, storage):
+    # Both uploads take their reference before either swaps avatar_url
+    await acquire(session_factory, storage, FIRST)
+    await acquire(session_factory, storage, SECOND)
+    await set_avatar(session_factory, storage, 1, SECOND)
+    await set_avatar(session_factory, storage, 1, FIRST)
+
+    # Character 2 still uses the shared blob; the replaced upload is unreferenced
+    assert await avatar_urls(session_factory) == {1: FIRST, 2: SHARED}
+    assert await ref_counts(session_factory) == {SHARED: 1, FIRST: 1, SECOND: 0}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_upload_and_delete(session_factory, storage):
+    async def upload(key: str) -> None:
+        await acquire(session_factory, storage, key)
+        await asyncio.sleep(0)  # transcoding
+        await set_avatar(session_factory, storage, 1, key)
+
+    await asyncio.gather(upload(FIRST), upload(SECOND), set_avatar(session_factory, storage, 1, None))
+
+    counts = await ref_counts(session_factory)
+    current = (await avatar_urls(session_factory))[1]
+    assert counts[SHARED] == 1
+    # Exactly the blob character 1 ends up with is referenced
+    assert {key: counts[key] for key in (FIRST, SECOND)} == {
+        key: int(key == current) for key in (FIRST, SECOND)
+    }
+
+
+@pytest.mark.asyncio
+async def test_collect_garbage_removes_unreferenced_blobs(session_factory, storage):
+    await acquire(session_factory, storage, FIRST)
+    for key in (SHARED, FIRST):
+        directory = storage.blob_dir(key)
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / avatar_filename(key)).write_bytes(b"webp")
+
+    # Character 1 moves to FIRST, character 2 drops its avatar: SHARED is unreferenced
+    await set_avatar(session_factory, storage, 1, FIRST)
+    await set_avatar(session_factory, storage, 2, None)
+
+    # Within the grace period nothing is removed
+    assert await storage.collect_garbage(session_factory, grace_seconds=3600, batch_size=10) == []
+
+    async with session_factory() as db:
+        await db.execute(
+            update(AvatarBlob).values(released_at=datetime.utcnow() - timedelta(hours=2))
+        )
+        await db.commit()
+    assert await storage.collect_garbage(session_factory, grace_seconds=3600, batch_size=10) == [SHARED]
+    assert await ref_counts(session_factory) == {FIRST: 1}
+    assert not storage.has_blob(SHARED)
+    assert storage.has_blob(FIRST)
+
+
+@pytest.mark.asyncio
+async def test_acquire_refuses_a_blob_being_collected(session_factory, storage):
+    async with session_factory() as db:
+        await db.execute(update(AvatarBlob).values(ref_count=COLLECTING))
+        await db.commit()
+
+    async with session_factory() as db:
+        with pytest.raises(HTTPException) as exc_info:
+            await storage.acquire(db, SHARED)
+    assert exc_info.value.status_code == 503
+    assert (await ref_counts(session_factory))[SHARED] == COLLECTING
@@ -0,0 +1,129 @@
+"""Rate limit storage backends: token bucket refill, sliding windows, SQLite fail-open"""
+import sqlite3
+import time
+
+import pytest
+
+from app.middleware import rate_limit_store
+from app.middleware.rate_limit_store import (
+    MemoryRateLimitStore,
+    SlidingWindowRateLimitStore,
+    SQLiteRateLimitStore,
+)
+
+
+class FakeClock:
+    """Stands in for the ``time`` module of rate_limit_store"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit_store, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def bucket_store(request, tmp_path):
+    if request.param == "memory":
+        store = MemoryRateLimitStore()
+    else:
+        store = SQLiteRateLimitStore(str(tmp_path / "rate_limit.db"))
+    yield store
+    store.close()
+
+
+def test_bucket_allows_limit_then_rejects(clock, bucket_store):
+    for _ in range(3):
+        assert bucket_store.hit("user:1", 3, 60) == 0
+    # One token comes back every 20 seconds
+    assert bucket_store.hit("user:1", 3, 60) == pytest.approx(20)
+    # Other keys have their own bucket
+    assert bucket_store.hit("user:2", 3, 60) == 0
+
+
+def test_bucket_refills_over_period(clock, bucket_store):
+    for _ in range(3):
+        bucket_store.hit("user:1", 3, 60)
+
+    clock.advance(10)
+    assert bucket_store.hit("user:1", 3, 60) == pytest.approx(10)
+    clock.advance(10)
+    assert bucket_store.hit("user:1", 3, 60) == 0
+    assert bucket_store.hit("user:1", 3, 60) > 0
+
+    # Refilling stops at the limit
+    clock.advance(600)
+    for _ in range(3):
+        assert bucket_store.hit("user:1", 3, 60) == 0
+    assert bucket_store.hit("user:1", 3, 60) > 0
+
+
+def test_sliding_window_frees_oldest_slot(clock):
+    store = SlidingWindowRateLimitStore(slots=6)
+    assert store.hit("admin_1:read", 2, 60) == 0
+    clock.advance(10)
+    assert store.hit("admin_1:read", 2, 60) == 0
+    # Full until the first slot leaves the 60 second window
+    retry_after = store.hit("admin_1:read", 2, 60)
+    assert 0 < retry_after <= 50
+
+    clock.advance(retry_after)
+    assert store.hit("admin_1:read", 2, 60) == 0
+    assert store.hit("admin_1:read", 2, 60) > 0
+
+
+def test_memory_store_caps_keys(clock):
+    store = MemoryRateLimitStore(maxsize=10)
+    for index in range(100):
+        store.hit(f"ip:{index}", 5, 60)
+    assert len(store) <= 12
+
+
+def test_sqlite_store_shares_buckets_between_connections(tmp_path):
+    path = str(tmp_path / "rate_limit.db")
+    first, second = SQLiteRateLimitStore(path), SQLiteRateLimitStore(path)
+    try:
+        assert first.hit("user:1", 2, 60) == 0
+        assert second.hit("user:1", 2, 60) == 0
+        assert first.hit("user:1", 2, 60) > 0
+        assert len(second) == 1
+    finally:
+        first.close()
+        second.close()
+
+
+def test_sqlite_store_fails_open_when_locked(tmp_path):
+    path = str(tmp_path / "rate_limit.db")
+    store = SQLiteRateLimitStore(path)
+    try:
+        assert store.hit("user:1", 1, 60) == 0
+        assert store.hit("user:1", 1, 60) > 0
+
+        # Another process holds the write lock
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            started = time.perf_counter()
+            assert store.hit("user:1", 1, 60) == 0
+            # Allowed after about busy_timeout_ms instead of stalling the event loop
+            assert time.perf_counter() - started < 0.05
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+
+        assert store.hit("user:1", 1, 60) > 0
+    finally:
+        store.close()
@@ -0,0 +1,59 @@
+"""Bounded executors: 429 beyond the queue, 503 and a new pool after a worker dies"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.workers import BoundedExecutor
+
+
+def _thread_pool(workers: int) -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+@pytest.mark.asyncio
+async def test_rejects_calls_beyond_workers_and_queue():
+    pool = BoundedExecutor(_thread_pool, workers=1, queue_size=1, busy_detail="busy", retry_after=3)
+    release = threading.Event()
+    try:
+        running = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert pool.pending == 2
+
+        with pytest.raises(HTTPException) as exc_info:
+            await pool.run(release.wait)
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.headers == {"Retry-After": "3"}
+        assert pool.rejected == 1
+
+        release.set()
+        await asyncio.gather(*running)
+        assert pool.pending == 0
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_replaces_a_broken_process_pool():
+    pool = BoundedExecutor(_process_pool, workers=1, queue_size=1, busy_detail="busy")
+    try:
+        first = await pool.run(os.getpid)
+
+        # The child exits abruptly, as when it is OOM-killed
+        with pytest.raises(HTTPException) as exc_info:
+            await pool.run(os._exit, 1)
+        assert exc_info.value.status_code == 503
+        assert pool.pending == 0
+
+        assert await pool.run(os.getpid) not in (first, os.getpid())
+    finally:
+        pool.shutdown()